@@ -1,14 +1,34 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 #Written by Reid McIlroy-Young
+"""
+Count where authors are: for every author of every paper, write a CSV row
+of (paper, date, subjects, reprint author and country, author and country).
 
+Files are read with isiparse and processed in parallel, each worker writing
+its own CSV shard, and the shards are concatenated into the output at the end.
+
+With --aggregate, instead of one row per author, write one row per
+(year, subject, country) with the number of author-papers there,
+which is what most analyses end up computing from the long form anyway.
+
+usage: python CountryCounts.py [--overwrite] [--aggregate] [file.isi ...]
+(with no files, reads every .isi file in the current directory)
+
+A file that can't be read (malformed, truncated) doesn't stop the run:
+what was read of it is kept, and it is reported at the end.
+"""
 
-import papers
 import os
 import csv
 import sys
-import IPython
+import shutil
+from collections import Counter
+
+import isiparse
+from util import parallel_map
 
 csvHeader = ['Paper ID', 'Date', 'Subjects', 'RP-Author', 'RP-Country', 'Author', 'Author-Country']
+aggregateHeader = ['Year', 'Subject', 'Country', 'Authors']
 
 outfile = "LocationCounts.csv"
 
@@ -22,212 +42,216 @@ FileSuffix = '.isi'
 class BadPaper(Warning):
     pass
 
-def paperParser(paper):
-    """
-    paperParser reads paper until it reaches 'EF' for each field tag it adds an
-    entry to the returned dict with the tag as the key and a list of the entries
-    for the tag as the value, the list has each line as an entry.   
-    """
-    tdict = {}
-    currentTag = ''
-    for l in paper:
-        if 'ER' in l[:2]:
-            return tdict
-        elif '   ' in l[:3]: #the string is three spaces in row
-            tdict[currentTag].append(l[3:-1])
-        elif l[2] == ' ':
-            currentTag = l[:2]
-            tdict[currentTag] = [l[3:-1]]
-        else:
-            raise BadPaper("Field tag not formed correctly: " + l)
-    raise BadPaper("End of file reached before EF")
-
-def isiParser(isifile):
-    """
-    isiParser reads a file, checks that the header is correct then reads each
-    paper returning a list of of dicts keyed with the field tags.
-    """
-    f = open(isifile, 'r')
-    if "VR 1.0" not in f.readline() and "VR 1.0" not in f.readline():
-        raise BadPaper(isifile + " Does not have a valid header")
-    notEnd = True
-    plst = []
-    while notEnd:
-        l = f.next()
-        if not l:
-            raise BadPaper("No ER found in " + isifile)
-        elif l.isspace():
-            continue
-        elif 'EF' in l[:2]:
-            notEnd = False
-            continue
-        else:
-            try:
-                if l[:2] != 'PT':
-                    raise BadPaper("Paper does not start with PT tag")
-                plst.append(paperParser(f))
-                plst[-1][l[:2]] = l[3:-1]
-            except Warning as w:
-                raise BadPaper(str(w.message) + "In " + isifile)
-            except Exception as e:
-                 raise e
-    try:
-        f.next()
-        print "EF not at end of " + isifile
-    except StopIteration as e:
-        pass
-    finally:
-        return plst
-
 def mapAuthorsInstitute(s):
     """
-    mapAuthorsInstitute takes in a author location string and returns a dict of
-    the authors and their locations. The location will be the same for all.
+    mapAuthorsInstitute takes in a author location string and returns a list of
+    (author, location) pairs. The location will be the same for all.
     """
     ls = s[1:].split(']', 1)
-    if len(ls) == 0:
+    if len(ls) < 2:
         raise IndexError
     authors = ls[0].split('; ')
     institute = ls[1]
-    return zip(authors, [institute * len(authors)])
+    return zip(authors, [institute] * len(authors))
 
-def americaIsSpecial(s):
+def authorLocations(p):
     """
-    USA country format is unique this deals with it
+    authorLocations takes in a parsed paper and returns a list of row dicts, one per author,
+    with the stuff in csvHeader.
+    Most of the function deals with isi's inconsistencies, as such the validity
+    of locations in particular is less than ideal
+    Raises BadPaper if the paper is missing something it needs.
     """
-    if s[-4:-1] == 'USA':
-        return 'USA'
+    pdict = {}
+    if 'UT' in p:
+        pdict[csvHeader[0]] = p['UT']
+    else:
+        raise BadPaper("WOS number error, no field")
+    if 'PY' in p:
+        pdict[csvHeader[1]] = p['PY']
+    else:
+        raise BadPaper("Year error, no field: " + p['UT'])
+    if 'PD' in p:
+        pdict[csvHeader[1]] += ' ' + p['PD'][:3]
+    if SubjectTag in p:
+        pdict[csvHeader[2]] = "; ".join(p[SubjectTag])
+    else:
+        raise BadPaper(SubjectTag + " error, no field: " + p['UT'])
+    if 'RP' in p:
+        rp = p['RP'].split(',')
+        if len(rp) < 2:
+            raise BadPaper("Reprint address error, no author name: " + p['UT'])
+        pdict[csvHeader[3]] = rp[0] + ',' + rp[1].replace(" (reprint author)", "")
+        pdict[csvHeader[4]] = isiparse.address_country(p['RP'])
+    elif p.get('AF') and p.get('C1'):
+        pdict[csvHeader[3]] = p['AF'][0]
+        pdict[csvHeader[4]] = isiparse.address_country(p['C1'][0])
     else:
-        return s[1:-1]
+        raise BadPaper("No Locations found in: " + p['UT'])
+    if 'AF' not in p:
+        raise BadPaper("Author names error, no field: " + p['UT'])
+    if 'C1' not in p:
+        raise BadPaper("Author Address error, no field: " + p['UT'])
+    if not p['C1'] or not p['C1'][0]:
+        raise BadPaper("Author Address error, empty field: " + p['UT'])
+
+    rows = []
+    if p['C1'][0][0] != '[':
+        # old style addresses: one per author, in order (or just one for everybody)
+        for i, auth in enumerate(p['AF']):
+            inloc = p['C1'][i] if i < len(p['C1']) else p['C1'][0]
+            rows.append(dict(pdict, **{csvHeader[5]: auth, csvHeader[6]: isiparse.address_country(inloc)}))
+    else:
+        # new style addresses: "[Author One; Author Two] Institution, ..., Country."
+        condict = {}
+        for con in p['C1']:
+            try:
+                condict.update(mapAuthorsInstitute(con))
+            except IndexError:
+                if WarningPrinting:
+                    print("Institute list wonky potential error in: " + p['UT'])
+        for auth in p['AF']:
+            inloc = condict.get(auth, p['C1'][0])
+            rows.append(dict(pdict, **{csvHeader[5]: auth, csvHeader[6]: isiparse.address_country(inloc)}))
+    return rows
 
 def csvLocCounter(plst, csvf):
     """
-    csvLocCounter takes in a parsed paper list and a csv file to write, for each 
+    csvLocCounter takes in an iterable of parsed papers and a csv.DictWriter to write, for each
     author in each paper it writes a row in the csv file.
-    The row contains the stuff in csvHeader.
-    Most of the function deals with isi's inconsistencies, as such the validity
-    of locations in particular is less than ideal
     csvLocCounter returns the number of imperfect records it found and could not
     deal with.
     """
-    pdict = {}
     ec = 0
     for p in plst:
         try:
-            if 'UT' in p:
-                pdict[csvHeader[0]] = p['UT'][0]
-            else:
-                if ErrorPrinting:
-                    print "WOS number error, no field:",
-                raise Warning
-            if 'PY' in p:
-                pdict[csvHeader[1]] = p['PY'][0]
-            else:
-                if ErrorPrinting:
-                    print "Year error, no field:",
-                    print p['UT'][0]
-                raise Warning
-            if 'PD' in p:
-                pdict[csvHeader[1]] += ' ' + p['PD'][0][:3]
-            if SubjectTag in p:
-                pdict[csvHeader[2]] = p[SubjectTag][0]
-            else:
-                if ErrorPrinting:
-                    print SubjectTag + " error, no year field:",
-                    print p['UT'][0]
-                raise Warning
-            if 'RP' in p:
-                rp = p['RP'][0].split(',')
-                pdict[csvHeader[3]] = rp[0] + ',' + rp[1][:-17]
-                pdict[csvHeader[4]] = americaIsSpecial(rp[-1])
-            else:
-                if 'AF' and 'C1' in p:
-                    pdict[csvHeader[3]] = p['AF'][0]
-                    pdict[csvHeader[4]] = americaIsSpecial(p['C1'][0].split(', ')[-1])
-                else:
-                    if ErrorPrinting:
-                        print "No Locations found in:",
-                        print p['UT'][0]
-                    raise Warning
-            if 'AF' in p:
-                if 'C1' in p:
-                    if p['C1'][0][0] != '[':
-                        for i in range(0, len(p['AF'])):
-                            try:
-                                pdict[csvHeader[5]] = p['AF'][i]
-                            except KeyError as e:
-                                if ErrorPrinting:
-                                    print "Authors error no author list:",
-                                    print p['UT'][0]
-                            if i >= len(p['C1']):
-                                inloc = p['C1'][0]
-                            else:
-                                inloc = p['C1'][i]
-                            pdict[csvHeader[6]] = americaIsSpecial(inloc.split(', ')[-1])
-                            csvf.writerow(pdict)                    
-                    else:
-                        condict = {}
-                        for con in p['C1']:
-                            try:
-                                condict.update(mapAuthorsInstitute(con))
-                            except IndexError as e:
-                                if WarningPrinting:
-                                  print "Institute list wonky potential error in:",
-                                  print p['UT'][0]
-                        for auth in p['AF']:
-                            pdict[csvHeader[5]] = auth
-                            if auth in condict:
-                                inloc = condict[auth]
-                            else:
-                                inloc = p['C1'][0]
-                            pdict[csvHeader[6]] = americaIsSpecial(inloc.split(',')[-1])
-                            csvf.writerow(pdict)
-                else:
-                    if ErrorPrinting:
-                        print "Author Address error, no field:",
-                        print p['UT'][0]
-                    raise Warning
-            else:
-                if ErrorPrinting:
-                    print "Author names error, no field:",
-                    print p['UT'][0]
-                raise Warning
-        except Warning as w:
-            ec +=1
+            csvf.writerows(authorLocations(p))
+        except BadPaper as w:
+            if ErrorPrinting:
+                print(w)
+            ec += 1
     return ec
 
+def aggregateLocCounter(plst, counts):
+    """
+    like csvLocCounter(), but instead of writing rows it adds them up in counts,
+    a Counter of (year, subject, country). Papers with several subjects count once under each.
+    returns the number of imperfect records.
+    """
+    ec = 0
+    for p in plst:
+        try:
+            rows = authorLocations(p)
+        except BadPaper as w:
+            if ErrorPrinting:
+                print(w)
+            ec += 1
+            continue
+        for row in rows:
+            for subject in p[SubjectTag]:
+                counts[(p['PY'], subject, row[csvHeader[6]])] += 1
+    return ec
+
+UnreadableFile = (isiparse.ISIFormatError, OSError, UnicodeDecodeError)
+
+def readable(plst, failures):
+    """
+    the papers of plst up to the first one that can't be parsed; the error that stopped it, if any, is appended to failures.
+    This way a truncated file still has what was read of it counted, instead of taking everything else down with it.
+    """
+    try:
+        for p in plst:
+            yield p
+    except UnreadableFile as e:
+        failures.append(e)
+
+def countFile(job):
+    """
+    worker: process one file. job is (isi file name, shard file name or None for aggregate mode)
+    returns (errors, counts, failure), where counts is a Counter in aggregate mode and None otherwise,
+    and failure is None, or a message saying why the file couldn't be read (to the end)
+    """
+    isi, shard = job
+    if ErrorPrinting:
+        print("Reading " + isi)
+    failures = []
+    counts = Counter() if shard is None else None
+    csvf = open(shard, 'w', newline='') if shard is not None else None #always make the shard, so there is one to concatenate
+    try:
+        with isiparse.reader(isi) as plst:
+            if shard is None:
+                ec = aggregateLocCounter(readable(plst, failures), counts)
+            else:
+                ec = csvLocCounter(readable(plst, failures), csv.DictWriter(csvf, csvHeader, quotechar='"', quoting=csv.QUOTE_ALL))
+    except UnreadableFile as e:
+        ec = 0
+        failures.append(e)
+    finally:
+        if csvf is not None:
+            csvf.close()
+    failure = "%s: %s" % (type(failures[0]).__name__, failures[0]) if failures else None
+    if failure and ErrorPrinting:
+        print("Could not read " + isi + ": " + failure)
+    return ec, counts, failure
+
 if __name__ == '__main__':
-    if os.path.isfile(outfile):
+    import argparse
+    ap = argparse.ArgumentParser(description="Count author locations in ISI files.")
+    ap.add_argument('files', nargs="*", help="ISI files (default: every " + FileSuffix + " file in the current directory)")
+    ap.add_argument('-o', '--outfile', default=outfile, help="CSV file to write (default: %(default)s)")
+    ap.add_argument('--overwrite', action="store_true", help="replace the output file if it exists")
+    ap.add_argument('-a', '--aggregate', action="store_true", help="write (year, subject, country) counts instead of one row per author")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    args = ap.parse_args()
+    outfile = args.outfile
+
+    if os.path.isfile(outfile) and not args.overwrite:
         #Checks if the output outfile already exists and terminates if so
-        print outfile +  " already exists\nexisting"
-        sys.exit()
-        #os.remove(outfile)
-    flist = sys.argv[1:] if sys.argv[1:] else [f for f in os.listdir(".") if f.endswith(FileSuffix)]
+        print(outfile + " already exists; use --overwrite to replace it")
+        sys.exit(1)
+    flist = args.files if args.files else sorted(f for f in os.listdir(".") if f.endswith(FileSuffix))
     if len(flist) == 0:
         #checks for any valid files
-        print "No " + FileSuffix + " Files"
+        print("No " + FileSuffix + " Files")
         sys.exit()
     else:
         #Tells how many files were found
-        print "Found " + str(len(flist)) + FileSuffix + "  files"
-    csvOut= csv.DictWriter(open(outfile, 'w'), csvHeader, quotechar='"', quoting=csv.QUOTE_ALL)
-    csvOut.writeheader()
+        print("Found " + str(len(flist)) + " " + FileSuffix + " files")
+
+    shards = [None if args.aggregate else "%s.%04d.part" % (outfile, i) for i in range(len(flist))]
     errorsFound = []
-    for isi in flist:
-            try:
-                if ErrorPrinting:
-                    print "Reading " + isi
-                errorsFound.append((csvLocCounter(isiParser(isi), csvOut), isi))
-            except BadPaper as b:
-                print b
-            except Exception, e:
-                print type(e)
-                print e
+    unreadable = []
+    counts = Counter()
+    for isi, shard, (ec, c, failure) in zip(flist, shards, parallel_map(countFile, list(zip(flist, shards)), args.processes)):
+        errorsFound.append((ec, isi))
+        if failure is not None:
+            unreadable.append((isi, failure))
+        if c is not None:
+            counts.update(c)
+
+    with open(outfile + ".part", 'w', newline='') as out:
+        if args.aggregate:
+            csvOut = csv.writer(out, quotechar='"', quoting=csv.QUOTE_ALL)
+            csvOut.writerow(aggregateHeader)
+            for (year, subject, country), n in sorted(counts.items()):
+                csvOut.writerow([year, subject, country, n])
+        else:
+            csv.writer(out, quotechar='"', quoting=csv.QUOTE_ALL).writerow(csvHeader)
+            for shard in shards:
+                with open(shard, newline='') as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+                os.remove(shard)
+    os.replace(outfile + ".part", outfile)
+
     tot = 0
     for er in errorsFound:
-        print str(er[0]) + " errors found in " + er[1]
+        print(str(er[0]) + " errors found in " + er[1])
         tot += er[0]
-    print str(tot) + " total errors found"
+    print(str(tot) + " total errors found")
+    for isi, failure in unreadable:
+        print("Could not read all of " + isi + ": " + failure)
+    if unreadable:
+        print(str(len(unreadable)) + " files could not be read to the end; what was read of them is counted")
     if not ErrorPrinting:
-        print "turn on ErrorPrinting to see more information"
-    print "Done"
\ No newline at end of file
+        print("turn on ErrorPrinting to see more information")
+    print("Done")
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Author name disambiguation.
+
+ISI names are ambiguous: AU gives "Smith, J", AF gives "Smith, John", and
+neither tells you whether two papers by "Smith, J" are by the same person.
+This works out which author mentions belong together, in the usual way:
+
+ 1. blocking: every mention is filed under its normalized surname + first initial
+    ("smith_j"), and only mentions in the same block are ever compared, which
+    turns an O(n^2) problem over the whole corpus into many small ones;
+ 2. scoring: within a block, pairs of mentions are scored on shared evidence
+    (co-authors, C1 affiliation, EM email, SO journal), and pairs whose full
+    given names contradict each other ("John" vs "James") are never linked;
+    only pairs sharing a co-author, affiliation or email are scored at all
+    (a shared journal only adds to the score: it is too weak to link on its own,
+    and so is an affiliation shared by more than MAX_EVIDENCE mentions);
+ 3. clustering: mentions linked by a high enough score are merged (union-find),
+    and each cluster becomes an author id.
+
+Blocks are resolved in parallel, and the result is written as a tab-separated
+author id table of (author id, UT, position, AU, AF).
+
+Example:
+```
+import authors
+table = authors.disambiguate(["PY=2006-2015_SU=Sociology/"])
+authors.write_table(table, "authors.tsv")
+```
+"""
+
+import sys, os
+import re
+import logging
+import unicodedata
+from functools import lru_cache
+from itertools import combinations
+from collections import namedtuple, defaultdict
+
+import isiparse
+from util import parallel_map
+
+Mention = namedtuple("Mention", "ut position au af block given coauthors affiliations journal emails")
+
+# evidence weights; pairs scoring at least THRESHOLD are linked
+EMAIL, COAUTHOR, AFFILIATION, JOURNAL = 5, 2, 2, 1
+MAX_COAUTHOR = 3 #count at most this many shared coauthors
+MAX_EVIDENCE = 100 #evidence shared by more mentions of a block than this isn't used to find candidate pairs, see resolve_block()
+THRESHOLD = 3
+
+
+@lru_cache(maxsize=1 << 20)
+def _ascii(s):
+    return unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii").lower()
+
+@lru_cache(maxsize=1 << 20)
+def split_name(name):
+    """
+    split an ISI author name into (surname, [given names]), normalized to lower case ASCII.
+    "Smith, John A" -> ("smith", ["john", "a"]); "Smith, JA" -> ("smith", ["j", "a"])
+    """
+    surname, _, given = name.partition(",")
+    surname = re.sub(r"[^a-z]", "", _ascii(surname))
+    given = given.strip()
+    if given.isupper() and " " not in given and len(given) <= 4:
+        words = list(given.lower()) #AU style run-together initials
+    else:
+        words = [w for w in re.split(r"[^a-z]+", _ascii(given)) if w]
+    return surname, words
+
+@lru_cache(maxsize=1 << 20)
+def block_key(name):
+    "the block a name belongs to: surname + first initial"
+    surname, given = split_name(name)
+    return "%s_%s" % (surname, given[0][0] if given else "")
+
+def given_compatible(a, b):
+    """
+    can these two lists of given names belong to the same person?
+    Initials match anything starting with them; full names must match exactly; extra names are fine.
+    """
+    for x, y in zip(a, b):
+        if len(x) > 1 and len(y) > 1:
+            if x != y:
+                return False
+        elif x[0] != y[0]:
+            return False
+    return True
+
+def _most_complete(a, b):
+    "combine two compatible given name lists, keeping the full name over the initial at each position"
+    longer = a if len(a) >= len(b) else b
+    return tuple(max(x, y, key=len) for x, y in zip(a, b)) + tuple(longer[min(len(a), len(b)):])
+
+
+def _affiliations(record):
+    "{normalized AF name: set of institutions} from bracketed C1 lines"
+    found = defaultdict(set)
+    for line in record.get('C1', []):
+        if not line.startswith("["):
+            continue
+        names, _, address = line[1:].partition("]")
+        institution = address.split(",")[0].strip().lower()
+        for name in names.split("; "):
+            found[name.strip()].add(institution)
+    return found
+
+def mentions(record):
+    "every author mention in a record"
+    au = record.get('AU', [])
+    af = record.get('AF', [])
+    if isinstance(au, str): au = [au]
+    if isinstance(af, str): af = [af]
+    if not au and af: au = af
+    blocks = [block_key(a) for a in au]
+    affiliations = _affiliations(record)
+    emails = [e.strip().lower() for e in record.get('EM', "").replace(";", " ").split()]
+    journal = record.get('SO')
+    for i, a in enumerate(au):
+        full = af[i] if i < len(af) else a
+        surname, given = split_name(full)
+        mine = {e for e in emails if surname and surname in _ascii(e.split("@")[0])}
+        yield Mention(record.get('UT'), i, a, full, blocks[i], tuple(given),
+                      frozenset(blocks[:i] + blocks[i+1:]),
+                      frozenset(affiliations.get(full, ())),
+                      journal, frozenset(mine))
+
+
+def score(m, n):
+    "how much evidence there is that two mentions in the same block are the same person; None if they can't be"
+    if not given_compatible(m.given, n.given):
+        return None
+    s = 0
+    if m.emails & n.emails: s += EMAIL
+    s += COAUTHOR * min(len(m.coauthors & n.coauthors), MAX_COAUTHOR)
+    if m.affiliations & n.affiliations: s += AFFILIATION
+    if m.journal and m.journal == n.journal: s += JOURNAL
+    return s
+
+def resolve_block(block):
+    """
+    cluster the mentions of one block. Returns a list of cluster numbers, parallel to the mentions.
+    Candidate pairs come from an inverted index on the evidence, so mentions sharing nothing are never compared.
+    The journal isn't indexed: it is worth less than THRESHOLD, so it never links a pair by itself,
+    and a big block publishing in one journal would make every pair a candidate.
+    For the same reason, evidence shared by more than MAX_EVIDENCE mentions (every "Wang, Y" at one big university)
+    doesn't make candidates either; those pairs can still be linked through their other evidence.
+    """
+    parent = list(range(len(block)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    evidence = defaultdict(list)
+    for i, m in enumerate(block):
+        for e in m.emails: evidence[('EM', e)].append(i)
+        for c in m.coauthors: evidence[('CO', c)].append(i)
+        for a in m.affiliations: evidence[('C1', a)].append(i)
+
+    # the most complete given names seen in each cluster, so that "J" can't glue "John" and "James" together
+    given = [m.given for m in block]
+
+    for group in evidence.values():
+        if len(group) > MAX_EVIDENCE:
+            continue
+        for i, j in combinations(group, 2):
+            ri, rj = find(i), find(j)
+            if ri == rj:
+                continue
+            s = score(block[i], block[j])
+            if s is not None and s >= THRESHOLD and given_compatible(given[ri], given[rj]):
+                parent[rj] = ri
+                given[ri] = _most_complete(given[ri], given[rj])
+
+    roots = {}
+    return [roots.setdefault(find(i), len(roots)) for i in range(len(block))]
+
+def _resolve_batch(batch):
+    "worker: resolve a list of (block key, mentions)"
+    return [(key, resolve_block(block)) for key, block in batch]
+
+
+def disambiguate(paths, processes=None, batch_size=2000):
+    """
+    disambiguate every author mention in a corpus.
+    returns the author id table: a list of (author id, UT, position, AU, AF) tuples,
+    where author ids look like "smith_j.3" (the block key and a cluster number within it).
+    """
+    blocks = defaultdict(list)
+    for fname in isiparse.find_files(paths):
+        logging.info("reading %s" % (fname,))
+        with isiparse.reader(fname) as isi:
+            for record in isi:
+                for m in mentions(record):
+                    blocks[m.block].append(m)
+
+    keys = sorted(blocks)
+    batches = [[(k, blocks[k]) for k in keys[i:i+batch_size]] for i in range(0, len(keys), batch_size)]
+    table = []
+    for batch in parallel_map(_resolve_batch, batches, processes):
+        for key, clusters in batch:
+            for m, c in zip(blocks[key], clusters):
+                table.append(("%s.%d" % (key, c), m.ut, m.position, m.au, m.af))
+    return table
+
+def write_table(table, fname):
+    with open(fname, "w", encoding="utf-8") as out:
+        out.write("author\tUT\tposition\tAU\tAF\n")
+        for row in table:
+            out.write("%s\t%s\t%d\t%s\t%s\n" % row)
+
+def read_table(fname):
+    "inverse of write_table(); returns {(UT, position): author id}"
+    ids = {}
+    with open(fname, encoding="utf-8") as f:
+        next(f)
+        for line in f:
+            author, ut, position, au, af = line.rstrip("\n").split("\t")
+            ids[(ut, int(position))] = author
+    return ids
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Disambiguate author names across ISI files, writing an author id table.")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-o', '--output', default="authors.tsv", help="author id table to write (default: %(default)s)")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    table = disambiguate(args.files, args.processes)
+    write_table(table, args.output)
+    print("%d mentions of %d authors" % (len(table), len({row[0] for row in table})))
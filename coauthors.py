@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Build co-authorship networks from ISI records as sparse matrices.
+
+Records are streamed from isiparse; author names are mapped to integer ids
+as they are first seen, and each paper's author pairs are counted in a hash
+table that is periodically flushed into COO arrays. At the end everything is
+summed into a (symmetric) scipy.sparse CSR matrix, so nothing ever builds a
+networkx graph edge by edge.
+
+Example:
+```
+import coauthors
+B = coauthors.CoauthorBuilder(field='AF', fractional=True, years=range(2007, 2011))
+B.add_files(["PY=2006-2015_SU=Sociology/"])
+M = B.matrix()              # M[i,j] = collaboration strength between B.names[i] and B.names[j]
+```
+
+Counting:
+ - full counting (the default): each paper adds 1 to every pair of its authors
+ - fractional counting (Newman 2001): each paper adds 1/(n-1) to every pair of its n authors,
+   so that each author's total collaboration weight from one paper is 1, however large the paper is.
+"""
+
+import sys, os
+import logging
+from array import array
+from itertools import combinations
+
+import numpy as np
+import scipy.sparse
+
+import isiparse
+
+BIG_PAPER = 30 #papers with more authors than this skip the hash table, see add()
+
+
+class CoauthorBuilder:
+    def __init__(self, field='AU', fractional=False, years=None, by_year=False, max_authors=None, buffer_size=1000000):
+        """
+        field: 'AU' (abbreviated names: "Smith, J") or 'AF' (full names: "Smith, John")
+        fractional: use fractional instead of full counting
+        years: if given, a container of (integer) years; records from other years are skipped
+        by_year: keep a separate matrix per year (all sharing one set of author ids), for time slicing
+        max_authors: skip papers with more authors than this (hyperauthorship papers, e.g. in physics, swamp everything else)
+        buffer_size: how many distinct pairs to aggregate in memory before flushing to the COO arrays
+        """
+        self.field = field
+        self.fractional = fractional
+        self.years = years
+        self.by_year = by_year
+        self.max_authors = max_authors
+        self.buffer_size = buffer_size
+
+        self.ids = {}      # name -> author id
+        self.names = []    # author id -> name
+        self.papers = array('i') # author id -> number of papers
+        self.skipped = 0   # records without authors, years, or with too many authors
+
+        self._buffers = {}  # slice -> {(i, j): weight}, i < j
+        self._chunks = {}   # slice -> [(rows, cols, data)] of flushed numpy arrays
+        self._chunked = {}  # slice -> number of entries in _chunks[slice]
+        self._compacted = {} # slice -> number of entries left by the last compaction of _chunks[slice]
+
+    def _id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.papers.append(0)
+        return i
+
+    def add(self, record):
+        authors = record.get(self.field)
+        if not authors:
+            self.skipped += 1
+            return
+        year = None
+        if self.years is not None or self.by_year:
+            try:
+                year = isiparse.parse_year(record.get('PY', ""))
+            except (TypeError, isiparse.ISIFormatError):
+                self.skipped += 1
+                return
+            if self.years is not None and year not in self.years:
+                return
+        if isinstance(authors, str):
+            authors = [authors]
+        if self.max_authors is not None and len(authors) > self.max_authors:
+            self.skipped += 1
+            return
+
+        ids = sorted({self._id(a.strip()) for a in authors})
+        for i in ids:
+            self.papers[i] += 1
+        n = len(ids)
+        if n < 2:
+            return
+        w = 1.0 / (n - 1) if self.fractional else 1.0
+        key = year if self.by_year else None
+
+        if n > BIG_PAPER:
+            # a big paper's n(n-1)/2 pairs are mostly unique to it, so hashing them one at a time
+            # is wasted effort: generate them all at once with numpy and append them straight to the COO arrays
+            ids = np.array(ids, dtype=np.int64)
+            r, c = np.triu_indices(n, 1)
+            self._append(key, ids[r], ids[c], np.full(len(r), w))
+            return
+
+        buf = self._buffers.setdefault(key, {})
+        for pair in combinations(ids, 2):
+            buf[pair] = buf.get(pair, 0.0) + w
+        if len(buf) > self.buffer_size:
+            self._flush(key)
+
+    def add_files(self, paths):
+        for fname in isiparse.find_files(paths):
+            logging.info("reading %s" % (fname,))
+            with isiparse.reader(fname) as isi:
+                for record in isi:
+                    self.add(record)
+
+    def _flush(self, key):
+        buf = self._buffers.pop(key, None)
+        if not buf:
+            return
+        pairs = np.fromiter((x for pair in buf for x in pair), dtype=np.int64, count=2 * len(buf)).reshape(-1, 2)
+        data = np.fromiter(buf.values(), dtype=np.float64, count=len(buf))
+        self._append(key, pairs[:, 0], pairs[:, 1], data)
+
+    def _append(self, key, rows, cols, data):
+        chunks = self._chunks.setdefault(key, [])
+        chunks.append((rows, cols, data))
+        self._chunked[key] = self._chunked.get(key, 0) + len(data)
+        # compact only once the chunks have doubled since the last compaction (and are past a floor),
+        # so that each compaction is paid for by as many new entries as it rereads: linear overall
+        if self._chunked[key] > max(4 * self.buffer_size, 2 * self._compacted.get(key, 0)) and len(chunks) > 1:
+            # compact: sum duplicate pairs across chunks, so memory tracks distinct pairs rather than papers
+            m = self._coo(key).tocoo()
+            self._chunks[key] = [(m.row.astype(np.int64), m.col.astype(np.int64), m.data)]
+            self._chunked[key] = self._compacted[key] = m.nnz
+
+    def _coo(self, key):
+        "sum everything flushed for a slice so far into an upper triangular CSR matrix"
+        n = len(self.names)
+        chunks = self._chunks.get(key, [])
+        if not chunks:
+            return scipy.sparse.csr_matrix((n, n))
+        rows = np.concatenate([c[0] for c in chunks])
+        cols = np.concatenate([c[1] for c in chunks])
+        data = np.concatenate([c[2] for c in chunks])
+        return scipy.sparse.coo_matrix((data, (rows, cols)), shape=(n, n)).tocsr() #tocsr() sums duplicates
+
+    def matrix(self, year=None, symmetric=True):
+        """
+        the co-authorship matrix, as a scipy.sparse CSR matrix indexed by author id (see .names).
+        With by_year=True, pass the year you want (see .slices()); otherwise leave year=None.
+        symmetric=False gives just the upper triangle (i < j), which is half the size.
+        """
+        if year is not None and not self.by_year:
+            raise ValueError("matrices were not kept per year; construct with by_year=True")
+        self._flush(year)
+        m = self._coo(year)
+        if symmetric:
+            m = (m + m.T).tocsr()
+        return m
+
+    def slices(self):
+        "the years there are matrices for, when by_year=True"
+        return sorted(k for k in set(self._buffers) | set(self._chunks) if k is not None)
+
+    def save(self, prefix, year=None):
+        """
+        write the matrix to prefix.npz (scipy.sparse.save_npz) and the author names,
+        one per line in id order, to prefix.names.txt
+        """
+        scipy.sparse.save_npz(prefix + ".npz", self.matrix(year))
+        with open(prefix + ".names.txt", "w") as f:
+            for name in self.names:
+                f.write(name + "\n")
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Build a co-authorship matrix from ISI files.")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-o', '--output', default="coauthors", help="output prefix: writes PREFIX.npz and PREFIX.names.txt (and PREFIX.YEAR.npz with --by-year)")
+    ap.add_argument('-f', '--field', default="AU", choices=["AU", "AF"], help="author field to use")
+    ap.add_argument('--fractional', action="store_true", help="use fractional counting")
+    ap.add_argument('-y', '--years', help="only use records from these years, e.g. 2007-2010")
+    ap.add_argument('--by-year', action="store_true", help="write one matrix per year")
+    ap.add_argument('--max-authors', type=int, help="skip papers with more authors than this")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    years = None
+    if args.years:
+        from isishard import parse_years
+        years = parse_years(args.years)
+
+    B = CoauthorBuilder(field=args.field, fractional=args.fractional, years=years, by_year=args.by_year, max_authors=args.max_authors)
+    B.add_files(args.files)
+    if args.by_year:
+        for year in B.slices():
+            B.save("%s.%d" % (args.output, year), year)
+        print("%d authors, %d years" % (len(B.names), len(B.slices())))
+    else:
+        B.save(args.output)
+        print("%d authors, %d co-authoring pairs" % (len(B.names), B.matrix(symmetric=False).nnz))
@@ -0,0 +1,41 @@
+"""
+Shared fixtures for the tests: small ISI exports written on the fly, so the tests need no corpus.
+"""
+
+import pytest
+
+# fields records() gives as lists, and how field-tagged exports spread them over lines
+LINES = ('AU', 'AF', 'C1', 'CR')
+SEMICOLONS = ('DE', 'ID', 'SC', 'WC')
+
+
+def isi_text(records):
+    "the field-tagged export of a list of record dicts (the inverse of isiparse.records())"
+    out = ["FN Thomson Reuters Web of Science", "VR 1.0"]
+    for r in records:
+        r = dict(r)
+        out.append("PT " + r.pop('PT', "J"))
+        for tag, value in r.items():
+            if tag in LINES:
+                out.append("%s %s" % (tag, value[0]))
+                out.extend("   " + v for v in value[1:])
+            elif tag in SEMICOLONS:
+                out.append("%s %s" % (tag, "; ".join(value)))
+            else:
+                lines = value.split("\n")
+                out.append("%s %s" % (tag, lines[0]))
+                out.extend("   " + v for v in lines[1:])
+        out.append("ER")
+        out.append("")
+    out.append("EF")
+    return "\n".join(out) + "\n"
+
+
+@pytest.fixture
+def write_isi(tmp_path):
+    "write_isi(name, records) writes records to tmp_path/name as a field-tagged export and returns its path"
+    def write(name, records):
+        path = tmp_path / name
+        path.write_text(isi_text(records), encoding="utf-8")
+        return str(path)
+    return write
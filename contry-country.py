@@ -1,115 +1,84 @@
-import papers
+"""
+Build a country collaboration graph: countries are nodes, and every pair of
+addresses (C1 lines) on the same paper adds 1 to the weight of the edge between
+their countries. Papers with several addresses in one country give that country
+a self-loop.
+
+Files are counted in parallel, one Counter of country pairs per file, and the
+counters are merged before the graph is streamed out once, to c-c.graphml,
+with graphio (no networkx graph is built).
+
+Countries are named by isiparse.address_country(), e.g. "Canada"; the old version of this script
+labelled them " Canada" (see README), so graphs from before and after don't line up node for node.
+
+usage: python contry-country.py [file.isi ...]
+(with no arguments, reads every .isi file in the current directory)
+"""
+
 import os
-import csv
 import sys
-import networkx as nx
+from collections import Counter
+from itertools import combinations
+
+import isiparse
+import graphio
+from util import parallel_map
 
 outfile = "c-c.graphml"
 
-class BadPaper(Warning):
-    pass
+FileSuffix = '.isi'
 
-def paperParser(paper):
+
+def countryPairs(fname):
     """
-    paperParser reads paper until it reaches 'EF' for each field tag it adds an
-    entry to the returned dict with the tag as the key and a list of the entries
-    for the tag as the value, the list has each line as an entry.   
+    count the country pairs in one ISI file.
+    returns (pairs, countries, missing): a Counter of (country, country) pairs (each sorted, since the graph is undirected),
+    the set of countries seen, and how many records had no C1 field
     """
-    tdict = {}
-    currentTag = ''
-    for l in paper:
-        if 'ER' in l[:2]:
-            return tdict
-        elif '   ' in l[:3]: #the string is three spaces in row
-            tdict[currentTag].append(l[3:-1])
-        elif l[2] == ' ':
-            currentTag = l[:2]
-            tdict[currentTag] = [l[3:-1]]
-        else:
-            raise BadPaper("Field tag not formed correctly: " + l)
-    raise BadPaper("End of file reached before EF")
+    pairs = Counter()
+    countries = set()
+    missing = 0
+    with isiparse.reader(fname) as isi:
+        for p in isi:
+            if 'C1' not in p:
+                missing += 1
+                continue
+            cs = [isiparse.address_country(loc) for loc in p['C1']]
+            countries.update(cs)
+            pairs.update(tuple(sorted(pair)) for pair in combinations(cs, 2))
+    return pairs, countries, missing
 
-def isiParser(isifile):
+def graphAdder(flist, processes=None):
     """
-    isiParser reads a file, checks that the header is correct then reads each
-    paper returning a list of of dicts keyed with the field tags.
+    count country pairs across all of flist, merging the per-file counts
+    returns (pairs, countries, missing) as in countryPairs()
     """
-    f = open(isifile, 'r')
-    if "VR 1.0" not in f.readline() and "VR 1.0" not in f.readline():
-        raise BadPaper(isifile + " Does not have a valid header")
-    notEnd = True
-    plst = []
-    while notEnd:
-        l = f.next()
-        if not l:
-            raise BadPaper("No ER found in " + isifile)
-        elif l.isspace():
-            continue
-        elif 'EF' in l[:2]:
-            notEnd = False
-            continue
-        else:
-            try:
-                if l[:2] != 'PT':
-                    raise BadPaper("Paper does not start with PT tag")
-                plst.append(paperParser(f))
-                plst[-1][l[:2]] = l[3:-1]
-            except Warning as w:
-                raise BadPaper(str(w.message) + "In " + isifile)
-            except Exception as e:
-                 raise e
-    try:
-        f.next()
-        print "EF not at end of " + isifile
-    except StopIteration as e:
-        pass
-    finally:
-        return plst
-
-def graphAdder(plst, grph):
-    for p in plst:
-        try:
-            for loc1 in p['C1']:
-                c1 = loc1.split(',')[-1][:-1]
-                if c1[-3:] == 'USA':
-                    c1 = 'USA'
-                if not grph.has_node(c1):
-                    grph.add_node(c1)
-                for loc2 in p['C1'][p['C1'].index(loc1) + 1:]:
-                    c2 = loc2.split(',')[-1][:-1]
-                    if c2[-3:] == 'USA':
-                        c2 = 'USA'
-                    if grph.has_edge(c1, c2):
-                        print str(c1) + ' - ' + str(c2)
-                        grph[c1][c2]['weight'] += 1
-                    else:
-                        grph.add_edge(c1, c2, weight = 1)
-        except KeyError as e:
-            print "Key Error"
-            print p.keys()
+    pairs = Counter()
+    countries = set()
+    missing = 0
+    for isi, (p, c, m) in zip(flist, parallel_map(countryPairs, flist, processes)):
+        pairs.update(p)
+        countries.update(c)
+        missing += m
+        if m:
+            print(str(m) + " records without addresses in " + isi)
+    return pairs, countries, missing
 
 if __name__ == '__main__':
     if os.path.isfile(outfile):
-        #Checks if the output csv already exists and terminates if so
-        print outfile +  " already exists\nexisting"
-        #sys.exit()
+        print(outfile + " already exists, replacing it")
         os.remove(outfile)
-    flist = [f for f in os.listdir(".") if f.endswith(".isi")]
+    flist = sys.argv[1:] if sys.argv[1:] else sorted(f for f in os.listdir(".") if f.endswith(FileSuffix))
     if len(flist) == 0:
         #checks for any valid files
-        print "No txt Files"
+        print("No " + FileSuffix + " files")
         sys.exit()
     else:
         #Tells how many files were found
-        print "Found " + str(len(flist)) + " txt files"
-    G = nx.Graph()
-    for isi in flist:
-        try:
-            graphAdder(isiParser(isi), G)
-        except Exception, e:
-            print type(e)
-            print isi
-            print e
-            break
-    nx.write_graphml(G, outfile)
-    print "Done"
+        print("Found " + str(len(flist)) + " " + FileSuffix + " files")
+
+    pairs, countries, missing = graphAdder(flist)
+
+    graphio.write_graphml(outfile, sorted(countries), ((c1, c2, w) for (c1, c2), w in pairs.items()), weight_type=int) #counts, as networkx declared them
+    print("%d countries, %d edges" % (len(countries), len(pairs)))
+    print("Done")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Bibliographic coupling and co-citation, as sparse matrix products.
+
+Both come from the paper x reference incidence matrix A (A[p, r] = 1 if paper p cites reference r):
+ - bibliographic coupling: (A Aᵀ)[p, q] = the number of references papers p and q share
+ - co-citation: (Aᵀ A)[r, s] = the number of papers citing both references r and s
+
+References in CR are written inconsistently ("Smith J., 1990, AM J SOCIOL, V95, P1, DOI 10...",
+"SMITH J, 1990, AM J SOCIOL, V95, P1"), so they are matched on a normalized key, see reference_key().
+
+The products are computed a block of rows at a time, blocks in parallel: each
+worker memory-maps the matrix from a scratch folder, multiplies its rows,
+and hands back only the upper-triangle entries at or above the threshold,
+so that neither the dense product nor the sub-threshold pairs are ever held
+in memory at once.
+
+Example:
+```
+import coupling
+A = coupling.incidence(["PY=2006-2015_SU=Sociology/"])
+C = coupling.coupling(A, threshold=2)           # C[i,j] = references shared by A.uts[i] and A.uts[j]
+K, refs = coupling.cocitation(A, threshold=3, min_citations=5)   # K[i,j] = papers citing both refs[i] and refs[j]
+```
+Results are upper triangular scipy.sparse CSR matrices (i < j); add the transpose for the full symmetric matrix.
+"""
+
+import sys, os
+import re
+import logging
+import tempfile
+from shutil import rmtree
+from functools import lru_cache
+
+import numpy as np
+import scipy.sparse
+
+import isiparse
+from util import parallel_map
+
+
+_doi = re.compile(r"(?:^|,)\s*DOI\s+(?:\[[^\]]*\]?|[^,]*)") #a truncated CR can lose the closing bracket
+
+@lru_cache(maxsize=1 << 20)
+def reference_key(cr):
+    """
+    normalize a CR reference, so that the different ways ISI writes the same reference compare equal:
+    upper case, no DOI, no punctuation in the author name, single spaces.
+    "Smith J., 1990, Am J Sociol, V95, P1, DOI 10.1086/229213" -> "SMITH J, 1990, AM J SOCIOL, V95, P1"
+    References with several DOIs list them in brackets, "DOI [10.1086/229213, 10.1086/229214]", commas and all.
+    """
+    cr = _doi.sub("", cr.upper())
+    parts = [re.sub(r"\s+", " ", p).strip() for p in cr.split(",")]
+    parts = [p for p in parts if p]
+    if not parts:
+        return ""
+    parts[0] = re.sub(r"[^A-Z0-9 ]", "", parts[0].lstrip("*")).strip()
+    return ", ".join(parts)
+
+
+class Incidence:
+    "the paper x reference incidence matrix A, as scipy.sparse CSR, with its labels"
+    def __init__(self, A, uts, refs):
+        self.A = A
+        self.uts = uts    # row -> UT
+        self.refs = refs  # column -> reference key
+
+    @property
+    def shape(self):
+        return self.A.shape
+
+    def citations(self):
+        "how many papers cite each reference"
+        return np.bincount(self.A.indices, minlength=len(self.refs))
+
+
+def _incidence_file(fname):
+    "worker: one file's rows of A, with column ids from a vocabulary of references local to this file"
+    refs = {}
+    uts = []
+    indptr, indices = [0], []
+    with isiparse.reader(fname) as isi:
+        for record in isi:
+            cr = record.get('CR', [])
+            if isinstance(cr, str):
+                cr = [cr]
+            cited = {refs.setdefault(k, len(refs)) for k in map(reference_key, cr) if k}
+            indices.extend(sorted(cited))
+            indptr.append(len(indices))
+            uts.append(record.get('UT', ""))
+    return uts, list(refs), np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int32)
+
+def incidence(paths, processes=None):
+    "build the incidence matrix of a corpus, one file per worker process"
+    refs, uts = {}, []
+    indptrs, indices = [], []
+    offset = 0
+    for local_uts, local_refs, indptr, local_indices in parallel_map(_incidence_file, isiparse.find_files(paths), processes):
+        remap = np.array([refs.setdefault(k, len(refs)) for k in local_refs], dtype=np.int32)
+        indptrs.append(indptr[1:] + offset)
+        indices.append(remap[local_indices])
+        offset += len(local_indices)
+        uts.extend(local_uts)
+    indptr = np.concatenate([np.zeros(1, dtype=np.int64)] + indptrs)
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+    A = scipy.sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(len(uts), len(refs)))
+    A.sort_indices()
+    return Incidence(A, uts, list(refs))
+
+
+@lru_cache(maxsize=1)
+def _operands(workdir):
+    "X as CSR (for slicing row blocks) and Xᵀ as CSR (the CSC arrays of X, transposed), memory-mapped"
+    def arrays(name):
+        return tuple(np.load(os.path.join(workdir, "%s.%s.npy" % (name, a)), mmap_mode="r") for a in ("data", "indices", "indptr"))
+    shape = tuple(np.load(os.path.join(workdir, "shape.npy")))
+    X = scipy.sparse.csr_matrix(arrays("csr"), shape=shape)
+    XT = scipy.sparse.csc_matrix(arrays("csc"), shape=shape).T
+    return X, XT
+
+def _gram_block(job):
+    "worker: rows lo:hi of X Xᵀ, keeping only entries with j > i and value >= threshold, as COO arrays"
+    workdir, lo, hi, threshold = job
+    X, XT = _operands(workdir)
+    P = (X[lo:hi] @ XT).tocoo()
+    rows = P.row + lo
+    keep = (P.col > rows) & (P.data >= threshold)
+    return rows[keep].astype(np.int32), P.col[keep].astype(np.int32), P.data[keep].astype(np.int32)
+
+def gram(X, threshold=1, block_size=10000, processes=None, tmpdir=None):
+    """
+    the upper triangle (i < j) of X Xᵀ for a 0/1 sparse matrix X, dropping entries below threshold.
+    Rows are multiplied block_size at a time, blocks in parallel; memory per worker
+    goes with block_size times the number of neighbours per row.
+    """
+    X = scipy.sparse.csr_matrix(X, dtype=np.int32)
+    X.sort_indices()
+    n = X.shape[0]
+    workdir = tempfile.mkdtemp(prefix="gram-", dir=tmpdir)
+    try:
+        np.save(os.path.join(workdir, "shape.npy"), np.array(X.shape))
+        for name, M in (("csr", X), ("csc", X.tocsc())):
+            for a in ("data", "indices", "indptr"):
+                np.save(os.path.join(workdir, "%s.%s.npy" % (name, a)), getattr(M, a))
+        jobs = [(workdir, lo, min(lo + block_size, n), threshold) for lo in range(0, n, block_size)]
+        rows, cols, data = [], [], []
+        for r, c, d in parallel_map(_gram_block, jobs, processes):
+            logging.debug("block: %d entries" % (len(d),))
+            rows.append(r)
+            cols.append(c)
+            data.append(d)
+    finally:
+        _operands.cache_clear()
+        rmtree(workdir, ignore_errors=True)
+    if not rows:
+        return scipy.sparse.csr_matrix((n, n), dtype=np.int32)
+    return scipy.sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=(n, n))
+
+def coupling(I, threshold=1, **kwargs):
+    "bibliographic coupling strengths between the papers of an Incidence, indexed like I.uts; see gram() for the rest"
+    return gram(I.A, threshold, **kwargs)
+
+def cocitation(I, threshold=1, min_citations=1, **kwargs):
+    """
+    co-citation strengths between the references of an Incidence.
+    min_citations: only consider references cited at least this many times; most references are cited once,
+                   and can't be co-cited more often than they are cited, so this shrinks the problem a lot.
+    returns (matrix, reference keys it is indexed by)
+    """
+    cols = np.flatnonzero(I.citations() >= min_citations)
+    AT = I.A[:, cols].T.tocsr()
+    return gram(AT, threshold, **kwargs), [I.refs[c] for c in cols]
+
+
+def save(prefix, M, labels):
+    "write M to prefix.npz and its labels, one per line, to prefix.labels.txt"
+    scipy.sparse.save_npz(prefix + ".npz", M)
+    with open(prefix + ".labels.txt", "w", encoding="utf-8") as f:
+        for label in labels:
+            f.write(label + "\n")
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Compute bibliographic coupling and/or co-citation matrices from the CR field of ISI files.")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-o', '--output', default="coupling", help="output prefix: writes PREFIX.coupling.npz/.labels.txt and PREFIX.cocitation.npz/.labels.txt")
+    ap.add_argument('-m', '--mode', default="both", choices=["coupling", "cocitation", "both"], help="which matrices to compute")
+    ap.add_argument('-t', '--threshold', type=int, default=1, help="drop pairs sharing fewer than this many references/citing papers")
+    ap.add_argument('--min-citations', type=int, default=2, help="for co-citation, only use references cited at least this often")
+    ap.add_argument('-b', '--block-size', type=int, default=10000, help="rows per block")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    I = incidence(args.files, args.processes)
+    print("%d papers citing %d distinct references" % I.shape)
+    if args.mode in ("coupling", "both"):
+        C = coupling(I, args.threshold, block_size=args.block_size, processes=args.processes)
+        save(args.output + ".coupling", C, I.uts)
+        print("coupling: %d pairs" % (C.nnz,))
+    if args.mode in ("cocitation", "both"):
+        K, refs = cocitation(I, args.threshold, args.min_citations, block_size=args.block_size, processes=args.processes)
+        save(args.output + ".cocitation", K, refs)
+        print("co-citation: %d references, %d pairs" % (len(refs), K.nnz))
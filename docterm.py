@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Document-term and keyword co-occurrence matrices, for topic modelling and keyword maps.
+
+Records are streamed from isiparse and turned into rows of a sparse CSR matrix
+(NumPy indptr/indices/data arrays), a bounded-size chunk at a time, with each
+chunk written to disk as soon as it's full. Files are processed in parallel,
+each worker with its own vocabulary; the vocabularies are merged afterwards by
+remapping each chunk's column ids. min_df/max_df pruning needs document
+frequencies over the whole corpus, so it happens in a second pass over the
+chunks, which writes the final arrays straight into memory-mapped .npy files.
+
+Terms:
+ - DE and ID (keyword) fields contribute whole keywords, normalized: "Social capital" -> "social capital"
+ - anything else (TI, AB, ...) contributes its words
+Tokenizing is cached, since the same keywords and titles come up over and over.
+
+Example:
+```
+import docterm
+M = docterm.build(["PY=2006-2015_SU=Sociology/"], "soc-keywords/", fields=['DE', 'ID'], min_df=5, max_df=0.5)
+X = M.tocsr()                   # scipy.sparse, on top of the memory-mapped arrays
+C = docterm.cooccurrence(M)     # keyword x keyword
+M = docterm.load("soc-keywords/")  # later
+```
+"""
+
+import sys, os
+import logging
+import tempfile
+from shutil import rmtree
+from functools import lru_cache
+from collections import Counter
+
+import numpy as np
+
+import isiparse
+from isiquery import tokenize, normalize
+from util import parallel_map
+
+KEYWORD_FIELDS = {'DE', 'ID'}
+
+
+@lru_cache(maxsize=1 << 18)
+def _keyword(k):
+    return normalize(k)
+
+@lru_cache(maxsize=1 << 16)
+def _words(text):
+    return tuple(tokenize(text))
+
+def terms(record, fields):
+    "the terms of a record, with repeats"
+    found = []
+    for field in fields:
+        v = record.get(field)
+        if v is None:
+            continue
+        if field in KEYWORD_FIELDS:
+            found.extend(_keyword(k) for k in (v if isinstance(v, list) else [v]))
+        else:
+            for text in (v if isinstance(v, list) else [v]):
+                found.extend(_words(text))
+    return [t for t in found if t]
+
+
+def _save_chunk(prefix, indptr, indices, data):
+    np.save(prefix + ".indptr.npy", np.asarray(indptr, dtype=np.int64))
+    np.save(prefix + ".indices.npy", np.asarray(indices, dtype=np.int32))
+    np.save(prefix + ".data.npy", np.asarray(data, dtype=np.int32))
+
+def _load_chunk(prefix):
+    return (np.load(prefix + ".indptr.npy"), np.load(prefix + ".indices.npy"), np.load(prefix + ".data.npy"))
+
+def _build_file(job):
+    """
+    worker: turn one file into CSR chunks of at most chunk_size rows, saved under workdir,
+    with column ids from a vocabulary local to this file.
+    returns (chunk prefixes, local vocabulary as a list, UTs)
+    """
+    fname, fields, chunk_size, workdir, fileno = job
+    vocab = {}
+    uts = []
+    chunks = []
+    indptr, indices, data = [0], [], []
+
+    def flush():
+        prefix = os.path.join(workdir, "%05d.%04d" % (fileno, len(chunks)))
+        _save_chunk(prefix, indptr, indices, data)
+        chunks.append(prefix)
+
+    with isiparse.reader(fname) as isi:
+        for record in isi:
+            counts = Counter(terms(record, fields))
+            for t, n in counts.items():
+                indices.append(vocab.setdefault(t, len(vocab)))
+                data.append(n)
+            indptr.append(len(indices))
+            uts.append(record.get('UT', ""))
+            if len(indptr) > chunk_size:
+                flush()
+                indptr, indices, data = [0], [], []
+    if len(indptr) > 1:
+        flush()
+    return chunks, list(vocab), uts
+
+
+class DocTermMatrix:
+    "a CSR matrix as three (possibly memory-mapped) arrays, plus the term and document (UT) labels"
+    def __init__(self, indptr, indices, data, vocab, uts):
+        self.indptr, self.indices, self.data = indptr, indices, data
+        self.vocab = vocab
+        self.uts = uts
+
+    @property
+    def shape(self):
+        return (len(self.indptr) - 1, len(self.vocab))
+
+    def tocsr(self):
+        import scipy.sparse
+        return scipy.sparse.csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+    def df(self):
+        "document frequency of each term"
+        return np.bincount(self.indices, minlength=len(self.vocab))
+
+
+def build(paths, outdir, fields=('DE', 'ID'), min_df=1, max_df=1.0, chunk_size=100000, processes=None):
+    """
+    build the document-term matrix of a corpus into outdir, and return it (memory-mapped).
+    min_df: drop terms in fewer documents than this
+    max_df: drop terms in more documents than this; a float <= 1.0 is a fraction of all documents
+    chunk_size: rows per chunk; memory use is proportional to this, not to the corpus
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    workdir = tempfile.mkdtemp(prefix="chunks-", dir=outdir)
+    try:
+        files = list(isiparse.find_files(paths))
+        jobs = [(f, list(fields), chunk_size, workdir, i) for i, f in enumerate(files)]
+
+        # merge the vocabularies, remembering how to remap each file's column ids
+        vocab, chunks, uts = {}, [], []
+        for local_chunks, local_vocab, local_uts in parallel_map(_build_file, jobs, processes):
+            remap = np.array([vocab.setdefault(t, len(vocab)) for t in local_vocab], dtype=np.int32)
+            chunks.extend((prefix, remap) for prefix in local_chunks)
+            uts.extend(local_uts)
+
+        # first pass: document frequencies, to decide which terms to keep
+        df = np.zeros(len(vocab), dtype=np.int64)
+        for prefix, remap in chunks:
+            indptr, indices, data = _load_chunk(prefix)
+            df += np.bincount(remap[indices], minlength=len(vocab)) if len(indices) else 0
+        if isinstance(max_df, float) and max_df <= 1.0:
+            max_df = max_df * len(uts)
+        keep = (df >= min_df) & (df <= max_df)
+        renumber = np.cumsum(keep) - 1 #old column -> new column, for kept columns
+        kept = [t for t, k in zip(vocab, keep) if k]
+
+        # second pass: write the pruned matrix into memory-mapped arrays
+        nnz = int(df[keep].sum())
+        out_indptr = np.lib.format.open_memmap(os.path.join(outdir, "indptr.npy"), mode="w+", dtype=np.int64, shape=(len(uts) + 1,))
+        out_indices = np.lib.format.open_memmap(os.path.join(outdir, "indices.npy"), mode="w+", dtype=np.int32, shape=(nnz,))
+        out_data = np.lib.format.open_memmap(os.path.join(outdir, "data.npy"), mode="w+", dtype=np.int32, shape=(nnz,))
+        row, pos = 0, 0
+        out_indptr[0] = 0
+        for prefix, remap in chunks:
+            indptr, indices, data = _load_chunk(prefix)
+            cols = remap[indices]
+            mask = keep[cols]
+            rows = len(indptr) - 1
+            # per-row counts of surviving entries give the new indptr
+            rowids = np.repeat(np.arange(rows), np.diff(indptr))
+            kept_per_row = np.bincount(rowids[mask], minlength=rows)
+            n = int(mask.sum())
+            out_indices[pos:pos+n] = renumber[cols[mask]]
+            out_data[pos:pos+n] = data[mask]
+            out_indptr[row+1:row+rows+1] = pos + np.cumsum(kept_per_row)
+            row += rows
+            pos += n
+        for a in (out_indptr, out_indices, out_data):
+            a.flush()
+        del out_indptr, out_indices, out_data
+
+        with open(os.path.join(outdir, "vocab.txt"), "w", encoding="utf-8") as f:
+            f.writelines(t + "\n" for t in kept)
+        with open(os.path.join(outdir, "docs.txt"), "w", encoding="utf-8") as f:
+            f.writelines(ut + "\n" for ut in uts)
+    finally:
+        rmtree(workdir, ignore_errors=True)
+    return load(outdir)
+
+def load(outdir, mmap=True):
+    "load a matrix written by build(); with mmap=True the arrays stay on disk until touched"
+    mode = "r" if mmap else None
+    arrays = [np.load(os.path.join(outdir, name + ".npy"), mmap_mode=mode) for name in ("indptr", "indices", "data")]
+    with open(os.path.join(outdir, "vocab.txt"), encoding="utf-8") as f:
+        vocab = [line.rstrip("\n") for line in f]
+    with open(os.path.join(outdir, "docs.txt"), encoding="utf-8") as f:
+        uts = [line.rstrip("\n") for line in f]
+    return DocTermMatrix(*arrays, vocab=vocab, uts=uts)
+
+def cooccurrence(M):
+    """
+    term x term co-occurrence counts: entry (i, j) is the number of documents containing both terms i and j
+    (and the diagonal is each term's document frequency). Returned as a scipy.sparse CSR matrix.
+    """
+    X = M.tocsr().astype(bool).astype(np.int32)
+    return (X.T @ X).tocsr()
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Build a sparse document-term matrix (and optionally the term co-occurrence matrix) from ISI files.")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-o', '--output', required=True, help="folder to write the matrix to")
+    ap.add_argument('-f', '--fields', default="DE,ID", help="comma-separated fields to take terms from (default: %(default)s)")
+    ap.add_argument('--min-df', type=int, default=1, help="drop terms in fewer documents than this")
+    ap.add_argument('--max-df', type=float, default=1.0, help="drop terms in more documents than this (a fraction if <= 1)")
+    ap.add_argument('-c', '--cooccurrence', action="store_true", help="also write the term co-occurrence matrix, to OUTPUT/cooccurrence.npz")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    max_df = args.max_df if args.max_df <= 1 else int(args.max_df)
+    M = build(args.files, args.output, fields=args.fields.split(","), min_df=args.min_df, max_df=max_df, processes=args.processes)
+    print("%d documents x %d terms, %d entries" % (M.shape[0], M.shape[1], len(M.data)))
+    if args.cooccurrence:
+        import scipy.sparse
+        scipy.sparse.save_npz(os.path.join(args.output, "cooccurrence.npz"), cooccurrence(M))
@@ -6,9 +6,11 @@ import requests
 from urllib.parse import urlparse, urlunparse
 import logging
 
+from httputil import PoliteSession
+
 class LoginError(Exception): pass
 
-class EzProxy(requests.Session):
+class EzProxy(PoliteSession):
     """
     rewrite requests to go through an EzProxy installation,
     which is a piece of software commonly used by institutional libraries
@@ -20,6 +22,8 @@ class EzProxy(requests.Session):
     (this has the advantage over standard SOCKS and HTTP proxies that users don't need to tweak any settings whatsoever on their side)
     
     Reference: https://www.oclc.org/support/services/ezproxy/documentation.en.html
+    
+    EzProxy installations keep an eye on request rates, so requests are paced and retried (see PoliteSession).
     """
     address = None
     
@@ -125,14 +129,8 @@ class EzProxy(requests.Session):
             # just disallow it.
             raise RuntimeError("Must be logged in to use the library proxy") 
         
-        # TODO: implement backoff on timeouts.
-        #   My first guess is that right here is a good place for it,
-        #   since I'm 99% sure it's EzProxy that's tracking request rates
-        #   so if we accidentally go over their limits, here is where
-        #  specifics: quadratic backoff + retry (like TCP)
-        #        or : rate limit (perhaps add an instance attribute) so that we, hopefully, never
-        #     the latter is probably easier to program with in general, because timeouts would immediately percolate up
-        #  --> requests *already does* retrials, but gives up after 3 attempts  
+        # backoff on timeouts and rate limiting happen in PoliteSession.request(), which super() goes to next:
+        # I'm 99% sure it's EzProxy that's tracking request rates, so this is the layer to be polite at
         
         # rewrite the referer to use the proxy too
         # TODO: where else do have leak URLs that might be leaking?
@@ -167,10 +165,11 @@ class EzProxy(requests.Session):
 
 
 class UWProxy(EzProxy):
-    def __init__(self, last_name, barcode):
+    def __init__(self, last_name, barcode, login=True):
         """
         
         Notice: UW flips the order of user/pass: name is the username and barcode is the pass. By default, EzProxy has them the other way.
+        login=False skips logging in, e.g. to restore a saved session instead (see isi_scrape.load_session())
         """
         super().__init__("proxy.lib.uwaterloo.ca")
         
@@ -185,10 +184,16 @@ class UWProxy(EzProxy):
         # automatically login, since why would you create a proxy without logging in?
         # the only reason EzProxy doesn't is because some sites might require complicated auth dances
         # which cannot(?) be done in one step and definitely
-        self.login(barcode, last_name)
+        if login:
+            self.login(barcode, last_name)
+        else:
+            self._user = last_name #whose login this is waiting for, so a saved one can be checked against it
 
 class GuelphProxy(EzProxy):
-    def __init__(self, barcode, last_name):
+    def __init__(self, barcode, last_name, login=True):
         super().__init__("subzero.lib.uoguelph.ca")
-        self.login(barcode, last_name)
+        if login:
+            self.login(barcode, last_name)
+        else:
+            self._user = last_name
 
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Streaming graph writers, and edge list readers.
+
+networkx wants the whole graph in memory before it will write a single byte
+of it, which is fine for a country graph and hopeless for a citation or
+co-authorship graph with tens of millions of edges. These write GraphML, GEXF,
+Pajek .net and plain tab-separated edge lists straight from iterators of
+nodes and edges (or from the sparse matrices coauthors.py, coupling.py and
+docterm.py produce), one line at a time, so memory doesn't grow with the
+number of edges. (Pajek numbers its vertices, so writing it keeps a
+label -> number table; that grows with the nodes, but never the edges.)
+
+nodes are labels, or (label, {attribute: value}) pairs;
+edges are (source, target) or (source, target, weight) tuples.
+
+Example:
+```
+import graphio, coauthors
+B = coauthors.CoauthorBuilder(); B.add_files(["PY=2006-2015_SU=Sociology/"])
+graphio.write("coauthors.graphml", B.names, graphio.csr_edges(B.matrix(symmetric=False), B.names))
+for u, v, w in graphio.read_edgelist("edges.tsv"): ...
+```
+"""
+
+import sys, os
+import logging
+from xml.sax.saxutils import escape, quoteattr
+
+BUFFER = 1 << 20
+
+# python type -> (GraphML type, GEXF type)
+_TYPES = {bool: ("boolean", "boolean"), int: ("long", "long"), float: ("double", "double"), str: ("string", "string")}
+
+
+def _num(w):
+    "format a weight without a spurious .0"
+    w = float(w)
+    return "%d" % w if w.is_integer() else repr(w)
+
+def _node(n):
+    "split a node into (label, attributes)"
+    if isinstance(n, tuple):
+        return str(n[0]), n[1]
+    return str(n), {}
+
+def _edge(e):
+    "split an edge into (source, target, weight or None)"
+    return str(e[0]), str(e[1]), (e[2] if len(e) > 2 else None)
+
+def csr_edges(M, labels=None, upper=False):
+    """
+    the edges of a scipy.sparse matrix, row by row, as (source, target, weight).
+    labels: node labels by index; default: the indices themselves
+    upper: only yield entries with row <= column, for a symmetric matrix whose edges would otherwise come out twice
+    """
+    M = M.tocsr()
+    indptr, indices, data = M.indptr, M.indices, M.data
+    for i in range(M.shape[0]):
+        for k in range(indptr[i], indptr[i+1]):
+            j = indices[k]
+            if upper and j < i:
+                continue
+            yield (labels[i] if labels is not None else i), (labels[j] if labels is not None else j), data[k]
+
+
+def weight_type(M):
+    "int for a matrix with an integer dtype, float otherwise; for write_graphml()'s weight_type"
+    import numpy as np
+    return int if np.issubdtype(M.dtype, np.integer) else float
+
+
+def write_edgelist(fname, edges, header=True):
+    "write edges as tab-separated source, target, weight lines"
+    with open(fname, "w", encoding="utf-8", buffering=BUFFER) as out:
+        if header:
+            out.write("source\ttarget\tweight\n")
+        for e in edges:
+            u, v, w = _edge(e)
+            out.write("%s\t%s\t%s\n" % (u, v, _num(w if w is not None else 1)))
+
+def write_graphml(fname, nodes, edges, directed=False, node_attrs=None, weight_type=float):
+    """
+    write a GraphML file.
+    node_attrs: {name: python type} of the node attributes to declare; GraphML needs them up front, before any nodes.
+    weight_type: the python type of the edge weights, declared up front the same way; int for counts
+                 (which is what networkx declares for int weights), float for anything else.
+                 See weight_type() for working it out from a matrix.
+    """
+    node_attrs = node_attrs or {}
+    with open(fname, "w", encoding="utf-8", buffering=BUFFER) as out:
+        out.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        out.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+                  'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                  'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+        for i, (name, t) in enumerate(node_attrs.items()):
+            out.write('  <key id="n%d" for="node" attr.name=%s attr.type="%s" />\n' % (i, quoteattr(name), _TYPES[t][0]))
+        out.write('  <key id="weight" for="edge" attr.name="weight" attr.type="%s" />\n' % (_TYPES[weight_type][0],))
+        out.write('  <graph edgedefault="%s">\n' % ("directed" if directed else "undirected"))
+        keys = {name: "n%d" % i for i, name in enumerate(node_attrs)}
+        for n in nodes:
+            label, attrs = _node(n)
+            if attrs:
+                out.write('    <node id=%s>\n' % (quoteattr(label),))
+                for name, value in attrs.items():
+                    out.write('      <data key="%s">%s</data>\n' % (keys[name], escape(str(value))))
+                out.write('    </node>\n')
+            else:
+                out.write('    <node id=%s />\n' % (quoteattr(label),))
+        for e in edges:
+            u, v, w = _edge(e)
+            if w is None:
+                out.write('    <edge source=%s target=%s />\n' % (quoteattr(u), quoteattr(v)))
+            else:
+                out.write('    <edge source=%s target=%s>\n      <data key="weight">%s</data>\n    </edge>\n' % (quoteattr(u), quoteattr(v), _num(w)))
+        out.write('  </graph>\n</graphml>\n')
+
+def write_gexf(fname, nodes, edges, directed=False, node_attrs=None):
+    "write a GEXF 1.2 file (for Gephi); node_attrs as in write_graphml()"
+    node_attrs = node_attrs or {}
+    with open(fname, "w", encoding="utf-8", buffering=BUFFER) as out:
+        out.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        out.write('<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n')
+        out.write('  <graph mode="static" defaultedgetype="%s">\n' % ("directed" if directed else "undirected"))
+        if node_attrs:
+            out.write('    <attributes class="node">\n')
+            for i, (name, t) in enumerate(node_attrs.items()):
+                out.write('      <attribute id="%d" title=%s type="%s" />\n' % (i, quoteattr(name), _TYPES[t][1]))
+            out.write('    </attributes>\n')
+        keys = {name: i for i, name in enumerate(node_attrs)}
+        out.write('    <nodes>\n')
+        for n in nodes:
+            label, attrs = _node(n)
+            if attrs:
+                out.write('      <node id=%s label=%s><attvalues>' % (quoteattr(label), quoteattr(label)))
+                out.write("".join('<attvalue for="%d" value=%s />' % (keys[name], quoteattr(str(value))) for name, value in attrs.items()))
+                out.write('</attvalues></node>\n')
+            else:
+                out.write('      <node id=%s label=%s />\n' % (quoteattr(label), quoteattr(label)))
+        out.write('    </nodes>\n    <edges>\n')
+        for i, e in enumerate(edges):
+            u, v, w = _edge(e)
+            out.write('      <edge id="%d" source=%s target=%s weight="%s" />\n' % (i, quoteattr(u), quoteattr(v), _num(w if w is not None else 1)))
+        out.write('    </edges>\n  </graph>\n</gexf>\n')
+
+def write_pajek(fname, nodes, edges, directed=False):
+    """
+    write a Pajek .net file. Pajek numbers vertices from 1 in the order they are listed,
+    so nodes must be given in full (a list, or anything len() works on); edges can still stream.
+    """
+    nodes = nodes if hasattr(nodes, '__len__') else list(nodes)
+    number = {}
+    with open(fname, "w", encoding="utf-8", buffering=BUFFER) as out:
+        out.write("*Vertices %d\n" % (len(nodes),))
+        for n in nodes:
+            label, _ = _node(n)
+            number[label] = len(number) + 1
+            out.write('%d "%s"\n' % (number[label], label.replace('"', "'")))
+        out.write("*Arcs\n" if directed else "*Edges\n")
+        for e in edges:
+            u, v, w = _edge(e)
+            out.write("%d %d %s\n" % (number[u], number[v], _num(w if w is not None else 1)))
+
+WRITERS = {'.graphml': write_graphml, '.gexf': write_gexf, '.net': write_pajek, '.tsv': None, '.txt': None}
+
+def write(fname, nodes, edges, directed=False, **kwargs):
+    "write a graph in the format fname's extension calls for: .graphml, .gexf, .net (Pajek), or .tsv/.txt (edge list; nodes are ignored)"
+    ext = os.path.splitext(fname)[1].lower()
+    if ext not in WRITERS:
+        raise ValueError("don't know how to write %s files; try one of %s" % (ext, ", ".join(sorted(WRITERS))))
+    if WRITERS[ext] is None:
+        return write_edgelist(fname, edges)
+    return WRITERS[ext](fname, nodes, edges, directed=directed, **kwargs)
+
+
+def read_edgelist(fname, header=None):
+    """
+    stream (source, target, weight) from a tab-separated edge list as written by write_edgelist().
+    The weight column is optional (default 1.0); header=None sniffs for a header line.
+    """
+    with open(fname, encoding="utf-8", buffering=BUFFER) as f:
+        for i, line in enumerate(f):
+            fields = line.rstrip("\n").split("\t")
+            if i == 0 and (header or (header is None and fields[:2] == ["source", "target"])):
+                continue
+            if len(fields) < 2:
+                continue
+            yield fields[0], fields[1], (float(fields[2]) if len(fields) > 2 and fields[2] else 1.0)
+
+def read_csr(fname, directed=False):
+    """
+    read an edge list into a scipy.sparse CSR matrix; returns (matrix, labels).
+    Undirected edge lists give a symmetric matrix. Repeated edges are summed.
+    """
+    import numpy as np
+    from array import array
+    import scipy.sparse
+    ids, labels = {}, []
+    rows, cols, data = array('l'), array('l'), array('d')
+    for u, v, w in read_edgelist(fname):
+        for label in (u, v):
+            if label not in ids:
+                ids[label] = len(labels)
+                labels.append(label)
+        rows.append(ids[u]); cols.append(ids[v]); data.append(w)
+        if not directed and u != v:
+            rows.append(ids[v]); cols.append(ids[u]); data.append(w)
+    n = len(labels)
+    M = scipy.sparse.coo_matrix((np.frombuffer(data, dtype=np.float64), (np.frombuffer(rows, dtype=np.int_), np.frombuffer(cols, dtype=np.int_))), shape=(n, n))
+    return M.tocsr(), labels
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Convert a tab-separated edge list (or a .npz matrix plus a labels file) to GraphML, GEXF, Pajek or another edge list, streaming.")
+    ap.add_argument('input', help="edge list (.tsv) or scipy.sparse matrix (.npz)")
+    ap.add_argument('output', help="file to write; the format comes from the extension (.graphml, .gexf, .net, .tsv)")
+    ap.add_argument('-l', '--labels', help="for .npz input, node labels one per line (e.g. PREFIX.names.txt from coauthors.py)")
+    ap.add_argument('--directed', action="store_true", help="write a directed graph")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    if args.input.endswith(".npz"):
+        import scipy.sparse
+        M = scipy.sparse.load_npz(args.input)
+        labels = None
+        if args.labels:
+            with open(args.labels, encoding="utf-8") as f:
+                labels = [line.rstrip("\n") for line in f]
+        nodes = labels if labels is not None else range(M.shape[0])
+        kwargs = {'weight_type': weight_type(M)} if args.output.lower().endswith(".graphml") else {}
+        write(args.output, nodes, csr_edges(M, labels, upper=not args.directed), directed=args.directed, **kwargs)
+    else:
+        # the formats list every node before the first edge, so this takes two passes over the input
+        seen = {}
+        for u, v, w in read_edgelist(args.input):
+            seen.setdefault(u, None); seen.setdefault(v, None)
+        write(args.output, list(seen), read_edgelist(args.input), directed=args.directed)
@@ -38,3 +38,157 @@ class AnonymizedSession(requests.Session):
         return "Mozilla/5.0 (X11; Linux x86_64; rv:36.0) Gecko/20100101 Firefox/36.0"
     
     #TODO: other countermeasures
+
+
+import time
+import random
+import threading
+import requests.exceptions
+
+class TokenBucket:
+    """
+    a token bucket rate limiter: tokens drip in at `rate` per second, up to `burst` of them saved up,
+    and every request spends one, waiting for it if there isn't one yet.
+    Thread-safe, so one bucket can be shared by every thread making requests through a session.
+    """
+    def __init__(self, rate=1.0, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, n=1):
+        "take n tokens, sleeping until they've dripped in if need be; returns how long that was"
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self.tokens -= n #may go negative: that's a reservation, which later callers queue behind
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+    
+    def adjust(self, factor=1.0, step=0.0, low=0.0, high=float("inf")):
+        """
+        change the rate to rate * factor + step, kept within [low, high], and return it.
+        Done under the same lock as acquire(), with the tokens so far counted at the old rate.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self.rate = min(high, max(low, self.rate * factor + step))
+            return self.rate
+
+
+class RTTEstimator:
+    """
+    an adaptive timeout for one endpoint, computed like TCP's retransmission timeout (RFC 6298):
+    a smoothed round trip time plus four times its mean deviation, doubled on every timeout (and reset by the next success).
+    """
+    def __init__(self, initial=29, minimum=5, maximum=300):
+        self.srtt = None
+        self.rttvar = None
+        self.minimum, self.maximum = minimum, maximum
+        self.timeout = initial
+    
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.timeout = min(self.maximum, max(self.minimum, self.srtt + 4 * self.rttvar))
+    
+    def backoff(self):
+        self.timeout = min(self.maximum, self.timeout * 2)
+
+
+class PoliteSession(requests.Session):
+    """
+    a requests.Session mixin that paces and retries its requests, so that long scrapes don't die on the first hiccup:
+    
+     - every request waits its turn at a TokenBucket (see .limiter), shared by all threads using the session
+     - timeouts, connection errors and responses retryable() says are transient (5xx, 429, ...) are retried,
+       up to RETRIES times, after an exponential backoff with full jitter
+     - the rate adapts AIMD-style, like TCP's congestion window: each success nudges it up by RATE_STEP
+       (up to MAX_RATE), each failure halves it (down to MIN_RATE), so it settles near the fastest rate
+       the server tolerates
+     - timeouts adapt to each endpoint's (host and path's) observed latency (see RTTEstimator),
+       unless a request passes timeout= itself
+    
+    The class attributes are the defaults; they can be overridden per instance.
+    """
+    RATE = 0.5        #requests per second to start at
+    MIN_RATE = 0.05
+    MAX_RATE = 2.0
+    RATE_STEP = 0.02  #additive increase, per successful request
+    BURST = 2
+    RETRIES = 6
+    BACKOFF = 2.0     #seconds; the n'th retry waits up to BACKOFF * 2**n
+    MAX_BACKOFF = 300
+    TIMEOUT = 29      #initial timeout for endpoints we haven't heard from yet
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs); del args, kwargs # <-- compatibility with wrapper()
+        self._politeness()
+    
+    def _politeness(self):
+        self.limiter = TokenBucket(self.RATE, self.BURST)
+        self._rtts = {} # (host, path) -> RTTEstimator
+        self._rtt_lock = threading.Lock()
+    
+    # requests.Session's __getstate__ only keeps its own attributes (see EzProxy); the politeness state
+    # is all locks and timing anyway, so just start it afresh
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._politeness()
+    
+    def retryable(self, response):
+        "is this response a transient failure, worth backing off and trying again? Override to add site-specific cases."
+        return response.status_code >= 500 or response.status_code == 429
+    
+    def _estimator(self, url):
+        scheme, host, path, *_ = urlparse(url)
+        with self._rtt_lock:
+            return self._rtts.setdefault((host, path), RTTEstimator(self.TIMEOUT))
+    
+    def _succeeded(self, estimator, rtt):
+        with self._rtt_lock:
+            estimator.sample(rtt)
+        self.limiter.adjust(step=self.RATE_STEP, high=self.MAX_RATE)
+    
+    def _failed(self, estimator, timed_out):
+        if timed_out:
+            with self._rtt_lock:
+                estimator.backoff()
+        self.limiter.adjust(factor=0.5, low=self.MIN_RATE)
+    
+    def request(self, method, url, *args, **kwargs):
+        estimator = self._estimator(url)
+        fixed_timeout = "timeout" in kwargs
+        for attempt in range(self.RETRIES + 1):
+            self.limiter.acquire()
+            if not fixed_timeout:
+                kwargs["timeout"] = estimator.timeout
+            try:
+                r = super().request(method, url, *args, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as exc:
+                self._failed(estimator, isinstance(exc, requests.exceptions.Timeout))
+                if attempt == self.RETRIES:
+                    raise
+                logging.warning("%s %s failed (%s); retrying" % (method, url, exc))
+            else:
+                if not self.retryable(r):
+                    self._succeeded(estimator, r.elapsed.total_seconds()) #elapsed is time to the headers, which is what timeout= bounds
+                    return r
+                self._failed(estimator, False)
+                if attempt == self.RETRIES:
+                    return r #let the caller's raise_for_status() deal with it
+                logging.warning("%s %s gave a transient error (%d, %s); retrying" % (method, url, r.status_code, r.url))
+                r.close()
+            delay = random.uniform(0, min(self.MAX_BACKOFF, self.BACKOFF * 2 ** attempt))
+            logging.info("backing off for %.1fs (rate now %.2f/s)" % (delay, self.limiter.rate))
+            time.sleep(delay)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+An asyncio client for ISI: the searches and exports of isi_scrape.ISI/ISIResults, as coroutines,
+for harvesters that want to overlap them with their other I/O without threads.
+
+The requests themselves are built by the same code isi_scrape uses (general_search_request(),
+ISIResults._export_request()), so both clients send ISI exactly the same thing; only the sending differs:
+ - one aiohttp.ClientSession, whose connector pools (and caps) the connections for every search and export
+ - one AsyncTokenBucket shared by all of them, with the same retries, backoff, AIMD rate and
+   adaptive timeouts as httputil.PoliteSession (and the same defaults, which it takes from there)
+
+Logging in to the library proxy is still done with the blocking code (it happens once, and EzProxy
+is a requests.Session); AsyncISI.connect() takes its cookies, headers and proxify() over.
+
+Needs aiohttp (`pip install aiohttp`).
+
+Example:
+```
+import asyncio, isi_async
+from ezproxy import UWProxy
+
+async def main():
+    S = await isi_async.AsyncISI.connect(UWProxy(last_name, barcode), connections=4)
+    async with S:
+        cats, dogs = await asyncio.gather(S.generalSearch(("TS", "cats")), S.generalSearch(("TS", "dogs")))
+        await cats.export("manycats.ciw", 1, 500)
+        await dogs.rip(workers=4)   #into the current directory, with a manifest, like ISIResults.rip()
+
+asyncio.run(main())
+```
+"""
+
+import sys, os
+import time
+import random
+import asyncio
+import logging
+from itertools import islice
+from collections import deque
+from glob import glob, escape as escape_glob
+from urllib.parse import urlparse
+from http.cookies import SimpleCookie
+
+import aiohttp
+
+from isi_scrape import (ISI, ISIResults, ISIError, InvalidInput, NoSession, NewSession, general_search_request, parse_page, isi_error,
+                        extract_qid, extract_count, extract_search_mode,
+                        BlockSummer, block_entry, append_manifest, CHUNK, LOTS, print)
+from httputil import PoliteSession, RTTEstimator, qs_parse
+
+
+class AsyncTokenBucket:
+    """
+    httputil.TokenBucket for coroutines: waiting for a token only puts the waiting task to sleep, not the event loop.
+    It needs no lock: nothing awaits between reading and updating the tokens, so no other task can get in between.
+    """
+    def __init__(self, rate=1.0, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._stamp = time.monotonic()
+
+    async def acquire(self, n=1):
+        "take n tokens, sleeping until they've dripped in if need be; returns how long that was"
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        self.tokens -= n #may go negative: that's a reservation, which later callers queue behind
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def adjust(self, factor=1.0, step=0.0, low=0.0, high=float("inf")):
+        "httputil.TokenBucket.adjust(): change the rate to rate * factor + step, kept within [low, high], and return it"
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        self.rate = min(high, max(low, self.rate * factor + step))
+        return self.rate
+
+
+def _form(pairs):
+    "a urlencoded aiohttp form from (key, value) pairs, which may repeat keys (ISI's do)"
+    return aiohttp.FormData([(k, str(v)) for k, v in pairs])
+
+
+class AsyncISI:
+    """
+    ISI, with awaitable searches. Make one with connect(); close it (or use it as an async context manager) when done.
+
+    Requests are paced and retried like httputil.PoliteSession's; the class attributes are the same knobs.
+    """
+    RATE = PoliteSession.RATE
+    MIN_RATE = PoliteSession.MIN_RATE
+    MAX_RATE = PoliteSession.MAX_RATE
+    RATE_STEP = PoliteSession.RATE_STEP
+    BURST = PoliteSession.BURST
+    RETRIES = PoliteSession.RETRIES
+    BACKOFF = PoliteSession.BACKOFF
+    MAX_BACKOFF = PoliteSession.MAX_BACKOFF
+    TIMEOUT = PoliteSession.TIMEOUT
+
+    def __init__(self, http, proxify=None, limiter=None):
+        """
+        http: the aiohttp.ClientSession to send everything through
+        proxify: rewrites URLs to go through a proxy (e.g. an EzProxy's proxify()); default: leave them be
+        limiter: the AsyncTokenBucket to pace requests with; share one between AsyncISIs to pace them together
+        """
+        self.http = http
+        self.proxify = proxify or (lambda url: url)
+        self.limiter = limiter or AsyncTokenBucket(self.RATE, self.BURST)
+        self.SID = None
+        self._rtts = {} # (host, path) -> RTTEstimator
+
+    @classmethod
+    async def connect(cls, session=None, connections=10, limiter=None):
+        """
+        start an ISI session, like ISI() does.
+        session: a (logged in) requests.Session to carry on from: its cookies and headers are copied,
+                 and if it is an EzProxy, requests go through its proxy
+        connections: how many connections to keep open to ISI at most; this also caps how many requests are in flight
+        """
+        ISI.TOS_warning()
+        jar = aiohttp.CookieJar(unsafe=True) #unsafe: allow cookies for IP addresses, as requests does
+        headers = {}
+        proxify = None
+        if session is not None:
+            for c in session.cookies:
+                morsel = SimpleCookie()
+                morsel[c.name] = c.value
+                morsel[c.name]['domain'] = c.domain
+                morsel[c.name]['path'] = c.path
+                jar.update_cookies(morsel)
+            headers = {k: v for k, v in session.headers.items() if k.lower() in ('user-agent', 'accept', 'accept-language')}
+            proxify = getattr(session, "proxify", None)
+        http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections), cookie_jar=jar, headers=headers)
+        self = cls(http, proxify, limiter)
+        try:
+            # hit the front page of WoS like a normal person, to get a SID
+            await self._page("GET", "http://isiknowledge.com/wos")
+            if self.SID is None:
+                raise NoSession(NoSession.KEY, "no SID from the front page")
+        except BaseException:
+            await http.close()
+            raise
+        return self
+
+    async def close(self):
+        await self.http.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+    def retryable(self, response):
+        "PoliteSession.retryable(), for aiohttp responses"
+        return response.status >= 500 or response.status == 429
+
+    def _estimator(self, url):
+        scheme, host, path, *_ = urlparse(url)
+        return self._rtts.setdefault((host, path), RTTEstimator(self.TIMEOUT))
+
+    async def _request(self, method, url, headers=None, **kwargs):
+        """
+        send a request through the proxy, politely (see PoliteSession.request()), and return the aiohttp response, unread.
+        The caller has to read or release it.
+        """
+        url = self.proxify(url)
+        headers = dict(headers or {})
+        if 'Referer' in headers:
+            headers['Referer'] = self.proxify(headers['Referer'])
+        estimator = self._estimator(url)
+        for attempt in range(self.RETRIES + 1):
+            await self.limiter.acquire()
+            # like requests' timeout=, this bounds connecting and each wait for data, not the whole download
+            timeout = aiohttp.ClientTimeout(sock_connect=estimator.timeout, sock_read=estimator.timeout)
+            sent = time.monotonic()
+            try:
+                r = await self.http.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as exc:
+                if isinstance(exc, asyncio.TimeoutError):
+                    estimator.backoff()
+                self.limiter.adjust(factor=0.5, low=self.MIN_RATE)
+                if attempt == self.RETRIES:
+                    raise
+                logging.warning("%s %s failed (%r); retrying" % (method, url, exc))
+            else:
+                if not self.retryable(r):
+                    estimator.sample(time.monotonic() - sent) #time to the headers, as in PoliteSession
+                    self.limiter.adjust(step=self.RATE_STEP, high=self.MAX_RATE)
+                    query = qs_parse(r.url.query_string)
+                    if "SID" in query:
+                        if self.SID not in (None, query["SID"]):
+                            r.release()
+                            raise NewSession(NewSession.KEY, "ISI session %s was replaced by %s" % (self.SID, query["SID"]))
+                        self.SID = query["SID"]
+                    return r
+                self.limiter.adjust(factor=0.5, low=self.MIN_RATE)
+                if attempt == self.RETRIES:
+                    return r #let the caller's raise_for_status() deal with it
+                logging.warning("%s %s gave a transient error (%d, %s); retrying" % (method, url, r.status, r.url))
+                r.release()
+            delay = random.uniform(0, min(self.MAX_BACKOFF, self.BACKOFF * 2 ** attempt))
+            logging.info("backing off for %.1fs (rate now %.2f/s)" % (delay, self.limiter.rate))
+            await asyncio.sleep(delay)
+
+    async def _page(self, method, url, **kwargs):
+        "fetch an ISI page; returns (its URL, its soup, see isi_scrape.parse_page()), or raises the ISIError it reports"
+        async with await self._request(method, url, **kwargs) as r:
+            r.raise_for_status()
+            body = await r.read()
+        url = str(r.url)
+        soup = parse_page(body)
+        err = isi_error(url, soup)
+        if err is not None:
+            raise err
+        return url, soup
+
+
+    async def generalSearch(self, *fields, timespan=None, editions=["SCI", "SSCI", "AHCI", "ISTP", "ISSHP"], sort='LC.D;PY.A;LD.D;SO.A;VL.D;PG.A;AU.A'):
+        "ISI.generalSearch(), awaitable; see there for the arguments. Returns an AsyncISIResults."
+        url, headers, form = general_search_request(self.SID, fields, timespan=timespan, editions=editions, sort=sort)
+        url, soup = await self._page("POST", url, headers=headers, data=_form(form))
+        count, estimated = extract_count(soup)
+        return AsyncISIResults(self, extract_search_mode(soup), extract_qid(soup), url, N=count, estimated=estimated)
+
+
+class AsyncISIResults(ISIResults):
+    """
+    ISIResults, with awaitable exports. Its session is the AsyncISI that made it.
+    """
+
+    async def _export(self, start, end, format="fieldtagged"):
+        "ISIResults._export(), awaitable: the response, unread, unless ISI sent an error page, which raises its ISIError"
+        url, headers, params = self._export_request(start, end, format)
+        r = await self.session._request("POST", url, headers=headers, data=_form(params.items()))
+        try:
+            r.raise_for_status()
+            if 'error' in str(r.url).lower():
+                err = isi_error(str(r.url), parse_page(await r.read()))
+                if err is not None:
+                    raise err
+        except BaseException:
+            r.release()
+            raise
+        return r
+
+    async def export(self, fname, start=1, end=500, format="fieldtagged", fsync=False):
+        "ISIResults.export(), awaitable: streams the export to fname and returns its manifest entry"
+        async with await self._export(start, end, format) as r:
+            summer = BlockSummer(format)
+            with open(fname, "wb") as w:
+                async for chunk in r.content.iter_chunked(CHUNK):
+                    summer.update(chunk)
+                    w.write(chunk)
+                if fsync:
+                    w.flush()
+                    await asyncio.get_running_loop().run_in_executor(None, os.fsync, w.fileno())
+        logging.debug("exported %d records (%d bytes) to %s" % (summer.records, summer.bytes, fname))
+        return block_entry(fname, start, end, format, summer)
+
+    async def probe(self):
+        "ISIResults.probe(), awaitable"
+        try:
+            (await self._export(1, 1)).release()
+        except ISIError as exc:
+            logging.info("result set %s is gone: %s" % (self.qid, exc))
+            return False
+        return True
+
+    async def _rip_block(self, L, U, fname, format="fieldtagged", fsync=False):
+        "ISIResults._rip_block(), awaitable"
+        block = await self.export(fname+".part", L, U, format, fsync=fsync)
+        os.replace(fname+".part", fname)
+        block['file'] = fname
+        return block
+
+    async def rip(self, overwrite=False, upper_limit=LOTS, format="fieldtagged", fsync=False, workers=4, prefix=""):
+        """
+        ISIResults.rip(), awaitable: the same blocks, file names and manifest, with up to `workers` blocks
+        exporting at once (on top of whatever else is sharing the AsyncISI's connections and rate limit).
+        """
+        todo = iter(self._rip_plan(overwrite, upper_limit, format, fsync, prefix))
+        window = deque()
+        def submit():
+            for L, U, fname in islice(todo, 1):
+                window.append(((L, U, fname), asyncio.ensure_future(self._rip_block(L, U, fname, format, fsync))))
+
+        try:
+            for _ in range(max(workers, 1)):
+                submit()
+            while window:
+                (L, U, fname), task = window.popleft()
+                try:
+                    block = await task
+                except InvalidInput:
+                    logging.error("Quitting on block [%d,%d), instead of reaching expected count %d" % (L,U,len(self)))
+                    if self.estimated:
+                        break #ran off the end of an estimated count; the blocks in flight after this one will fail the same way
+                    raise
+                print("Exported records [%d,%d] to %s: %d records" % (L,U, fname, block['records']))
+                append_manifest(".", block, fsync)
+                submit()
+        finally:
+            # let whatever is in flight finish; anything that finished fine is still good
+            await asyncio.gather(*(t for _, t in window), return_exceptions=True)
+            for _, t in window:
+                if not t.cancelled() and t.exception() is None:
+                    append_manifest(".", t.result(), fsync)
+        assert not glob(escape_glob(prefix) + "*.part"), "successful rip() should leave no partial downloads"
@@ -67,9 +67,16 @@ from textwrap import dedent #tip from http://stackoverflow.com/a/6133466
 #import argparse, optparse, ...
 import logging
 import traceback
+import hashlib, codecs
+import datetime
+import json
+import time
+import threading
 
-from itertools import count, cycle
-from glob import glob #for rip()
+from itertools import count, cycle, islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob, escape as escape_glob #for rip()
 from urllib.parse import urlparse, urljoin
 
 
@@ -77,10 +84,19 @@ from urllib.parse import urlparse, urljoin
 # (users will need to `pip install` these)
 import requests
 from requests.exceptions import HTTPError
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+try:
+    from bs4.filter import ElementFilter
+except ImportError:
+    ElementFilter = None #bs4 < 4.13, see strainer()
+try:
+    import lxml
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
 
 # local package imports
-from isiparse import is_WOS_number
+from isiparse import is_WOS_number, TAB_SUFFIX
 from util import *
 from httputil import *
 from ezproxy import *
@@ -88,6 +104,15 @@ from ezproxy import *
 MAX_EXPORT = 500 #how many records ISI limits us to in one request
 LOTS = 20000 #how many results we consider to be a large query
 
+# export format -> the extension rip() gives its blocks; these are all formats isiparse.reader() can read
+EXTENSIONS = {'fieldtagged': '.ciw',
+              'othersoftware': '.ciw',
+              'winTabUTF8': TAB_SUFFIX,
+              'macTabUTF8': TAB_SUFFIX,
+              'winTabUnicode': TAB_SUFFIX,
+              'macTabUnicode': TAB_SUFFIX,
+              }
+
 import builtins
 def print(*args, **kwargs):
     builtins.print("[isiscrape]", *args, **kwargs)
@@ -115,6 +140,56 @@ class NoRecordsFound(ISIError):
 # make a reverse mapping, so we can look them up at runtime
 ISIError.ALL = {e.KEY: e for e in list(locals().values())  if isinstance(e, type) and issubclass(e, ISIError)}
 
+class NoSession(ISIError):
+    "ISI didn't hand us a SID; usually because the proxy session has expired, and the proxy bounced us to its login page instead"
+    KEY = "isi_scrape.noSID" #ours, not ISI's
+
+class NewSession(ISIError):
+    "ISI answered with a different SID than the one we were using: that ISI session, and every result set in it, is gone"
+    KEY = "isi_scrape.newSID" #ours, not ISI's
+
+# ----------------------------- page parsing
+
+# ISI pages are big, and all we ever want from them is a handful of hidden inputs, a record count, and error messages.
+# So pages are parsed only down to those (see strainer()), with the fastest parser available,
+# and only once per response (see ISIResponse.soup), shared between error checking and the extract_*() functions.
+
+def _classes(attrs):
+    c = attrs.get("class") or ""
+    return set(c.split() if isinstance(c, str) else c)
+
+def strainer(wanted):
+    """
+    make a parse_only filter out of wanted(tag name, attribute dict) -> bool:
+    only the elements it accepts (and everything inside them) get parsed at all.
+    """
+    if ElementFilter is None:
+        return SoupStrainer(wanted) #old bs4 calls a function given as the name with (name, attrs)
+    class Filter(ElementFilter):
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            return wanted(name, attrs or {})
+        def allow_string_creation(self, string):
+            return False #strings outside any wanted element
+    return Filter()
+
+def _page_element(name, attrs):
+    "the elements extract_*() and isi_error() look at"
+    if name == "input":
+        return attrs.get("name") in ("qid", "search_mode", "search_mode1")
+    return attrs.get("id") in ("footer_formatted_count", "hitCount.top") or \
+           bool(_classes(attrs) & {"errorMessage", "NEWwokErrorContainer"})
+
+PAGE = strainer(_page_element)
+RESULTS = strainer(lambda name, attrs: "search-results-item" in _classes(attrs))
+
+def parse_page(content, only=PAGE):
+    return BeautifulSoup(content, PARSER, parse_only=only)
+
+def page_soup(r):
+    "the (cached) parse of a response; works for plain requests.Responses too, but then isn't cached"
+    return r.soup if isinstance(r, ISIResponse) else parse_page(r.content)
+
+
 def extract_qid(soup):
     """
     screenscrape the qid of the given query result page
@@ -175,6 +250,44 @@ def extract_search_mode(soup):
     search_mode = search_mode['value']
     return search_mode
 
+def isi_error(url, soup):
+    """
+    the ISIError an ISI error page (at url, parsed into soup) reports, or None if it isn't one.
+    """
+    if 'error' not in url.lower():
+        return None
+    err, msg = None, ""
+    
+    # if we see an error reported in the query string, extract its text by screenscraping
+    params = qs_parse(urlparse(url).query)
+    if 'error_display_redirect' in params:
+        assert params['error_display_redirect'] == 'true', "ISI only gives this tag if an error actually happened"
+        assert 'message_key' in params, "and in that case, it will give the error key in this"
+        err = params['message_key']
+        
+        soup = soup.find("div", class_="errorMessage")
+        for div in soup("div"):
+            # the error might appear in any of several different sub-divs
+            # my kludgey approximation is to take the first one we see
+            # if we see any
+            if div.text.strip():
+                msg = div.text.strip()
+                break
+                
+    elif 'Error' in params:
+        # *or*, low-level errors get a whole different error page
+        # in some cases the previous URL has a more specific error code in it? but not all? and sometimes it changes its mind on the same arguments??
+        #params = qs_parse(urlparse(self.history[-1].url).query)
+        
+        err = params['Error']  
+        title = soup.find(class_="NEWwokErrorContainer")
+        title = title and title.find(class_="NEWpageTitle")
+        title = title and title.find("h1")
+        msg = title.text.strip() if title else ""
+    
+    return ISIError.ALL.get(err, ISIError)(err, msg) #look up the appropriate ISIError, falling back on ISIError itself if not known, and instantiate it
+
+
 class ISIResponse(requests.Response):
     """rel
     Extend an requests.Response to translate ISI's frustratingly
@@ -183,8 +296,15 @@ class ISIResponse(requests.Response):
     (Actually, translates them to ISIErrors, a more specific subclass)
     """
     
-    # TODO: if this ever adds state, it will need to extend
-    #       __setstate__ and __getstate__ because its parent does
+    # the parsed page is cached in _soup; that's deliberately not in requests.Response.__attrs__,
+    # so it doesn't get pickled, and gets reparsed (once) if it's needed after unpickling
+    
+    @property
+    def soup(self):
+        "the page, parsed once, down to the parts ISI keeps its state and errors in (see PAGE)"
+        if getattr(self, "_soup", None) is None:
+            self._soup = parse_page(self.content)
+        return self._soup
     
     def raise_for_status(self, *args, **kwargs):
         """
@@ -200,35 +320,10 @@ class ISIResponse(requests.Response):
         #super().raise_for_status() #<-- super() is broken under Wrapped
         requests.Response.raise_for_status(self, *args, **kwargs) 
         
-        if 'error' in self.url.lower():
-            err, msg = None, ""
-            soup = BeautifulSoup(self.content)
-            
-            # if we see an error reported in the query string, extract its text by screenscraping
-            params = qs_parse(urlparse(self.url).query)
-            if 'error_display_redirect' in params:
-                assert params['error_display_redirect'] == 'true', "ISI only gives this tag if an error actually happened"
-                assert 'message_key' in params, "and in that case, it will give the error key in this"
-                err = params['message_key']
-                
-                soup = soup.find("div", class_="errorMessage")
-                for div in soup("div"):
-                    # the error might appear in any of several different sub-divs
-                    # my kludgey approximation is to take the first one we see
-                    # if we see any
-                    if div.text.strip():
-                        msg = div.text.strip()
-                        break
-                            
-            elif 'Error' in params:
-                # *or*, low-level errors get a whole different error page
-                # in some cases the previous URL has a more specific error code in it? but not all? and sometimes it changes its mind on the same arguments??
-                #params = qs_parse(urlparse(self.history[-1].url).query)
-                
-                err = params['Error']  
-                msg = soup.find(class_="NEWwokErrorContainer").find(class_="NEWpageTitle").find("h1").text
-            
-            raise ISIError.ALL.get(err, ISIError)(err, msg) #look up the appropriate ISIError, falling back on ISIError itself if not known, and instantiate it
+        if 'error' in self.url.lower(): #checked here too, so that non-error pages (e.g. exports) are never parsed
+            err = isi_error(self.url, self.soup)
+            if err is not None:
+                raise err
             
 
 class ISISession(requests.Session):
@@ -238,8 +333,11 @@ class ISISession(requests.Session):
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs); del args, kwargs # <-- compatibility with wrapper()
-        self.__dict__.setdefault("timeout", 29) #set a default timeout (if not set already), so that getting kicked off doesn't just hang for hours but instead eventually retries
-        
+        if not isinstance(self, PoliteSession):
+            # PoliteSessions adapt their timeouts to each page; anything else gets a fixed default (if not set already),
+            # so that getting kicked off doesn't just hang for hours but instead eventually retries
+            self.__dict__.setdefault("timeout", 29)
+    
     def __getstate__(self):
         state = super().__getstate__()
         if hasattr(self,'_SID'): state['_SID'] = self._SID
@@ -256,10 +354,10 @@ class ISISession(requests.Session):
         return getattr(self, "_SID", None)
     @SID.setter
     def SID(self, value):
-        if hasattr(self, "_SID"):
-            assert self._SID == value, "SID %s should immutable, but instead we received an update %d" % (self._SID, value)
-        else:
-            self._SID = value
+        # the SID is immutable: a different one means ISI has started us a new session (see NewSession)
+        if getattr(self, "_SID", None) not in (None, value):
+            raise NewSession(NewSession.KEY, "ISI session %s was replaced by %s" % (self._SID, value))
+        self._SID = value
         
     def request(self, *args, **kwargs):
         #attach timeout if it's given as a default session-level variable
@@ -271,24 +369,175 @@ class ISISession(requests.Session):
             if hasattr(self, "timeout"):
                 kwargs["timeout"] = self.timeout
         
-        r = wrapper(ISIResponse)(super().request(*args, **kwargs))
+        # clone=False: the response is brand new and nobody else holds it, so there's nothing to protect by copying it;
+        # and copying isn't free: deepcopy()ing a Response goes through its __getstate__, which reads in the whole body
+        r = wrapper(ISIResponse, clone=False)(super().request(*args, **kwargs))
         query = qs_parse(urlparse(r.url).query)
         if "SID" in query:
-            self.SID = query["SID"]
+            try:
+                self.SID = query["SID"]
+            except NewSession:
+                r.close()
+                raise
         return r
     
 
+def general_search_request(SID, fields, timespan=None, editions=["SCI", "SSCI", "AHCI", "ISTP", "ISSHP"], sort='LC.D;PY.A;LD.D;SO.A;VL.D;PG.A;AU.A'):
+    """
+    build the WOS_GeneralSearch.do request for ISI.generalSearch() (see there for the arguments), without sending it,
+    so that the blocking (ISI) and asyncio (isi_async) clients send exactly the same thing.
+    returns (url, headers, form), where form is a list of (key, value) pairs, since ISI repeats some keys.
+    """
+    max_field_count = 25
+    
+    # There are a lot of things that get posted to this form, even though it's just the simple search.
+    # most of these were copied raw from a working query
+    # most of them are ridiculously unusable and redundant and possibly ignored on the backend
+    # but WHEN IN ROME...
+    # 
+    # For readability, I split up the construction of the POST data into a sections, with a generator for each.
+    # They are underscored to avoid conflicts with the input arguments.
+    
+    def _session():
+        """ 
+        This is header stuff needed to convince the search engine to listen to us
+        """
+        yield 'product', 'WOS' # 'UA' == "all databases", "..." == korean thing, "..." = MedLine, ...; we want WOS because WOS can give us bibliographies, not just 
+        yield 'action', 'search' 
+        yield 'search_mode', 'GeneralSearch'
+        yield 'SID', SID
+    
+    def _cruft():
+        """
+        this is crap ISI probably ignores
+        TODO: try commenting this out and seeing if anything breaks. (requires a working test suite, which is annoying because the only server to test against is the real one)
+        """
+        # (the browser is sending hardcoded error messages as options in its *query*??)
+        yield 'input_invalid_notice', 'Search Error: Please enter a search term.'
+        yield 'exp_notice', 'Search Error: Patent search term could be found in more than one family (unique patent number required for Expand option) '
+        yield 'max_field_notice', 'Notice: You cannot add another field.'
+        yield 'input_invalid_notice_limits', ' <br/>Note: Fields displayed in scrolling boxes must be combined with at least one other search field.'
+        # LOL what are these for?? "Yes, I Love Descartes Too"
+        yield 'x', '0',
+        yield 'y', '0',
+        # whyyyyyy
+        yield 'ss_query_language', 'auto'
+        yield 'ss_showsuggestions', 'ON'
+        yield 'ss_numDefaultGeneralSearchFields', '1'
+        yield 'ss_lemmatization', 'On'
+        yield 'limitStatus', 'collapsed'
+        yield 'update_back2search_link_param', 'yes'
+        #'sa_params': "UA||4ATCGy9dQvV3rtykDa3|http://apps.webofknowledge.com.proxy.lib.uwaterloo.ca|'", #<-- TODO: this seems to repeat things passed elsewhere: product, SID, and URL. The first two I can get, but the URL is tricky because I've abstracted out from coding against the UW proxy directly
+            # but I suspect the system won't notice if it's missing...
+        yield 'ss_spellchecking', 'Suggest'
+        yield 'ssStatus', 'display:none'
+        yield 'formUpdated', 'true'
+    
+    # This is the actual fields
+    # This part is rather complicated. This ISI's fault.
+    def _fields():
+        """
+        this generator walks the input and reformats it into key-value pairs 
+        returns the number of fields searched (which you need to retrieve from the StopIteration)
+        Note: the number of times this yields is larger than the number of fields actually represented, because of ISI cruft, so you can't simply len() the result.
+        """
+        for i in range(0, len(fields), 2):
+            t = (i//2)+1 #terms correspond to every other index, and are themselves indexed from 1
+            
+            # the field term
+            # TODO: wrap this in a better typecheck, because the user has to pass a complicated
+            # datastructure down and, if wrong, will get a crash in this pretty obscure place
+            (field, querystring) = fields[i]
+            
+            if isinstance(querystring, list): #TODO: be more geneerric
+                # attempt to coerce lists to the format used by GeneralSearch.do for OR'd enumerations
+                # This is to ###-separarate the points
+                # as far as I know, this is *only* used for but we'll leave that up to the user
+                querystring = str.join("###", querystring)
+            
+            yield "value(select%d)" % t, field
+            yield "value(input%d)" % t, querystring 
+            yield "value(hidInput%d)" % t, "" #the fantastic spaztastic no-op hidden input field
+            
+            # the operand term
+            if fields[i+1:]:
+                op = fields[i+1]
+                assert op in ["AND","OR","NOT","SAME","NEAR"], "ISI only knows these operators"
+                yield "value(bool_%d_%d)" % (t,t+1), op
+            else:
+                # last field; don't include the operand term
+                assert len(fields)-1 == i, "Double checking I got the if right"
+        
+        if t > max_field_count:
+            logging.warn("Submitting %d > %d fields to ISI. ISI might balk." % (fieldCount, max_field_count))
+        yield 'fieldCount', t  #the number of fields processed
+        yield 'max_field_count', max_field_count #uhhhh, and what happens if I ignore this? omg, I bet ISI is full of SQL injections. :(
+    
+    def _period():
+        """    
+         the period is actually several sub-fields together; as in fields2isi we re-interpret the python arguments into ISI's crufty form
+        """
+        #default values, as on the HTML form
+        period = "Range Selection" # this decides whether we're using the range drop down or the year dropdowns
+        range = "ALL"  #this is the value of the range dropdown
+        startYear, endYear = 1900, 2000 #this is the value of the year dropdowns
+        # obviously, only one of the latter two actually matters, but we POST both because we want to be as close to a browser as possible to avoid mishaps.
+        
+        if timespan is not None:
+            try:
+                # (startYear, endYear)
+                startYear, endYear = timespan
+                period = "Year Range"
+            except:
+                if isinstance(timespan, int):
+                    # (year,)
+                    startYear, endYear = timespan, timespan
+                    period = "Year Range"
+                else:
+                    # special-case ISI timespan
+                    assert timespan in ["ALL","Latest5Years","YearToDate","4week","2week","1week"], "ISI only knows these timespans, besides year ranges."
+                    range = timespan
+            
+        yield ("period", period)
+        yield ("startYear", startYear)
+        yield ("endYear", endYear)
+        yield ("range", range)
+    
+    def _sort_order():
+        yield 'rs_sort_by', sort
+    
+    def _editions():
+        for e in editions:
+            yield ("editions", e)
+    
+    # merge all the sections
+    # note: we have to use lists of key-value pairs and not dicts because ISI repeats some parameter names
+    # += on a list L and a generator G is the same as .extend(); note that L + G will *not* work.
+    form = []
+    form += _session()
+    form += _cruft()
+    form += _fields()
+    form += _period()
+    form += _sort_order()
+    form += _editions()
+    
+    return ("http://apps.webofknowledge.com/WOS_GeneralSearch.do",
+            {'Referer': "http://apps.webofknowledge.com/WOS_GeneralSearch.do?product=WOS&SID=%s&search_mode=GeneralSearch" % SID}, #TODO: base this URL on the data above
+            form)
+
+
 class ISI():
     """
     An API for http://apps.webofknowledge.com/wos, implemented with screen-scraping.
     """
     def __init__(self, session=None):
         """
-        if given, session should be a requests.Session to route scraping operations through
+        if given, session should be a requests.Session to route scraping operations through.
+        It is taken over, not copied: it becomes an ISISession, and shares its cookies with this ISI.
         """
         if session is None: session = requests.Session()
         if not isinstance(session, requests.Session): raise TypeError("session")
-        session = wrapper(ISISession)(session)
+        session = wrapper(ISISession, clone=False)(session)
 
         self.session = session
         
@@ -298,6 +547,9 @@ class ISI():
         r = self.session.get("http://isiknowledge.com/wos") #go to the front page like a normal person and create a session
         r.raise_for_status()
         # find the WoS SID (which is different than the ezproxy SID!)
+        # (ISISession picks it out of the redirects; without one, nothing else is going to work)
+        if self.session.SID is None:
+            raise NoSession(NoSession.KEY, "no SID at %s" % (r.url,))
         self._searchpage = r.url
         # TODO: scrape the search page to extract all the form fields and the form target
         # TODO.. other key things to scrape??
@@ -306,149 +558,15 @@ class ISI():
     def _generalSearch(self, *fields, timespan=None, editions=["SCI", "SSCI", "AHCI", "ISTP", "ISSHP"], sort='LC.D;PY.A;LD.D;SO.A;VL.D;PG.A;AU.A'):
         """
         Backend for generalSearch(); factored out since some of the other extractions *can only work by first doing a regular search*. ugh.
+        The request itself is built by general_search_request().
         
         returns HTTPResponse
         """
-        max_field_count = 25
-        
-        # There are a lot of things that get posted to this form, even though it's just the simple search.
-        # most of these were copied raw from a working query
-        # most of them are ridiculously unusable and redundant and possibly ignored on the backend
-        # but WHEN IN ROME...
-        # 
-        # For readability, I split up the construction of the POST data into a sections, with a generator for each.
-        # They are underscored to avoid conflicts with the input arguments.
-        
-        def _session():
-            """ 
-            This is header stuff needed to convince the search engine to listen to us
-            """
-            yield 'product', 'WOS' # 'UA' == "all databases", "..." == korean thing, "..." = MedLine, ...; we want WOS because WOS can give us bibliographies, not just 
-            yield 'action', 'search' 
-            yield 'search_mode', 'GeneralSearch'
-            yield 'SID', self.session.SID
-        
-        def _cruft():
-            """
-            this is crap ISI probably ignores
-            TODO: try commenting this out and seeing if anything breaks. (requires a working test suite, which is annoying because the only server to test against is the real one)
-            """
-            # (the browser is sending hardcoded error messages as options in its *query*??)
-            yield 'input_invalid_notice', 'Search Error: Please enter a search term.'
-            yield 'exp_notice', 'Search Error: Patent search term could be found in more than one family (unique patent number required for Expand option) '
-            yield 'max_field_notice', 'Notice: You cannot add another field.'
-            yield 'input_invalid_notice_limits', ' <br/>Note: Fields displayed in scrolling boxes must be combined with at least one other search field.'
-            # LOL what are these for?? "Yes, I Love Descartes Too"
-            yield 'x', '0',
-            yield 'y', '0',
-            # whyyyyyy
-            yield 'ss_query_language', 'auto'
-            yield 'ss_showsuggestions', 'ON'
-            yield 'ss_numDefaultGeneralSearchFields', '1'
-            yield 'ss_lemmatization', 'On'
-            yield 'limitStatus', 'collapsed'
-            yield 'update_back2search_link_param', 'yes'
-            #'sa_params': "UA||4ATCGy9dQvV3rtykDa3|http://apps.webofknowledge.com.proxy.lib.uwaterloo.ca|'", #<-- TODO: this seems to repeat things passed elsewhere: product, SID, and URL. The first two I can get, but the URL is tricky because I've abstracted out from coding against the UW proxy directly
-                # but I suspect the system won't notice if it's missing...
-            yield 'ss_spellchecking', 'Suggest'
-            yield 'ssStatus', 'display:none'
-            yield 'formUpdated', 'true'
-        
-        # This is the actual fields
-        # This part is rather complicated. This ISI's fault.
-        def _fields():
-            """
-            this generator walks the input and reformats it into key-value pairs 
-            returns the number of fields searched (which you need to retrieve from the StopIteration)
-            Note: the number of times this yields is larger than the number of fields actually represented, because of ISI cruft, so you can't simply len() the result.
-            """
-            for i in range(0, len(fields), 2):
-                t = (i//2)+1 #terms correspond to every other index, and are themselves indexed from 1
-                
-                # the field term
-                # TODO: wrap this in a better typecheck, because the user has to pass a complicated
-                # datastructure down and, if wrong, will get a crash in this pretty obscure place
-                (field, querystring) = fields[i]
-                
-                if isinstance(querystring, list): #TODO: be more geneerric
-                    # attempt to coerce lists to the format used by GeneralSearch.do for OR'd enumerations
-                    # This is to ###-separarate the points
-                    # as far as I know, this is *only* used for but we'll leave that up to the user
-                    querystring = str.join("###", querystring)
-                
-                yield "value(select%d)" % t, field
-                yield "value(input%d)" % t, querystring 
-                yield "value(hidInput%d)" % t, "" #the fantastic spaztastic no-op hidden input field
-                
-                # the operand term
-                if fields[i+1:]:
-                    op = fields[i+1]
-                    assert op in ["AND","OR","NOT","SAME","NEAR"], "ISI only knows these operators"
-                    yield "value(bool_%d_%d)" % (t,t+1), op
-                else:
-                    # last field; don't include the operand term
-                    assert len(fields)-1 == i, "Double checking I got the if right"
-            
-            if t > max_field_count:
-                logging.warn("Submitting %d > %d fields to ISI. ISI might balk." % (fieldCount, max_field_count))
-            yield 'fieldCount', t  #the number of fields processed
-            yield 'max_field_count', max_field_count #uhhhh, and what happens if I ignore this? omg, I bet ISI is full of SQL injections. :(
-        
-        def _period():
-            """    
-             the period is actually several sub-fields together; as in fields2isi we re-interpret the python arguments into ISI's crufty form
-            """
-            #default values, as on the HTML form
-            period = "Range Selection" # this decides whether we're using the range drop down or the year dropdowns
-            range = "ALL"  #this is the value of the range dropdown
-            startYear, endYear = 1900, 2000 #this is the value of the year dropdowns
-            # obviously, only one of the latter two actually matters, but we POST both because we want to be as close to a browser as possible to avoid mishaps.
-            
-            if timespan is not None:
-                try:
-                    # (startYear, endYear)
-                    startYear, endYear = timespan
-                    period = "Year Range"
-                except:
-                    if isinstance(timespan, int):
-                        # (year,)
-                        startYear, endYear = timespan, timespan
-                        period = "Year Range"
-                    else:
-                        # special-case ISI timespan
-                        assert timespan in ["ALL","Latest5Years","YearToDate","4week","2week","1week"], "ISI only knows these timespans, besides year ranges."
-                        range = timespan
-                
-            yield ("period", period)
-            yield ("startYear", startYear)
-            yield ("endYear", endYear)
-            yield ("range", range)
-        
-        def _sort_order():
-            yield 'rs_sort_by', sort
-        
-        def _editions():
-            for e in editions:
-                yield ("editions", e)
-        
-        # merge all the sections
-        # note: we have to use lists of key-value pairs and not dicts because ISI repeats some parameter names
-        # += on a list L and a generator G is the same as .extend(); note that L + G will *not* work.
-        form = []
-        form += _session()
-        form += _cruft()
-        form += _fields()
-        form += _sort_order()
-        form += _editions()
-        
-        #print(form) #DEBUG
-        #import IPython; IPython.embed() #DEBUG
+        url, headers, form = general_search_request(self.session.SID, fields, timespan=timespan, editions=editions, sort=sort)
         
         # Do the query
         # this causes ISI to create and cache a resultset
-        r = self.session.post("http://apps.webofknowledge.com/WOS_GeneralSearch.do",
-                headers={'Referer': "http://apps.webofknowledge.com/WOS_GeneralSearch.do?product=WOS&SID=%s&search_mode=GeneralSearch" % self.session.SID}, #TODO: base this URL on the data above
-                data=form)
+        r = self.session.post(url, headers=headers, data=form)
         return r
         
     def generalSearch(self, *fields, timespan=None, editions=["SCI", "SSCI", "AHCI", "ISTP", "ISSHP"], sort='LC.D;PY.A;LD.D;SO.A;VL.D;PG.A;AU.A'):
@@ -547,6 +665,54 @@ class ISI():
         assert Q._search_mode == 'GeneralSearch'
         return Q
         
+    def partition(self, *fields, years, limit=LOTS, spans=None, editions=["SCI", "SSCI", "AHCI", "ISTP", "ISSHP"], sort='LC.D;PY.A;LD.D;SO.A;VL.D;PG.A;AU.A'):
+        """
+        generalSearch(*fields), split into searches over disjoint ranges of years (timespan=), each small enough to rip():
+        ranges are bisected until each has at most limit records. A single year can't be split any further,
+        so a year with more than that is left as it is, with a warning (and rip() will stop at its upper_limit).
+        years: (first, last), inclusive; the whole query is searched over these years too
+        spans: start from these (first, last) ranges instead of from years, e.g. a previous partition's, to get the same
+               parts again (and so the same block names, when resuming); any that have grown too big are split further
+        
+        The parts' counts are checked against the whole query's: they must add up, unless some are estimated,
+        in which case a mismatch is only warned about.
+        Returns an ISIPartition.
+        """
+        def search(span):
+            try:
+                return self.generalSearch(*fields, timespan=span, editions=editions, sort=sort)
+            except NoRecordsFound:
+                return None
+        
+        parts = []
+        def split(span, Q):
+            first, last = span
+            if Q is None:
+                return #no records in these years
+            if len(Q) <= limit:
+                parts.append((span, Q))
+            elif first == last:
+                logging.warning("%d alone has %d records, more than %d, and can't be split any further" % (first, len(Q), limit))
+                parts.append((span, Q))
+            else:
+                mid = (first + last) // 2
+                for half in ((first, mid), (mid+1, last)):
+                    split(half, search(half))
+        
+        years = tuple(years)
+        whole = search(years)
+        for span in (spans or [years]):
+            span = tuple(span)
+            split(span, whole if span == years else search(span))
+        partition = ISIPartition(parts)
+        if whole is not None and len(partition) != len(whole):
+            msg = "the %d parts add up to %d records, but the whole query has %d" % (len(parts), len(partition), len(whole))
+            if whole.estimated or partition.estimated:
+                logging.warning(msg + " (estimated)")
+            else:
+                raise RuntimeError(msg)
+        return partition
+    
     def advancedSearch(self, query):
         """
         query should be a string in the form
@@ -637,7 +803,7 @@ class ISI():
         r = self._generalSearch(("UT", document))
         r.raise_for_status()
         
-        soup = BeautifulSoup(r.content)
+        soup = parse_page(r.content, RESULTS)
         
         records = soup(class_="search-results-item")
         assert len(records) == 1, "Since we searched by WOS number, we should only have one result"
@@ -683,6 +849,275 @@ class ISI():
     #    return "<%s: %s " % (type(self),) #???
 
 
+# ----------------------------- session cache
+
+# Logging in to the proxy is a few round trips, and ISI() is one more; a saved session lets the next run skip the login:
+# its cookies go back into a fresh (not logged in) session, and ISI()'s front page request doubles as the check that they still work.
+# The ISI SID isn't saved: that same request hands it out again (the same one, if ISI's session is still alive).
+SESSION_CACHE = os.path.expanduser("~/.isi_scrape_session.json")
+SESSION_LIFETIME = 60*60 #seconds; well inside EzProxy's default two hour idle timeout
+
+def save_session(fname, session, lifetime=SESSION_LIFETIME):
+    """
+    save session's cookies and EzProxy login to fname, for load_session().
+    The file is as good as your library login until it expires, so only you can read it.
+    """
+    state = {'address': getattr(session, "address", None),
+             'user': getattr(session, "_user", None),
+             'expires': time.time() + lifetime,
+             'cookies': [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+                          'secure': c.secure, 'expires': c.expires} for c in session.cookies]}
+    fd = os.open(fname + ".part", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+    os.chmod(fname + ".part", 0o600) #in case it was already there, with other permissions
+    os.replace(fname + ".part", fname)
+
+def load_session(fname, session, user=None):
+    """
+    restore a session saved by save_session() into session, a fresh requests.Session (an EzProxy must not be logged in yet).
+    user: only restore a session saved for this user; by default, whoever session is for
+          (an EzProxy made with login=False still knows whose login it is waiting for)
+    returns whether there was anything usable to restore: not if there was no file, an expired one, or one for another user or proxy.
+    Whether ISI still accepts it can only be found out by asking; ISI() does (see NoSession).
+    """
+    try:
+        with open(fname) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if user is None:
+        user = getattr(session, "_user", None)
+    now = time.time()
+    if state.get('expires', 0) < now:
+        logging.info("saved session in %s has expired" % (fname,))
+        return False
+    if state.get('address') != getattr(session, "address", None) or (user is not None and state.get('user') != user):
+        logging.info("saved session in %s is for someone else" % (fname,))
+        return False
+    for c in state.get('cookies', []):
+        if c['expires'] is not None and c['expires'] < now:
+            continue
+        session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'], secure=c['secure'], expires=c['expires'])
+    if isinstance(session, EzProxy):
+        session._logged_in = True
+        session._user = state['user']
+    return True
+
+
+# ----------------------------- block manifest
+
+CHUNK = 1 << 20 #how much of an export to read at a time
+MANIFEST = "manifest.tsv" #rip() records every finished block here, one per line
+MANIFEST_FIELDS = ['file', 'start', 'end', 'format', 'records', 'bytes', 'sha256', 'date']
+
+class BlockSummer:
+    """
+    the sha256, size and record count of an export, fed to it a chunk at a time as it downloads.
+    Records are counted by their "ER" end-of-record lines in the field-tagged formats,
+    and by lines (less the header) in the tab-delimited ones.
+    """
+    def __init__(self, format="fieldtagged"):
+        self.hash = hashlib.sha256()
+        self.bytes = 0
+        self.lines = 0
+        self.tab = EXTENSIONS.get(format) == TAB_SUFFIX
+        self._decoder = codecs.getincrementaldecoder("utf-16" if "Unicode" in format else "utf-8-sig")(errors="replace")
+        self._tail = ""
+    
+    def update(self, chunk):
+        self.hash.update(chunk)
+        self.bytes += len(chunk)
+        text = self._decoder.decode(chunk)
+        if self.tab:
+            self.lines += text.count("\n")
+        else:
+            # carry the end of the last chunk over, so an "\nER\n" split between chunks still counts (exactly once: the carry is shorter than the pattern)
+            text = self._tail + text
+            self.lines += text.count("\nER\n") + text.count("\nER\r")
+            self._tail = text[-3:]
+    
+    @property
+    def records(self):
+        return max(self.lines - 1, 0) if self.tab else self.lines
+    
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+def block_entry(fname, start, end, format, summer):
+    "the manifest entry for block fname, which summer has seen all of"
+    return {'file': os.path.basename(fname), 'start': start, 'end': end, 'format': format,
+            'records': summer.records, 'bytes': summer.bytes, 'sha256': summer.hexdigest()}
+
+def summarize_file(fname, start, end, format="fieldtagged"):
+    "the manifest entry for an already downloaded block"
+    summer = BlockSummer(format)
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            summer.update(chunk)
+    return block_entry(fname, start, end, format, summer)
+
+def read_manifest(directory):
+    "{file name: manifest entry (a dict of strings)}; later entries for the same file win"
+    entries = {}
+    path = os.path.join(directory, MANIFEST)
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            header = next(f, "").rstrip("\n").split("\t")
+            for line in f:
+                entry = dict(zip(header, line.rstrip("\n").split("\t")))
+                entries[entry['file']] = entry
+    return entries
+
+_manifest_lock = threading.Lock() #rips of different result sets can share a manifest, from different threads (see ISIPartition)
+
+def append_manifest(directory, entry, fsync=False):
+    "record a finished block; with fsync, the block's rename and the manifest line are on disk before this returns"
+    path = os.path.join(directory, MANIFEST)
+    entry = dict(entry, date=entry.get('date') or datetime.datetime.now().isoformat(timespec="seconds"))
+    with _manifest_lock, open(path, "a", encoding="utf-8") as f:
+        if f.tell() == 0:
+            f.write("\t".join(MANIFEST_FIELDS) + "\n")
+        f.write("\t".join(str(entry[k]) for k in MANIFEST_FIELDS) + "\n")
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        # and the directory, which is what holds the renames
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def plan_rip(N, directory=".", overwrite=False, upper_limit=LOTS, format="fieldtagged", fsync=False, prefix=""):
+    """
+    the blocks rip() still has to export to get N records into directory, as (start, end, file name) triples,
+    after checking the ones already on disk against the manifest (and adding any that are missing from it).
+    File names are relative to directory, and start with prefix (see part_prefix()).
+    This needs no connection, so it can be used to decide whether to make one.
+    """
+    if format not in EXTENSIONS:
+        raise ValueError("rip() can only export formats isiparse can read: %s" % (", ".join(sorted(EXTENSIONS)),))
+    ext = EXTENSIONS[format]
+    manifest = read_manifest(directory)
+    
+    # hard limit the number of records to scrape
+    L = 0
+    if upper_limit: U = min(N, upper_limit)
+    else: U = N
+    
+    # A bunch of things in this one-liner:
+    # - L and U are overwritten. deal with it.
+    # - the chain() produces the endpoints of each MAX_EXPORT-large block
+    #   - the inner range() gives all endpoints *except* the last one (because range() is half-open in python), so we have to tack it on.
+    # - ISI ranges are closed, not half-open like python, so need to adjust:
+    #   - ISI starts counting at 1 (of course, why wouldn't it?) so we start counting at 1
+    # note!: the web UI declines to let you export more records than available, however the API will accept such a request and just the subset available
+    #       so we could just request 500 records at a time, but that feel dangerous, and it also makes the last export get named wrong
+    blocks = ((L+1, U) for L, U in pairs(chain(range(L, U, MAX_EXPORT), [U])))
+    todo = [] #blocks still to download
+    for L, U in blocks:
+        fname = "%s%04d-%04d%s" % (prefix, L,U, ext) #XXX the '4' is a hardcode: most cases will have a few thousand
+        path = os.path.join(directory, fname)
+        if not overwrite and os.path.exists(path):
+            # skip results we already have
+            # notice: this is done at the block level.
+            #         so weird things can happen, especially if the DB has changed between rips
+            #  A better method would key on individual records, but that means (i think) having results indexed by WOS number or something, which means stuffing them into SQL or making a giant folder with one file per record, which we *could* do but is more than I want to both with at the moment. And more importantly, there's no way to guess from WOS number , so we'd have to use the integer location of the record *within this resultset* which is a hard. so no.
+            assert os.path.isfile(path)
+            entry = manifest.get(fname)
+            if entry is None:
+                # from before manifests, or the rename went through but the manifest line didn't:
+                # blocks only get their final name once complete, so it's good; read it once to record it
+                logging.info("%s is not in the manifest; adding it" % (fname,))
+                append_manifest(directory, summarize_file(path, L, U, format), fsync)
+                continue
+            if int(entry['bytes']) == os.path.getsize(path):
+                continue #trusted, without reading it
+            logging.warning("%s is %d bytes, but the manifest says %s; downloading it again" % (fname, os.path.getsize(path), entry['bytes']))
+        todo.append((L, U, fname))
+    return todo
+
+PARAMETERS = "parameters.txt" #what the command line rip was of, see __main__
+HANDLE = "results.json" #and the result set it is ripping, see ISIResults.save()
+
+def part_prefix(span):
+    "the file name prefix of the blocks of the part of an ISIPartition covering the years span = (first, last)"
+    return "%d-%d_" % span
+
+def format_parts(partition):
+    "an ISIPartition's parts for parameters.txt: first-last:count for each, with a ~ after estimated counts"
+    return " ".join("%d-%d:%d%s" % (span + (len(Q), "~" if Q.estimated else "")) for span, Q in partition.parts)
+
+def read_parameters(directory):
+    """
+    the parameters.txt of a command line rip in directory, as a dict, with Records an int, Estimated a bool,
+    and Format (which older rips didn't record) defaulting to fieldtagged; None if there isn't one.
+    A partitioned rip's Parts become a list of (file name prefix, count, estimated), see format_parts().
+    """
+    path = os.path.join(directory, PARAMETERS)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as params:
+        params = dict(l.replace("\n","").split(": ", 1) for l in params if ": " in l)
+    assert 'Records' in params
+    params['Records'] = int(params['Records'])
+    if 'Estimated' in params:
+        params['Estimated'] = bool(int(params['Estimated']))
+    params.setdefault('Format', "fieldtagged")
+    if 'Parts' in params:
+        parts = []
+        for part in params['Parts'].split():
+            span, count = part.split(":")
+            first, last = span.split("-")
+            parts.append((part_prefix((int(first), int(last))), int(count.rstrip("~")), count.endswith("~")))
+        params['Parts'] = parts
+    return params
+
+def plan_resume(directory, params, upper_limit=LOTS):
+    """
+    the blocks resuming the rip in directory still needs, worked out offline from its parameters (see read_parameters())
+    and manifest: every block missing from anywhere in the range, not just the end. Empty if the rip is complete.
+    For a partitioned rip, that's the blocks missing from each of its parts.
+    
+    An estimated count can promise more records than ISI has, and then rip() stops at the first block past the real end.
+    So for those, blocks after a block that came back short, or after the last block of a rip that finished
+    (Completed in its parameters), aren't missing: they don't exist.
+    """
+    todo = []
+    for prefix, N, estimated in params.get('Parts') or [("", params['Records'], params.get('Estimated'))]:
+        part = plan_rip(N, directory, upper_limit=upper_limit, format=params['Format'], prefix=prefix)
+        if estimated and part:
+            have = [e for e in read_manifest(directory).values() if e['file'].startswith(prefix) and e['format'] == params['Format'] and os.path.isfile(os.path.join(directory, e['file']))]
+            ends = [int(e['start']) for e in have if int(e['records']) < int(e['end']) - int(e['start']) + 1]
+            if not ends and 'Completed' in params and have:
+                ends = [max(int(e['start']) for e in have)]
+            if ends:
+                part = [block for block in part if block[0] <= min(ends)]
+        todo.extend(part)
+    return todo
+
+
+_pool_lock = threading.Lock()
+
+def ensure_pool(session, connections):
+    """
+    make sure session can keep at least `connections` connections open to one host, for that many threads to share.
+    Adapters that are already big enough are left alone (a partitioned rip comes through here once per part);
+    smaller ones are replaced, and closed, rather than left to leak their pools.
+    """
+    with _pool_lock:
+        for scheme in ("http://", "https://"):
+            old = session.adapters.get(scheme)
+            if old is not None and getattr(old, "_pool_maxsize", 0) >= connections:
+                continue
+            session.mount(scheme, requests.adapters.HTTPAdapter(pool_maxsize=max(connections, requests.adapters.DEFAULT_POOLSIZE)))
+            if old is not None:
+                old.close()
+
+
 class ISIResults:
     """
     You need to create queries in order to extract anything from WOS,
@@ -724,7 +1159,7 @@ class ISIResults:
             raise TypeError("session")
         http_response.raise_for_status() #XXX does this belong in here or outside?
         
-        soup = BeautifulSoup(http_response.content)
+        soup = page_soup(http_response) #already parsed by raise_for_status() if it was an error page
         
         qid = extract_qid(soup)
         count, estimated = extract_count(soup)
@@ -736,10 +1171,62 @@ class ISIResults:
         return self._len
     
     
-    def _export(self, start, end, format="fieldtagged"):
+    # A result set is only a handful of numbers, and ISI keeps it for as long as the session lasts,
+    # so it can be saved and picked up again, by a later run or another process, without searching again
+    # (which costs requests, and can come back with a different count).
+    
+    def to_dict(self):
+        "what it takes to find this result set again; see from_dict()"
+        return {'SID': self.session.SID, 'search_mode': self._search_mode, 'qid': self.qid, 'referer': self.referer,
+                'N': self._len, 'estimated': self.estimated}
+    
+    @classmethod
+    def from_dict(cls, state, session):
         """
-        backend for export()
-        start and end are an *inclusive* range
+        a result set saved by to_dict(), attached to session: a requests.Session logged in to the same ISI session
+        (e.g. restored with load_session(), or the .session of an ISI()), since ISI keeps result sets per SID
+        and a qid means nothing in any other. A session that has no SID yet takes the saved one, so a worker
+        can go straight from load_session() to exporting, without a single request.
+        raises ValueError if session is in a different ISI session. Whether ISI still has the result set is for probe() to say
+        (if ISI has since moved the session on to a new SID, it hasn't: see NewSession).
+        """
+        if isinstance(session, requests.Session) and not isinstance(session, ISISession):
+            session = wrapper(ISISession, clone=False)(session)
+        if session.SID is None:
+            session.SID = state['SID']
+        elif session.SID != state['SID']:
+            raise ValueError("result set %s belongs to ISI session %s, not %s" % (state['qid'], state['SID'], session.SID))
+        return cls(session, state['search_mode'], state['qid'], state['referer'], N=state['N'], estimated=state['estimated'])
+    
+    def save(self, fname):
+        with open(fname + ".part", "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(fname + ".part", fname)
+    
+    @classmethod
+    def load(cls, fname, session):
+        "from_dict(), from a file written by save()"
+        with open(fname) as f:
+            return cls.from_dict(json.load(f), session)
+    
+    def probe(self):
+        """
+        is this result set still there on ISI's end? Costs one single-record export.
+        Not if ISI answers with an error, or with a new SID (NewSession), which leaves the session's SID as it was.
+        (An expired proxy login isn't an answer either way, so that still raises.)
+        """
+        try:
+            self._export(1, 1).raise_for_status()
+        except ISIError as exc:
+            logging.info("result set %s is gone: %s" % (self.qid, exc))
+            return False
+        return True
+    
+    def _export_request(self, start, end, format="fieldtagged"):
+        """
+        build the OutboundService.do request that exports records start through end (an *inclusive* range), without sending it,
+        so that the blocking and asyncio (isi_async) exports send exactly the same thing.
+        returns (url, headers, params)
         """
         assert 0 <= start <= end
         assert end - start < 500, "ISI disallows more than 500 records at a time"
@@ -838,13 +1325,20 @@ class ISIResults:
             raise ValueError("Unknown search_mode '%s'" % (self._search_mode,)) #XXX check this in __init__ instead?
         
         assert len(params) == 27, "Expected number of params, extracted by hand-counting in Firefox's web inspector"
+        return "http://apps.webofknowledge.com/OutboundService.do?action=go", {'Referer': self.referer}, params
+    
+    def _export(self, start, end, format="fieldtagged", stream=False):
+        """
+        backend for export()
+        start and end are an *inclusive* range
+        stream: passed on to requests; with stream=True the body is left to be read by the caller
+        """
+        url, headers, params = self._export_request(start, end, format)
         # fire!
-        r = self.session.post("http://apps.webofknowledge.com/OutboundService.do?action=go",
-                           headers={'Referer': self.referer},
-                           data=params)
+        r = self.session.post(url, headers=headers, data=params, stream=stream)
         return r
     
-    def export(self, fname, start=1, end=500, format="fieldtagged"):
+    def export(self, fname, start=1, end=500, format="fieldtagged", fsync=False):
         """
         Request records export via the "Save to Other File Formats" dialog.
         Export records for the current query startinf running start through end-1.
@@ -855,16 +1349,25 @@ class ISIResults:
          - bibtex                       -- for LaTeX junkies
          - html                         -- if you hate yourself
         
-        Returns the HTTP response from ISI's OutboundService.do,
-        because I don't want to corner your choices, though this
-        does mean you get more information than you expect, probably.
+        The body is streamed to fname in CHUNK-sized pieces, never held in memory all at once,
+        and hashed and counted on the way past (see BlockSummer).
+        fsync: fsync fname before returning, so it is on disk and not just in the OS's cache
+        
+        Returns the manifest entry for the block (see MANIFEST_FIELDS), for rip() to record.
         """
-        r = self._export(start, end, format)
+        r = self._export(start, end, format, stream=True)
         r.raise_for_status()
         
-        # TODO: logging.debug()
+        summer = BlockSummer(format)
         with open(fname,"wb") as w:
-            w.write(r.content) #.content == binary => "wb"; .text would => "w"
+            for chunk in r.iter_content(CHUNK):
+                summer.update(chunk)
+                w.write(chunk)
+            if fsync:
+                w.flush()
+                os.fsync(w.fileno())
+        logging.debug("exported %d records (%d bytes) to %s" % (summer.records, summer.bytes, fname))
+        return block_entry(fname, start, end, format, summer)
     
     
     def bulk_inlinks(self, loops=True):
@@ -912,7 +1415,7 @@ class ISIResults:
                               headers={'Referer': base},
                               params=params)
         r.raise_for_status()
-        soup = BeautifulSoup(r.content)
+        soup = page_soup(r)
         
         # 2) "click" TotalCitingArticles.do, given the CitationReport qid
         #  this will make a third qid with search_mode == "TotalCitingArticles"
@@ -952,57 +1455,126 @@ class ISIResults:
         return Q
         
     
-    def rip(self, overwrite=False, upper_limit=LOTS):
+    def _rip_block(self, L, U, fname, format="fieldtagged", fsync=False):
+        "export one block for rip(), atomically: it only gets its real name once it's complete"
+        block = self.export(fname+".part", L, U, format, fsync=fsync)
+        os.replace(fname+".part", fname) #by using a .part file we can tolerate partial rips (for simplicity, individual blocks are redownloaded in their entirety)
+        block['file'] = fname
+        return block
+    
+    def _rip_plan(self, overwrite=False, upper_limit=LOTS, format="fieldtagged", fsync=False, prefix=""):
+        "the blocks rip() still has to export into the current directory; see plan_rip()"
+        return plan_rip(len(self), ".", overwrite, upper_limit, format, fsync, prefix)
+    
+    def rip(self, overwrite=False, upper_limit=LOTS, format="fieldtagged", fsync=False, workers=1, prefix=""):
         """
         Export all records available in this query.
         
         fname: file name. used as a template: if fname == "fname.ext" then records will be exported to ["fname_0001.ext", "fname_0501.ext", ...] 
+        Each finished block gets a line in the folder's manifest (see MANIFEST); on a resume, blocks in the manifest
+        whose size still matches are trusted as they are, without being re-read.
         upper_limit: the largest record index to export; use this to make an easy guarantee that you won't get stomped by ISI for chewing through their data.
                      if you are a fool, set to None to disable
+        format: export format, one of EXTENSIONS; blocks are named with the matching extension.
+                The tab-delimited formats (e.g. winTabUTF8) are one record per line, so they are much cheaper to parse afterwards.
+        fsync: fsync each block (and the manifest) before recording it as done, so a crash or power cut can't leave
+               a block the manifest vouches for half-written
+        workers: how many blocks to export at once, over one pool of connections. They all still go through the
+                 session's rate limiter (see PoliteSession), so this hides round trips rather than hitting ISI harder.
+                 Blocks are reported, and recorded in the manifest, in order regardless.
+        prefix: put this in front of every block's file name, so several result sets can be ripped into one folder (see ISIPartition)
         """
+        todo = self._rip_plan(overwrite, upper_limit, format, fsync, prefix)
         
-        # hard limit the number of records to scrape
-        L = 0
-        if upper_limit: U = min(len(self), upper_limit)
-        else: U = len(self)
-        
-        # A bunch of things in this one-liner:
-        # - L and U are overwritten. deal with it.
-        # - the chain() produces the endpoints of each MAX_EXPORT-large block
-        #   - the inner range() gives all endpoints *except* the last one (because range() is half-open in python), so we have to tack it on.
-        # - ISI ranges are closed, not half-open like python, so need to adjust:
-        #   - ISI starts counting at 1 (of course, why wouldn't it?) so we start counting at 1
-        # note!: the web UI declines to let you export more records than available, however the API will accept such a request and just the subset available
-        #       so we could just request 500 records at a time, but that feel dangerous, and it also makes the last export get named wrong
-        blocks = ((L+1, U) for L, U in pairs(chain(range(L, U, MAX_EXPORT), [U])))
-        for L, U in blocks:
-            fname = "%04d-%04d.ciw" % (L,U) #XXX the '4' is a hardcode: most cases will have a few thousand
-            if not overwrite and os.path.exists(fname):
-                # skip results we already have
-                # notice: this is done at the block level.
-                #         so weird things can happen, especially if the DB has changed between rips
-                #  A better method would key on individual records, but that means (i think) having results indexed by WOS number or something, which means stuffing them into SQL or making a giant folder with one file per record, which we *could* do but is more than I want to both with at the moment. And more importantly, there's no way to guess from WOS number , so we'd have to use the integer location of the record *within this resultset* which is a hard. so no.
-                assert os.path.isfile(fname)
-                continue
+        if workers > 1:
+            # one connection per worker, rather than requests' default pool of 10 that the workers would fight over
+            ensure_pool(self.session, workers)
+        
+        # a window of at most `workers` blocks in flight, collected in block order
+        todo = iter(todo)
+        window = deque()
+        def submit():
+            for L, U, fname in islice(todo, 1):
+                window.append(((L, U, fname), pool.submit(self._rip_block, L, U, fname, format, fsync)))
+        
+        with ThreadPoolExecutor(max(workers, 1)) as pool:
             try:
-                print("Exporting records [%d,%d] to %s" % (L,U, fname)) #TODO: if we start multiprocessing it would be useful to see the search query
-                r = self.export(fname+".part", L, U)
-                os.renames(fname+".part", fname) #by using a .part file we can tolerate partial rips (for simplicity, individual blocks are redownloaded in their entirety)
-            except InvalidInput as exc:
-                logging.error("Quitting on block [%d,%d), instead of reaching expected count %d" % (L,U,len(self))) #DEBUG
-                if self.estimated:
-                    # if we run off the end of the query because our count
-                    # was wrong because it was an estimate, it is not an error
-                    break
-                else:
-                    # all other ISI errors, or anything else, are thrown up the stack
-                    raise
-        assert not glob("*.part"), "successful rip() should leave no partial downloads"
+                for _ in range(max(workers, 1)):
+                    submit()
+                while window:
+                    (L, U, fname), future = window.popleft()
+                    try:
+                        block = future.result()
+                    except InvalidInput as exc:
+                        logging.error("Quitting on block [%d,%d), instead of reaching expected count %d" % (L,U,len(self))) #DEBUG
+                        if self.estimated:
+                            # if we run off the end of the query because our count
+                            # was wrong because it was an estimate, it is not an error
+                            # (blocks after this one are past the end too; the ones already in flight will fail the same way)
+                            for _, f in window:
+                                f.cancel()
+                            break
+                        else:
+                            # all other ISI errors, or anything else, are thrown up the stack
+                            raise
+                    print("Exported records [%d,%d] to %s: %d records" % (L,U, fname, block['records']))
+                    append_manifest(".", block, fsync)
+                    submit()
+            finally:
+                for _, f in window:
+                    f.cancel()
+                for (L, U, fname), f in window:
+                    # wait out whatever was already running; anything that finished fine is still good
+                    if not f.cancelled() and f.exception() is None:
+                        append_manifest(".", f.result(), fsync)
+        assert not glob(escape_glob(prefix) + "*.part"), "successful rip() should leave no partial downloads"
     
     def __str__(self):
         return "<%s: %d records%s>" % (type(self).__name__, len(self), " (approximately)" if self.estimated else "") #<-- this could be better
 
 
+class ISIPartition:
+    """
+    A query too big to rip() in one go, as a list of ((first year, last year), ISIResults) parts over disjoint ranges of years;
+    see ISI.partition(). It does len(), .estimated and rip() like an ISIResults, so it can stand in for one.
+    """
+    def __init__(self, parts):
+        self.parts = parts
+    
+    def __len__(self):
+        return sum(len(Q) for span, Q in self.parts)
+    
+    @property
+    def estimated(self):
+        return any(Q.estimated for span, Q in self.parts)
+    
+    def rip(self, overwrite=False, upper_limit=LOTS, format="fieldtagged", fsync=False, workers=1, parts_at_once=1):
+        """
+        rip every part into the current directory, with one manifest for all of them;
+        each part's blocks are named after its years (see part_prefix()), e.g. 1990-1995_0001-0500.ciw.
+        parts_at_once: how many parts to rip at once (each of them `workers` blocks at a time);
+                       everything still goes through the one session's rate limiter.
+        See ISIResults.rip() for the rest.
+        """
+        def rip(part):
+            span, Q = part
+            print("Ripping %d-%d: %s%d records" % (span + ("an estimated " if Q.estimated else "", len(Q))))
+            Q.rip(overwrite=overwrite, upper_limit=upper_limit, format=format, fsync=fsync, workers=workers, prefix=part_prefix(span))
+        
+        if parts_at_once > 1:
+            for session in {id(Q.session): Q.session for span, Q in self.parts}.values():
+                ensure_pool(session, parts_at_once * max(workers, 1)) #up front, so the parts find it big enough already
+            with ThreadPoolExecutor(parts_at_once) as pool:
+                for _ in pool.map(rip, self.parts):
+                    pass
+        else:
+            for part in self.parts:
+                rip(part)
+    
+    def __str__(self):
+        return "<%s: %d records in %d parts%s>" % (type(self).__name__, len(self), len(self.parts), " (approximately)" if self.estimated else "")
+
+
 # ----------------------------- main
 
 if __name__ == '__main__':
@@ -1016,6 +1588,14 @@ if __name__ == '__main__':
     ap.add_argument('barcode', type=str, help="Your 14 digit library card barcode number (not your student ID!)")
     ap.add_argument('query', type=str, nargs="+", help="A query in the form FD=filter where FD is the field and filter is what to search for in that field.")
     ap.add_argument('-o', '--overwrite', action="store_true", help="Overwrite previous scrapes. By default, only append new records, if any.")
+    ap.add_argument('--max-rate', type=float, default=PoliteSession.MAX_RATE, help="Never make more than this many requests per second. Below it, the rate adapts to how well ISI is keeping up. (default: %(default)s)")
+    ap.add_argument('-w', '--workers', type=int, default=1, help="Export this many blocks at once. The rate limit (--max-rate) still applies to all of them together. (default: %(default)s)")
+    ap.add_argument('-p', '--partition', metavar="YEARS", help="Split the query into parts over ranges of publication years within YEARS (e.g. 1900-2016), each small enough to rip, and rip them all into the one folder.")
+    ap.add_argument('--parts-at-once', type=int, default=1, help="With --partition, rip this many parts at once. (default: %(default)s)")
+    ap.add_argument('--fsync', action="store_true", help="fsync every block before recording it in the manifest, for rips that must survive crashes")
+    ap.add_argument('-f', '--format', choices=sorted(EXTENSIONS), help="Export format. The tab-delimited ones (e.g. winTabUTF8) are faster to parse. (default: fieldtagged, or what the rip being resumed used)")
+    ap.add_argument('--session-cache', default=SESSION_CACHE, help="Save the logged in session here, and reuse it on the next run if it hasn't expired, instead of logging in again. (default: %(default)s)")
+    ap.add_argument('--no-session-cache', dest="session_cache", action="store_const", const=None, help="Always log in afresh, and don't save the session")
     ap.add_argument('-q', '--quiet', action="store_true", help="Silence most output")
     ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
     ap.add_argument('-y', '--yes', action="store_true", help="Automatically choose yes to any prompts.")
@@ -1038,6 +1618,8 @@ if __name__ == '__main__':
     Tip: to work with the session and query objects after scrape is complete (or, equally well, to debug them), run with `python -i`.
     """ #^TODO: argparse helpfully reflows the text but this fucks up the formatting that I do want. What do?
     args = ap.parse_args()
+    if args.session_cache:
+        args.session_cache = os.path.abspath(args.session_cache) #we chdir() into the results folder later
     
     #by sorting we enforce that each search has a unique reference for each search
     args.query = sorted(args.query)
@@ -1072,24 +1654,31 @@ if __name__ == '__main__':
     
     print("Target: %s" % (strquery,))
     
-    resuming = False
-    if os.path.isfile(os.path.join(results, "parameters.txt")):
+    # before connecting to anything, work out if there's anything to do
+    params = read_parameters(results)
+    resuming = params is not None
+    if resuming:
         # resume a partial download
-        resuming = True
-        with open(os.path.join(results, "parameters.txt")) as params:
-            params = dict(l.replace("\n","").split(": ", 1) for l in params if ": " in l)
-            assert params['Query'] == strquery, "The old query '%s' does not match the current '%s'." % (params['Query'], strquery) #TODO: just warn instead of crash
-            assert 'Records' in params
-            params['Records'] = int(params['Records'])
-            if 'Estimated' in params:
-                params['Estimated'] = bool(int(params['Estimated']))
-        
-        # decide if this set is complete already or not
-        # TODO: this is super dumb, it just checks if the last block of records exists
-        if glob(os.path.join(results,"*-%04d.ciw" % params['Records'])):        
+        assert params['Query'] == strquery, "The old query '%s' does not match the current '%s'." % (params['Query'], strquery) #TODO: just warn instead of crash
+        if args.format is not None and args.format != params['Format']:
+            ap.error("%s was ripped as %s; can't resume it as %s" % (results, params['Format'], args.format))
+        args.format = params['Format']
+        if args.partition is not None and args.partition != params.get('Partition'):
+            ap.error("%s was %s; can't resume it partitioned over %s" % (results, "partitioned over " + params['Partition'] if 'Partition' in params else "not partitioned", args.partition))
+        args.partition = params.get('Partition')
+        
+        # decide if this set is complete already or not: every block in the manifest and on disk, start to end
+        todo = plan_resume(results, params)
+        if not todo and not args.overwrite:
             logging.info("Not resuming %s: already complete." % (strquery,))
             raise SystemExit(0)
-        print("Resuming %s" % (strquery,))
+        print("Resuming %s: %d blocks to go" % (strquery, len(todo)))
+    if args.format is None:
+        args.format = "fieldtagged"
+    if args.partition is not None:
+        from isishard import parse_years
+        years = parse_years(args.partition)
+        years = (years[0], years[-1])
     
     
     # Login to the pay-wall web of science
@@ -1099,11 +1688,29 @@ if __name__ == '__main__':
     # mixin the anonymization
     class proxy(AnonymizedSession, proxy): pass #LOL WTF BBQ THIS 100% WORKS
     
-    # log in to the EzProxy server
-    proxy = proxy(args.user, args.barcode)
-    print("Logged into %s as %s." % (proxy.address, args.user,))
+    def connect(login=True):
+        "log in to the EzProxy server (or don't, to restore a saved session into it)"
+        session = proxy(args.user, args.barcode, login=login)
+        session.MAX_RATE = args.max_rate
+        session.limiter.adjust(high=args.max_rate)
+        return session
     
-    S = ISI(proxy)
+    # try the saved session first: if it still works, that's the only request we make to get going
+    S = None
+    if args.session_cache:
+        session = connect(login=False)
+        if load_session(args.session_cache, session):
+            try:
+                S = ISI(session)
+                print("Reusing saved session for %s on %s." % (args.user, session.address))
+            except (ISIError, requests.exceptions.RequestException) as exc:
+                logging.info("saved session didn't work (%s); logging in again" % (exc,))
+    if S is None:
+        session = connect()
+        print("Logged into %s as %s." % (session.address, args.user,))
+        S = ISI(session)
+    if args.session_cache:
+        save_session(args.session_cache, S.session)
     
     
     # If we successfully logged in, go into the results subdirectory
@@ -1114,9 +1721,29 @@ if __name__ == '__main__':
     
     
     
-    print("Querying ISI for %s" % (strquery,))
-    # remember: you need to do this so that the DB will let you download anything
-    Q = S.generalSearch(*query)
+    # if we're still in the same ISI session as the run being resumed (see --session-cache), its result set is still good
+    Q = None
+    if args.partition is not None:
+        print("Querying ISI for %s, in parts over %d-%d" % ((strquery,) + years))
+        spans = [tuple(map(int, prefix.rstrip("_").split("-"))) for prefix, N, estimated in params['Parts']] if resuming else None
+        Q = S.partition(*query, years=years, spans=spans)
+        print("Split into %d parts: %s" % (len(Q.parts), format_parts(Q)))
+    elif resuming and os.path.isfile(HANDLE):
+        try:
+            Q = ISIResults.load(HANDLE, S.session)
+            if Q.probe():
+                print("Reusing result set %s from the last run" % (Q.qid,))
+            else:
+                Q = None
+        except ValueError as exc:
+            logging.info("Can't reuse the last run's result set: %s" % (exc,))
+            Q = None
+    
+    if Q is None:
+        print("Querying ISI for %s" % (strquery,))
+        # remember: you need to do this so that the DB will let you download anything
+        Q = S.generalSearch(*query)
+        Q.save(HANDLE)
     
     if resuming:
         if len(Q) < params['Records']:
@@ -1130,10 +1757,7 @@ if __name__ == '__main__':
         if 'Estimated' in params:
             assert params['Estimated'] == Q.estimated, "Mismatched estimate flags: %s vs %s" % (params['Estimated'], Q.estimated)
         
-        # TODO: don't make any connections if we are resuming until we know what actually needs downloading
-        #    conversely don't make any folders if we can't connect
-        #    this means adjusting the flow to have two paths
-        # --> one way to do this would be to make "if not logged in" in EzProxy **call login()** 
+        # TODO: don't make any folders if we can't connect
     
     
     
@@ -1144,7 +1768,7 @@ if __name__ == '__main__':
     
     # record the parameters used for replicability
     # this could be done better.. pickle? shelve? 
-    with open("parameters.txt","w") as desc:
+    with open(PARAMETERS,"w") as desc:
         desc.write(dedent("""\
               ISI scrape
               ==========
@@ -1152,11 +1776,22 @@ if __name__ == '__main__':
               Query: %s
               Records: %d
               Estimated: %d
+              Format: %s
               Date: %s
-              """ % (strquery, len(Q), Q.estimated, datetime.datetime.now())))
+              """ % (strquery, len(Q), Q.estimated, args.format, datetime.datetime.now())))
+        if args.partition is not None:
+            desc.write("Partition: %s\n" % (args.partition,))
+            desc.write("Parts: %s\n" % (format_parts(Q),))
     
     print("Collecting %s%d results from %s" % ("an estimated " if Q.estimated else "", len(Q), strquery))
-    Q.rip(overwrite=args.overwrite) #we never overwrite Q results since that functionality is done by renaming the whole directory on completion        
+    if args.partition is not None:
+        Q.rip(overwrite=args.overwrite, format=args.format, fsync=args.fsync, workers=args.workers, parts_at_once=args.parts_at_once)
+    else:
+        Q.rip(overwrite=args.overwrite, format=args.format, fsync=args.fsync, workers=args.workers) #we never overwrite Q results since that functionality is done by renaming the whole directory on completion        
+    with open(PARAMETERS,"a") as desc:
+        desc.write("Completed: %s\n" % (datetime.datetime.now(),)) #see plan_resume()
+    if args.session_cache:
+        save_session(args.session_cache, S.session) #the session was just in use, so it's good for another SESSION_LIFETIME
     print("Completed %s" % (strquery,))
     
     # because this is under __main__ and not main()
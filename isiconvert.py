@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Convert ISI files to JSON Lines or CSV.
+
+Each input file is converted by its own worker process into its own output
+shard, through a big write buffer; shards are either kept (one per input
+file, in an output folder) or concatenated into a single output file at the end.
+
+Fields that isiparse gives as lists (AU, AF, C1, CR, DE, ID, WC, SC, ...) become
+JSON arrays, or, with join, strings joined by a separator; CSV can't hold
+arrays, so in CSV they are always joined.
+
+Example:
+```
+import isiconvert
+isiconvert.convert(["PY=2006-2015_SU=Sociology/"], "sociology.jsonl", fields=['UT', 'PY', 'TI', 'AU', 'SO'])
+isiconvert.convert(["PY=2006-2015_SU=Sociology/"], "csv/", format='csv')  # one CSV per input file
+```
+"""
+
+import sys, os
+import csv
+import json
+import shutil
+import logging
+
+import isiparse
+from util import parallel_map, safe_filename
+
+BUFFER = 1 << 22
+
+# the columns CSV gets when no fields are asked for, in the order WoS exports them
+CSV_FIELDS = ['PT', 'AU', 'AF', 'TI', 'SO', 'LA', 'DT', 'DE', 'ID', 'AB', 'C1', 'RP', 'EM',
+              'CR', 'NR', 'TC', 'Z9', 'PU', 'SN', 'J9', 'JI', 'PD', 'PY', 'VL', 'IS',
+              'BP', 'EP', 'DI', 'PG', 'WC', 'SC', 'GA', 'UT']
+
+FORMATS = {'.jsonl': 'jsonl', '.json': 'jsonl', '.csv': 'csv'}
+
+
+def _select(record, fields, join):
+    "pick out fields from record (all of them if fields is None), joining lists with join unless it is None"
+    if fields is not None:
+        record = {f: record[f] for f in fields if f in record}
+    if join is not None:
+        record = {f: (join.join(v) if isinstance(v, list) else v) for f, v in record.items()}
+    return record
+
+def convert_file(job):
+    """
+    worker: convert one ISI file into one shard.
+    job is (ISI file, shard file, format, fields, join, header)
+    returns the number of records written
+    """
+    fname, shard, fmt, fields, join, header = job
+    n = 0
+    logging.info("converting %s -> %s" % (fname, shard))
+    with isiparse.reader(fname) as isi, open(shard, "w", encoding="utf-8", newline="", buffering=BUFFER) as out:
+        if fmt == 'jsonl':
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+            for record in isi:
+                out.write(encode(_select(record, fields, join)))
+                out.write("\n")
+                n += 1
+        else:
+            w = csv.DictWriter(out, fields or CSV_FIELDS, extrasaction="ignore")
+            if header:
+                w.writeheader()
+            for record in isi:
+                w.writerow(_select(record, fields, join if join is not None else "; "))
+                n += 1
+    return n
+
+def convert(paths, output, format=None, fields=None, join=None, processes=None):
+    """
+    convert every ISI file in paths.
+    output: a file name (shards are concatenated into it), or a folder, ending in "/" or already existing,
+            to get one output file per input file
+    format: 'jsonl' or 'csv'; by default, from output's extension (and jsonl for folders)
+    fields: list of field tags to keep; default: all of them (for CSV: CSV_FIELDS)
+    join: separator to join list fields with; default: keep them as arrays (CSV always joins, with "; " by default)
+    returns the number of records converted
+    """
+    sharded = output.endswith(os.sep) or os.path.isdir(output)
+    if format is None:
+        format = 'jsonl' if sharded else FORMATS.get(os.path.splitext(output)[1].lower())
+    if format not in ('jsonl', 'csv'):
+        raise ValueError("unknown output format %r; give format='jsonl' or 'csv'" % (format,))
+    ext = "." + format
+    files = list(isiparse.find_files(paths))
+
+    if sharded:
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        shards = [os.path.join(output, safe_filename(os.path.splitext(os.path.basename(f))[0]) + ext) for f in files]
+        if len(set(shards)) < len(shards):
+            # same-named files in different folders
+            shards = [os.path.join(output, "%04d.%s" % (i, os.path.basename(s))) for i, s in enumerate(shards)]
+    else:
+        shards = ["%s.%04d.part" % (output, i) for i in range(len(files))]
+
+    jobs = [(f, s, format, fields, join, sharded) for f, s in zip(files, shards)]
+    total = sum(parallel_map(convert_file, jobs, processes))
+
+    if not sharded:
+        with open(output + ".part", "w", encoding="utf-8", newline="", buffering=BUFFER) as out:
+            if format == 'csv':
+                csv.writer(out).writerow(fields or CSV_FIELDS)
+            for shard in shards:
+                with open(shard, encoding="utf-8", newline="") as f:
+                    shutil.copyfileobj(f, out, BUFFER)
+                os.remove(shard)
+        os.replace(output + ".part", output)
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Convert ISI files to JSON Lines or CSV.")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-o', '--output', required=True, help="output file (.jsonl or .csv), or folder (ending in /) for one output file per input file")
+    ap.add_argument('-f', '--format', choices=["jsonl", "csv"], help="output format (default: from the output's extension)")
+    ap.add_argument('-F', '--fields', help="comma-separated field tags to keep, e.g. UT,PY,TI,AU (default: all)")
+    ap.add_argument('--join', metavar="SEP", help="join list fields into strings with SEP, e.g. --join '; ' (default: JSON arrays)")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    fields = args.fields.split(",") if args.fields else None
+    n = convert(args.files, args.output, args.format, fields, args.join, args.processes)
+    print("%d records written to %s" % (n, args.output))
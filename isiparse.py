@@ -11,6 +11,13 @@ manually or with isi_scrape and running
 ```
 python -m isiparse data.ciw
 ```
+
+Records come out as dicts of two letter field tags. Most fields are a single string,
+with continuation lines joined by spaces (AB by newlines), but these are lists:
+ - AU, AF, CR, C1: one entry per line (an author, a cited reference, an address)
+ - DE, ID, SC, WC: split on "; " (keywords, categories)
+Note: before isiquery, AU, AF and CR were single space-joined strings and DE and ID single "; "-joined ones.
+Code written against those gets them back with " ".join(record['AU']) and "; ".join(record['DE']).
 """
 
 # TODO:
@@ -36,6 +43,17 @@ def is_WOS_number(w):
     
     return True
 
+def address_country(address):
+    """
+    extract the country from a C1 (or RP) address line.
+    "[Smith, J] Univ Waterloo, Dept Sociol, Waterloo, ON N2L 3G1, Canada." -> "Canada"
+    US addresses end in the state and zip code ("..., Chicago, IL 60637 USA."), which we collapse to just "USA".
+    """
+    country = address.rsplit(",", 1)[-1].strip().rstrip(".")
+    if country.endswith("USA"):
+        country = "USA"
+    return country
+
 
 class EmptyModule(): pass
 
@@ -47,7 +65,10 @@ except ImportError:
     import codecs
     builtins.open = codecs.open
 
-import sys
+import sys, os
+import re
+import csv
+import codecs
 
 from datetime import date
 import time
@@ -239,8 +260,13 @@ def records(isi):
 		reformatters = {'AB': paragraph, #abstracts are just paragraphs reflowed
 			'SC': semicolon_list,  #subject categories are a a list split by semicolons
 			'WC': semicolon_list,  #ditto for web-of-science categories
+			'DE': semicolon_list,  #author keywords
+			'ID': semicolon_list,  #KeyWords Plus
 			#....			
 			'C1': newline_list,
+			'AU': newline_list,    #one author per line; flattening these makes them impossible to split again
+			'AF': newline_list,
+			'CR': newline_list,    #one cited reference per line
 			#'PY': parse_year, #TODO
 			#'PD': parse_month,
 			}				
@@ -309,11 +335,77 @@ def records(isi):
 	
 
 
+TAB_SUFFIX = ".tab" #what we name tab-delimited exports; WoS itself calls them savedrecs.txt
+
+def _semicolons(v):
+	return v.split("; ")
+
+def _addresses(v):
+	# C1 addresses are separated by "; ", but so are the author names in their [brackets]
+	return [a for a in re.split(r"; (?![^\[]*\])", v) if a]
+
+# how tab-delimited exports pack the fields records() gives as lists; everything else is a plain string
+tab_reformatters = {'AU': _semicolons,
+	'AF': _semicolons,
+	'CR': _semicolons,
+	'DE': _semicolons,
+	'ID': _semicolons,
+	'WC': _semicolons,
+	'SC': _semicolons,
+	'C1': _addresses,
+	}
+
+def tab_records(isi):
+	"""
+	read records from an open WoS tab-delimited export (the {win,mac}Tab{UTF8,Unicode} export formats),
+	giving the same dicts records() gives for the field-tagged format.
+	
+	Tab-delimited exports are a header line of field tags and then one record per line,
+	so they can go straight through the csv module instead of the continuation-line state machine,
+	which makes them several times cheaper to read.
+	"""
+	csv.field_size_limit(min(sys.maxsize, 2**31 - 1)) #CR lists get long
+	rows = csv.reader(isi, delimiter="\t", quoting=csv.QUOTE_NONE)
+	try:
+		header = [tag.strip().lstrip("\ufeff") for tag in next(rows)]
+	except StopIteration:
+		raise ISIFormatError("Empty tab-delimited file")
+	if header[:1] != ["PT"]:
+		raise ISIFormatError("Malformed tab-delimited header: '%s'" % ("\t".join(header),))
+	for i, row in enumerate(rows):
+		if not any(row):
+			continue
+		if len(row) > len(header) and any(row[len(header):]):
+			raise ISIFormatError("line[%d]: more fields than the header has tags" % (i+2,))
+		# empty fields are simply missing from field-tagged records, so drop them here too
+		yield {tag: tab_reformatters.get(tag, str)(value) for tag, value in zip(header, row) if tag and value}
+
+
+def sniff(name):
+	"""
+	guess the format and encoding of an export file.
+	returns (format, encoding), where format is 'fieldtagged' or 'tab'.
+	The "Unicode" tab-delimited exports are UTF-16, which we spot by their BOM.
+	"""
+	with builtins.open(name, "rb") as f:
+		head = f.read(512)
+	encoding = "utf-16" if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)) else "utf-8-sig"
+	head = head.decode(encoding, "ignore").lstrip("\ufeff")
+	return ('tab' if head.startswith("PT\t") else 'fieldtagged'), encoding
+
+
 class reader():
-	def __init__(self, name, encoding="utf-8-sig"):
-		self._file = builtins.open(name, "r", encoding=encoding)
+	"""
+	iterate over the records in an export file, field-tagged or tab-delimited (see sniff()).
+	encoding=None means to guess it.
+	"""
+	def __init__(self, name, encoding=None):
+		self.format, guess = sniff(name)
+		self._file = builtins.open(name, "r", encoding=encoding or guess)
 	
 	def __iter__(self):
+		if self.format == 'tab':
+			return iter(tab_records(self._file))
 		return iter(records(self._file))
 	
 	def __enter__(self):
@@ -324,16 +416,32 @@ class reader():
 		self._file.close()
 
 
-def open(fname, mode="r", encoding="utf-8-sig"):
+def open(fname, mode="r", encoding=None):
 	"""
 	utf-8-sig is the most widely compatible text codec. It handles both ASCII files (because of utf-8 backwards compatibility) and most Unicode files, with or without a BOM.
+	It's what we use unless the file starts with a UTF-16 BOM, like the "Unicode" tab-delimited exports do.
 	If you happen to have a different encoding, you can provide it. See the codecs module for options.
 	TODO: use the chardet module?
 	"""
 	if mode != "r":
 		raise NotImplementedError("only have read-only support so far")
 	
-	return reader(fname)
+	return reader(fname, encoding)
+
+def find_files(paths, suffixes=(".isi", ".ciw", TAB_SUFFIX)):
+	"""
+	expand a list of files and directories into the ISI files they name.
+	Directories are searched (not recursively) for files ending in one of suffixes,
+	in sorted order so that block files come out in record order;
+	plain files are passed through as given, so you can still name a savedrecs.txt directly.
+	"""
+	for path in paths:
+		if os.path.isdir(path):
+			for f in sorted(os.listdir(path)):
+				if f.endswith(tuple(suffixes)):
+					yield os.path.join(path, f)
+		else:
+			yield path
 
 if __name__ == '__main__':
 	import sys
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Local search over an ingested ISI corpus, using (most of) the Web of Science query language.
+
+ISI.generalSearch() can only ask the server, one round trip per question.
+Once records are on disk we can answer the same sort of questions ourselves:
+this builds per-field inverted indexes (and a range index on PY) over a set of
+ISI files and evaluates WoS-style expressions like
+```
+TS=(social capital OR network*) AND PY=2007-2010 NOT AU=Smith
+```
+against them, giving back UT sets or the matching records themselves.
+
+Example:
+```
+import isiquery
+I = isiquery.Index()
+I.build(["PY=2006-2015_SU=Sociology/"])
+I.save("sociology.idx")
+
+I = isiquery.Index.load("sociology.idx")
+uts = I.search("SO=SOCIAL FORCES AND PY=2010")
+for record in I.records("TS=migra* AND CU=Canada"):
+    print(record['TI'])
+```
+
+Supported:
+ - field tags: see FIELDS. Bare terms search TS (like the WoS basic search does).
+ - operators: AND, OR, NOT, and parentheses. Adjacent terms are ANDed.
+   SAME and NEAR are accepted but, since these indexes don't keep positions, are treated as AND.
+ - wildcards: * (any run of characters), ? (exactly one) and $ (zero or one)
+ - ranges on PY: PY=2007-2010
+ - quoted phrases, which are (for the same reason as NEAR) treated as the AND of their words.
+   For real phrase search over TS, see isitext.
+
+This is an approximation of what ISI does: ISI lemmatizes, knows about
+author name variants, and has secret sauce. Don't expect counts to match exactly.
+"""
+
+import sys, os
+import re
+import logging
+import pickle
+from array import array
+from bisect import bisect_left, bisect_right
+
+import isiparse
+
+
+# ------------------------------------------------------------------- text
+
+_words = re.compile(r"[^\W_]+")
+def tokenize(text):
+    """
+    split text into lower-cased words.
+    text may be a string or a list of strings (as isiparse gives for list-valued fields).
+    """
+    if isinstance(text, list):
+        text = " ".join(text)
+    return _words.findall(text.lower())
+
+def normalize(value):
+    "normalize a whole-field value (journal name, category, author name...) for exact matching"
+    return " ".join(tokenize(value))
+
+
+# ------------------------------------------------------------------- fields
+
+# how each searchable field tag is extracted from a record.
+# 'text' fields are tokenized into words, 'exact' fields are matched on their whole (normalized) values,
+# and 'range' fields are integers supporting "lo-hi" queries.
+# extractors take a record and give a list of values.
+def _get(*tags):
+    def extract(record):
+        values = []
+        for tag in tags:
+            v = record.get(tag)
+            if v is None:
+                continue
+            if isinstance(v, list):
+                values.extend(v)
+            else:
+                values.append(v)
+        return values
+    return extract
+
+def _countries(record):
+    return list({isiparse.address_country(a) for a in record.get('C1', [])})
+
+def _year(record):
+    try:
+        return [isiparse.parse_year(record['PY'])]
+    except (KeyError, isiparse.ISIFormatError):
+        return []
+
+FIELDS = {
+    'TS': ('text',  _get('TI', 'AB', 'DE', 'ID')), #Topic
+    'TI': ('text',  _get('TI')),                   #Title
+    'AB': ('text',  _get('AB')),                   #Abstract (not a WoS tag, but handy)
+    'AU': ('exact', _get('AU', 'AF')),             #Author; matched by surname, then initials/given names
+    'SO': ('exact', _get('SO')),                   #Publication Name
+    'DO': ('exact', _get('DI')),                   #DOI
+    'PY': ('range', _year),                        #Year Published
+    'CU': ('exact', _countries),                   #Country
+    'AD': ('text',  _get('C1')),                   #Address
+    'SU': ('exact', _get('SC')),                   #Research Area
+    'WC': ('exact', _get('WC')),                   #Web of Science Category
+    'DT': ('exact', _get('DT')),                   #Document Type
+    'LA': ('exact', _get('LA')),                   #Language
+    'UT': ('exact', _get('UT')),                   #Accession Number
+}
+
+
+# ------------------------------------------------------------------- query parsing
+
+class QuerySyntaxError(ValueError):
+    pass
+
+OPERATORS = {'OR': 1, 'AND': 2, 'NOT': 3, 'SAME': 4, 'NEAR': 5} #binding strength, as in ISI's search help
+
+_query_tokens = re.compile(r'\s*(?:(\()|(\))|([A-Za-z]{2,4})=|"([^"]*)"|([^\s()"]+))')
+
+def lex(query):
+    "split a query string into (kind, value) tokens"
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        m = _query_tokens.match(query, pos)
+        if not m or m.end() == pos:
+            raise QuerySyntaxError("can't parse query at '%s'" % (query[pos:],))
+        pos = m.end()
+        lparen, rparen, field, phrase, word = m.groups()
+        if lparen: yield ('(', None)
+        elif rparen: yield (')', None)
+        elif field: yield ('field', field.upper())
+        elif phrase is not None: yield ('phrase', phrase)
+        elif word.split("/")[0].upper() in OPERATORS: yield ('op', word.split("/")[0].upper()) #NEAR/5 -> NEAR
+        else: yield ('term', word)
+
+def parse(query, default_field='TS'):
+    """
+    parse a WoS query string into a tree of tuples:
+      (op, left, right) for boolean operators, and
+      ('term', field, value) / ('phrase', field, value) at the leaves.
+
+    A field tag applies to everything after it up to the next field tag or the
+    end of the enclosing parentheses, so TS=(cats OR dogs) and TS=cats dogs both do what you'd expect.
+    """
+    tokens = list(lex(query))
+    pos = [0]
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else (None, None)
+    def take():
+        t = peek(); pos[0] += 1; return t
+
+    def expression(field, min_strength=1):
+        left, field = operand(field)
+        while True:
+            kind, value = peek()
+            if kind == 'op':
+                strength = OPERATORS[value]
+                if strength < min_strength: break
+                take()
+            elif kind in ('term', 'phrase', '(', 'field'):
+                value, strength = 'AND', OPERATORS['AND'] #implicit AND between adjacent terms
+                if strength < min_strength: break
+            else:
+                break
+            right, field = expression(field, strength + 1)
+            left = (value, left, right)
+        return left, field
+
+    def operand(field):
+        kind, value = take()
+        if kind == 'field':
+            if value not in FIELDS:
+                raise QuerySyntaxError("unknown field tag '%s'" % (value,))
+            return operand(value)
+        elif kind == '(':
+            inner, _ = expression(field)
+            if take()[0] != ')':
+                raise QuerySyntaxError("unbalanced parentheses in '%s'" % (query,))
+            return inner, field
+        elif kind == 'term' and FIELDS[field][0] != 'text':
+            # whole-value fields take all the words up to the next operator: SO=SOCIAL FORCES, AU=Smith J
+            words = [value]
+            while peek()[0] == 'term':
+                words.append(take()[1])
+            return ('term', field, " ".join(words)), field
+        elif kind in ('term', 'phrase'):
+            return (kind, field, value), field
+        else:
+            raise QuerySyntaxError("expected a search term in '%s' but got %s" % (query, value or kind))
+
+    tree, _ = expression(default_field)
+    if peek()[0] is not None:
+        raise QuerySyntaxError("trailing junk in '%s'" % (query,))
+    return tree
+
+def fields2query(*fields):
+    """
+    convert the (field, querystring), operator, (field, querystring), ... tuple
+    that ISI.generalSearch() takes into a query string, so the same arguments work locally.
+    """
+    parts = []
+    for i, f in enumerate(fields):
+        if i % 2:
+            parts.append(f)
+        else:
+            field, querystring = f
+            if isinstance(querystring, list):
+                querystring = " OR ".join(querystring)
+            parts.append("%s=(%s)" % (field, querystring))
+    return " ".join(parts)
+
+
+# ------------------------------------------------------------------- the index
+
+def _wildcard(pattern):
+    "compile an ISI wildcard pattern into a regex, returning (literal prefix, regex)"
+    prefix = re.split(r"[*?$]", pattern, 1)[0]
+    regex = "".join({'*': '.*', '?': '.', '$': '.?'}.get(c, re.escape(c)) for c in pattern)
+    return prefix, re.compile(regex + r"\Z")
+
+class Index:
+    """
+    Per-field inverted indexes over a set of ISI files.
+
+    Documents are numbered in the order they are added; each field maps
+    a key (word, normalized value, or year) to a sorted array of document numbers.
+    Documents are deduplicated by UT, since overlapping rips are common.
+    """
+    def __init__(self):
+        self.uts = []      # docid -> UT
+        self.where = array('i') # docid -> index into self.files
+        self.files = []
+        self.ids = {}      # UT -> docid
+        self.postings = {field: {} for field in FIELDS}
+        self._sorted = {}  # field -> sorted list of keys; a cache for wildcard and range lookups
+
+    def __len__(self):
+        return len(self.uts)
+
+    def add(self, record, fileno=-1):
+        "index a single record. returns its docid, or None if it was already indexed."
+        ut = record.get('UT')
+        if ut is None or ut in self.ids:
+            return None
+        docid = len(self.uts)
+        self.uts.append(ut)
+        self.where.append(fileno)
+        self.ids[ut] = docid
+
+        for field, (kind, extract) in FIELDS.items():
+            values = extract(record)
+            if kind == 'text':
+                keys = set(tokenize(values))
+            elif kind == 'exact':
+                keys = {normalize(v) for v in values}
+            else:
+                keys = set(values)
+            index = self.postings[field]
+            for key in keys:
+                if key not in index:
+                    index[key] = array('i')
+                index[key].append(docid)
+        self._sorted.clear()
+        return docid
+
+    def build(self, paths):
+        "index every record in the given files (or folders of files)"
+        for fname in isiparse.find_files(paths):
+            fname = os.path.abspath(fname)
+            if fname in self.files:
+                continue
+            self.files.append(fname)
+            fileno = len(self.files) - 1
+            logging.info("indexing %s" % (fname,))
+            with isiparse.reader(fname) as isi:
+                for record in isi:
+                    self.add(record, fileno)
+
+    def save(self, fname):
+        with open(fname, "wb") as f:
+            pickle.dump((self.uts, self.where, self.files, self.postings), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fname):
+        self = cls()
+        with open(fname, "rb") as f:
+            self.uts, self.where, self.files, self.postings = pickle.load(f)
+        self.ids = {ut: docid for docid, ut in enumerate(self.uts)}
+        return self
+
+    # ---- lookups
+
+    def _keys(self, field):
+        if field not in self._sorted:
+            self._sorted[field] = sorted(self.postings[field])
+        return self._sorted[field]
+
+    def _union(self, field, keys):
+        index = self.postings[field]
+        result = set()
+        for key in keys:
+            result.update(index.get(key, ()))
+        return result
+
+    def lookup(self, field, value):
+        "the set of docids matching a single term in a single field"
+        kind, _ = FIELDS[field]
+        if kind == 'range':
+            lo, _, hi = value.partition("-")
+            try:
+                lo, hi = int(lo), int(hi or lo)
+            except ValueError:
+                raise QuerySyntaxError("%s needs a year or year range, not '%s'" % (field, value))
+            keys = self._keys(field)
+            return self._union(field, keys[bisect_left(keys, lo):bisect_right(keys, hi)])
+
+        if kind == 'text':
+            words = tokenize(value) if not re.search(r"[*?$]", value) else [value.lower()]
+            if len(words) != 1:
+                # punctuation inside a term (e.g. "socio-economic") splits it into several words; require all of them
+                return self.match_all(field, words)
+            value = words[0]
+        else:
+            value = " ".join(w for w in re.split(r"[^\w*?$]+", value.lower()) if w)
+
+        if re.search(r"[*?$]", value):
+            prefix, regex = _wildcard(value)
+            keys = self._keys(field)
+            start = bisect_left(keys, prefix)
+            matches = []
+            for key in keys[start:]:
+                if not key.startswith(prefix): break
+                if regex.match(key): matches.append(key)
+            return self._union(field, matches)
+
+        if field == 'AU':
+            # "AU=Smith" finds every Smith; "AU=Smith J" finds "Smith, J" and "Smith, John" but not "Smithers, J"
+            keys = self._keys(field)
+            start = bisect_left(keys, value)
+            matches = []
+            for key in keys[start:]:
+                if not key.startswith(value): break
+                if key == value or key[len(value)] == " " or " " in value:
+                    matches.append(key)
+            return self._union(field, matches)
+
+        return set(self.postings[field].get(value, ()))
+
+    def match_all(self, field, words):
+        result = None
+        for w in words:
+            docs = self.lookup(field, w)
+            result = docs if result is None else result & docs
+        return result if result is not None else set()
+
+    def evaluate(self, tree):
+        "evaluate a parse() tree to a set of docids"
+        op = tree[0]
+        if op == 'term':
+            _, field, value = tree
+            return self.lookup(field, value)
+        if op == 'phrase':
+            _, field, value = tree
+            if FIELDS[field][0] == 'text':
+                return self.match_all(field, tokenize(value))
+            return self.lookup(field, value)
+        _, left, right = tree
+        left = self.evaluate(left)
+        right = self.evaluate(right)
+        if op == 'OR':
+            return left | right
+        elif op == 'NOT':
+            return left - right
+        else: # AND, SAME, NEAR
+            return left & right
+
+    def search(self, *query):
+        """
+        evaluate a query, returning the set of matching UTs.
+        query is either a single WoS query string, or the same (field, querystring), op, ... tuple that generalSearch() takes.
+        """
+        return {self.uts[d] for d in self._docids(*query)}
+
+    def _docids(self, *query):
+        if len(query) == 1 and isinstance(query[0], str):
+            query = query[0]
+        else:
+            query = fields2query(*query)
+        return self.evaluate(parse(query))
+
+    def records(self, *query):
+        """
+        stream the records matching a query out of the indexed files.
+        Only files containing at least one match are opened.
+        """
+        docids = self._docids(*query)
+        wanted = {}
+        for d in docids:
+            wanted.setdefault(self.where[d], set()).add(self.uts[d])
+        for fileno in sorted(wanted):
+            uts = wanted[fileno]
+            with isiparse.reader(self.files[fileno]) as isi:
+                for record in isi:
+                    if record.get('UT') in uts:
+                        uts.discard(record['UT']) #only the first copy, to match the index's deduplication
+                        yield record
+                        if not uts: break
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Index ISI files and search them with Web of Science field tag queries, offline.")
+    sub = ap.add_subparsers(dest="command")
+    b = sub.add_parser("build", help="index a corpus")
+    b.add_argument('index', help="index file to write (or extend, if it exists)")
+    b.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    s = sub.add_parser("search", help="search an index")
+    s.add_argument('index', help="index file, from 'build'")
+    s.add_argument('query', help="e.g. 'TS=(cats OR dogs) AND PY=2007-2010'")
+    s.add_argument('-c', '--count', action="store_true", help="only print how many records match")
+    s.add_argument('-t', '--titles', action="store_true", help="print titles as well as UTs (reads the matching records)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    if args.command == "build":
+        I = Index.load(args.index) if os.path.exists(args.index) else Index()
+        I.build(args.files)
+        I.save(args.index)
+        print("Indexed %d records from %d files" % (len(I), len(I.files)))
+    elif args.command == "search":
+        I = Index.load(args.index)
+        if args.count:
+            print(len(I.search(args.query)))
+        elif args.titles:
+            for record in I.records(args.query):
+                print("%s\t%s" % (record['UT'], record.get('TI', "")))
+        else:
+            for ut in sorted(I.search(args.query)):
+                print(ut)
+    else:
+        ap.print_help()
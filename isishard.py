@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Reshard an ISI corpus by publication year (and optionally by primary category).
+
+rip() lays a corpus out by query and block number, which means every analysis
+has to read every file even when it only cares about, say, 2007-2010 Sociology.
+This rewrites the records into one shard per PY (or per (PY, first WC) pair)
+and writes a small catalog next to them, so that readers can open only the
+shards matching a year or category filter.
+
+Records are copied through as raw text, so nothing isiparse doesn't understand
+(or mangles while reformatting) gets lost on the way.
+
+Example:
+```
+python isishard.py -o shards/ --by-category PY\\=2006-2015_SU\\=Sociology/
+
+import isishard
+for record in isishard.reader("shards/", years=range(2007, 2011), categories=["Sociology"]):
+    print(record['TI'])
+```
+"""
+
+import sys, os
+import logging
+import hashlib
+
+import isiparse
+from util import chomp, safe_filename
+
+CATALOG = "catalog.txt" #the shard index, kept in the same folder as the shards
+HEADER = ["FN Thomson Reuters Web of Science", "VR 1.0"] #same as isijoin
+FOOTER = ["EF"]
+
+UNKNOWN_YEAR = "unknown" #shard key for records without a PY field
+NO_CATEGORY = "none"     #shard key for records without a WC field
+
+
+def raw_records(fname, encoding="utf-8-sig"):
+    """
+    split an ISI file into records *without* parsing them,
+    yielding (lines, PY, WC) where lines is the list of lines of the record (up to and including 'ER'),
+    PY is the year as a string (or None) and WC the list of categories (possibly empty).
+
+    This is a lot more forgiving than isiparse.records(); it is meant for copying records around, not validating them.
+    """
+    with open(fname, "r", encoding=encoding) as isi:
+        lines = []
+        for line in isi:
+            line = chomp(line)
+            if line[:2] in ("FN", "VR") and not lines:
+                continue #file header
+            if line[:2] == "EF" and not lines:
+                return
+            if not line and not lines:
+                continue #the blank line between records
+            lines.append(line)
+            if line[:2] == "ER":
+                yield lines, _field(lines, "PY"), _field(lines, "WC", "; ")
+                lines = []
+        if lines:
+            raise isiparse.ISIFormatError("%s: file ended in the middle of a record" % (fname,))
+
+def _field(lines, tag, sep=None):
+    "pull a single field (with its continuation lines) out of a raw record"
+    content = None
+    for line in lines:
+        if content is None:
+            if line[:2] == tag:
+                content = [line[3:]]
+        elif line[:2] == "  ":
+            content.append(line[3:])
+        else:
+            break
+    if sep is None:
+        return " ".join(content) if content is not None else None
+    return " ".join(content).split(sep) if content is not None else []
+
+
+def shard_key(year, categories, by_category=False):
+    "the (PY, WC) shard a record with the given year and categories belongs in"
+    year = year.strip() if year else UNKNOWN_YEAR
+    if not by_category:
+        return (year, None)
+    category = categories[0].strip() if categories else NO_CATEGORY
+    return (year, category)
+
+def shard_name(key, taken=None):
+    """
+    the file name of a shard.
+    taken: {lower cased file name: key} of the names handed out so far; safe_filename() can map different categories
+           ("A & B", "A / B") to the same name, and case-insensitive file systems more still, so a name that
+           is already someone else's gets a short hash of the key added. The name is then recorded in taken.
+    """
+    year, category = key
+    name = "PY=%s" % (year,)
+    if category is not None:
+        name += "_WC=%s" % (category,)
+    name = safe_filename(name)
+    if taken is not None:
+        if taken.get(name.lower() + ".isi", key) != key:
+            name += "_" + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:8]
+            assert taken.get(name.lower() + ".isi", key) == key, "shard name collision: %s" % (name,)
+        taken[name.lower() + ".isi"] = key
+    return name + ".isi"
+
+
+def reshard(files, outdir, by_category=False, buffer_lines=200000):
+    """
+    Copy every record in files into shards in outdir, and write the catalog.
+
+    Shards are written through an in-memory buffer which is flushed (appending to each shard)
+    whenever it holds more than buffer_lines lines, so that a corpus with thousands of
+    (year, category) pairs doesn't need thousands of open file handles.
+
+    returns the catalog, as a dict {shard key: (file name, record count)}
+    """
+    if os.path.exists(os.path.join(outdir, CATALOG)):
+        raise FileExistsError("%s already contains a sharded corpus" % (outdir,))
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    elif any(f.startswith("PY=") and f.endswith(".isi") for f in os.listdir(outdir)):
+        # shards are appended to, so these would get mixed into the new ones
+        raise FileExistsError("%s has shards but no catalog (left by an interrupted reshard?); remove them or use another folder" % (outdir,))
+
+    catalog = {}   # key -> [fname, count]
+    taken = {}     # lower cased file name -> key, see shard_name()
+    buffers = {}   # key -> [lines]
+    buffered = 0
+
+    def flush():
+        for key, lines in buffers.items():
+            fname = os.path.join(outdir, catalog[key][0])
+            new = not os.path.exists(fname)
+            with open(fname, "a", encoding="utf-8-sig") as shard:
+                if new:
+                    shard.write("\n".join(HEADER) + "\n")
+                shard.write("\n".join(lines) + "\n")
+        buffers.clear()
+
+    for fname in files:
+        logging.info("resharding %s" % (fname,))
+        for lines, year, categories in raw_records(fname):
+            key = shard_key(year, categories, by_category)
+            if key not in catalog:
+                catalog[key] = [shard_name(key, taken), 0]
+            catalog[key][1] += 1
+            buf = buffers.setdefault(key, [])
+            buf.extend(lines)
+            buf.append("") #every record is followed by a single empty line
+            buffered += len(lines) + 1
+            if buffered > buffer_lines:
+                flush()
+                buffered = 0
+    flush()
+
+    for key, (fname, count) in catalog.items():
+        with open(os.path.join(outdir, fname), "a", encoding="utf-8-sig") as shard:
+            shard.write("\n".join(FOOTER) + "\n")
+
+    write_catalog(outdir, catalog)
+    return {key: tuple(v) for key, v in catalog.items()}
+
+
+def write_catalog(outdir, catalog):
+    """
+    the catalog is a tab-separated table of (file, PY, WC, records)
+    WC is empty if the corpus was only sharded by year.
+    """
+    with open(os.path.join(outdir, CATALOG), "w") as cat:
+        cat.write("file\tPY\tWC\trecords\n")
+        for (year, category), (fname, count) in sorted(catalog.items(), key=lambda kv: kv[1][0]):
+            cat.write("%s\t%s\t%s\t%d\n" % (fname, year, category if category is not None else "", count))
+
+def read_catalog(outdir):
+    "inverse of write_catalog(): returns {(PY, WC): (file name, record count)}"
+    catalog = {}
+    with open(os.path.join(outdir, CATALOG)) as cat:
+        header = next(cat)
+        for line in cat:
+            fname, year, category, count = chomp(line).split("\t")
+            catalog[(year, category or None)] = (fname, int(count))
+    return catalog
+
+
+def select(outdir, years=None, categories=None):
+    """
+    list the shard files in outdir which can contain records matching the filters.
+
+    years: None (everything), or a container of integer years; e.g. range(2007, 2011)
+           records with no PY are only included when years is None.
+    categories: None (everything), or a container of category names.
+           This matches the *primary* (first listed) WC category only, and only
+           works on corpora sharded with by_category=True.
+    """
+    catalog = read_catalog(outdir)
+    for (year, category), (fname, count) in sorted(catalog.items(), key=lambda kv: kv[1][0]):
+        if years is not None:
+            if year == UNKNOWN_YEAR or int(year) not in years:
+                continue
+        if categories is not None:
+            if category is None:
+                raise ValueError("%s is not sharded by category" % (outdir,))
+            if category not in categories:
+                continue
+        yield os.path.join(outdir, fname)
+
+def reader(outdir, years=None, categories=None):
+    "stream parsed records out of the shards selected by select()"
+    for fname in select(outdir, years, categories):
+        with isiparse.reader(fname) as isi:
+            for record in isi:
+                yield record
+
+
+def parse_years(s):
+    "parse a year filter like '2007' or '2007-2010' (inclusive) into a range()"
+    if "-" in s:
+        start, end = s.split("-", 1)
+        return range(int(start), int(end) + 1)
+    return range(int(s), int(s) + 1)
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Reshard ISI files by publication year (and optionally primary category), writing a catalog so that later jobs only read the shards they need.")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them (e.g. the output of isi_scrape)")
+    ap.add_argument('-o', '--output', required=True, help="folder to write shards and catalog to")
+    ap.add_argument('-c', '--by-category', action="store_true", help="also shard by the first WC category of each record")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    catalog = reshard(isiparse.find_files(args.files), args.output, by_category=args.by_category)
+    print("Wrote %d records into %d shards in %s" % (sum(c for f, c in catalog.values()), len(catalog), args.output))
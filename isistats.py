@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Corpus statistics in one pass.
+
+Records per year, per category, per journal, per country, the TC distribution,
+field coverage... each of these is easy to compute, but computing them one
+script at a time means one full scan of the corpus per question.
+Here each question is an Aggregator; any number of them are fed from a
+single stream of records, one file per worker process, and the per-file
+partial states are merged at the end.
+
+Example:
+```
+import isistats
+results = isistats.run(["PY=2006-2015_SU=Sociology/"], ["years", "journals", "citations"])
+print(results["years"])
+
+# or bring your own:
+class Pages(isistats.Aggregator):
+    def __init__(self): self.pages = 0
+    def add(self, record): self.pages += int(record.get('PG', 0))
+    def merge(self, other): self.pages += other.pages
+    def result(self): return {'pages': self.pages}
+results = isistats.run(files, {"pages": Pages()})
+```
+Aggregators you define yourself need to live in an importable module, so they can be sent to the workers.
+"""
+
+import sys, os
+import json, csv
+import logging
+from copy import deepcopy
+from collections import Counter
+
+import isiparse
+from util import parallel_map
+
+
+class Aggregator:
+    """
+    the interface: add() is called with each record, merge() folds in
+    another instance's partial state (from another file or worker), and
+    result() gives a JSON-able dict of the answer.
+    """
+    def add(self, record):
+        raise NotImplementedError
+    def merge(self, other):
+        raise NotImplementedError
+    def result(self):
+        raise NotImplementedError
+
+
+class CountBy(Aggregator):
+    "count records per value of a field; list fields (WC, SC, ...) count the record once under each of their values"
+    def __init__(self, field):
+        self.field = field
+        self.counts = Counter()
+    def add(self, record):
+        v = record.get(self.field)
+        if v is None:
+            return
+        if isinstance(v, list):
+            self.counts.update(set(v))
+        else:
+            self.counts[v] += 1
+    def merge(self, other):
+        self.counts.update(other.counts)
+    def result(self):
+        return dict(self.counts.most_common())
+
+class Years(CountBy):
+    def __init__(self):
+        super().__init__('PY')
+    def result(self):
+        return dict(sorted(self.counts.items()))
+
+class Countries(Aggregator):
+    "count records per country (from C1), each country counted once per record"
+    def __init__(self):
+        self.counts = Counter()
+    def add(self, record):
+        self.counts.update({isiparse.address_country(a) for a in record.get('C1', [])})
+    def merge(self, other):
+        self.counts.update(other.counts)
+    def result(self):
+        return dict(self.counts.most_common())
+
+class Citations(Aggregator):
+    "the distribution of times cited (TC). Kept exactly, as a histogram, which stays small since most papers are cited a handful of times."
+    def __init__(self):
+        self.histogram = Counter()
+    def add(self, record):
+        try:
+            self.histogram[int(record['TC'])] += 1
+        except (KeyError, ValueError):
+            pass
+    def merge(self, other):
+        self.histogram.update(other.histogram)
+    def quantile(self, q):
+        n = sum(self.histogram.values())
+        seen = 0
+        for tc in sorted(self.histogram):
+            seen += self.histogram[tc]
+            if seen >= q * n:
+                return tc
+    def result(self):
+        n = sum(self.histogram.values())
+        if not n:
+            return {'records': 0}
+        return {'records': n,
+                'total': sum(tc * k for tc, k in self.histogram.items()),
+                'mean': sum(tc * k for tc, k in self.histogram.items()) / n,
+                'min': min(self.histogram),
+                'median': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'max': max(self.histogram),
+                'uncited': self.histogram.get(0, 0)}
+
+class Coverage(Aggregator):
+    "the fraction of records that have each field"
+    def __init__(self):
+        self.records = 0
+        self.fields = Counter()
+    def add(self, record):
+        self.records += 1
+        self.fields.update(record.keys())
+    def merge(self, other):
+        self.records += other.records
+        self.fields.update(other.fields)
+    def result(self):
+        return {tag: n / self.records for tag, n in sorted(self.fields.items())} if self.records else {}
+
+
+# the built-in aggregators, by name
+AGGREGATORS = {
+    'years': Years,
+    'categories': lambda: CountBy('WC'),
+    'subjects': lambda: CountBy('SC'),
+    'journals': lambda: CountBy('SO'),
+    'doctypes': lambda: CountBy('DT'),
+    'languages': lambda: CountBy('LA'),
+    'countries': Countries,
+    'citations': Citations,
+    'coverage': Coverage,
+}
+
+
+def _run_file(job):
+    "worker: feed one file through fresh copies of the aggregators"
+    fname, templates = job
+    aggregators = deepcopy(templates)
+    logging.info("reading %s" % (fname,))
+    with isiparse.reader(fname) as isi:
+        for record in isi:
+            for a in aggregators.values():
+                a.add(record)
+    return aggregators
+
+def run(paths, aggregators=None, processes=None):
+    """
+    feed every record in paths through the aggregators in one pass, and return {name: result}.
+    aggregators is a list of names from AGGREGATORS, or a dict of {name: (empty) Aggregator instance};
+    None means all of the built-in ones.
+    """
+    if aggregators is None:
+        aggregators = list(AGGREGATORS)
+    if not isinstance(aggregators, dict):
+        aggregators = {name: AGGREGATORS[name]() for name in aggregators}
+    totals = deepcopy(aggregators)
+    files = list(isiparse.find_files(paths))
+    for partial in parallel_map(_run_file, [(f, aggregators) for f in files], processes):
+        for name, a in partial.items():
+            totals[name].merge(a)
+    return {name: a.result() for name, a in totals.items()}
+
+
+def write_json(results, out):
+    json.dump(results, out, indent=2, sort_keys=False)
+    out.write("\n")
+
+def write_csv(results, out):
+    "flatten the results to (aggregator, key, value) rows"
+    w = csv.writer(out)
+    w.writerow(["aggregator", "key", "value"])
+    for name, result in results.items():
+        for key, value in result.items():
+            w.writerow([name, key, value])
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Compute statistics over ISI files in a single pass.")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-a', '--aggregate', action="append", choices=sorted(AGGREGATORS), help="statistic to compute; repeat for several (default: all)")
+    ap.add_argument('-f', '--format', default="json", choices=["json", "csv"], help="output format")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    results = run(args.files, args.aggregate, args.processes)
+    {'json': write_json, 'csv': write_csv}[args.format](results, sys.stdout)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Full-text (topic) search over an ISI corpus, ranked with BM25.
+
+This covers the same ground as a WoS TS= search: title (TI), abstract (AB),
+author keywords (DE) and KeyWords Plus (ID). Unlike isiquery, it keeps word
+positions, so it can answer phrase queries, and it ranks its results.
+
+Postings are kept compact: for each term, a byte string of
+  varint(doc delta) varint(tf) varint(position delta)*tf
+per document, so that a million-abstract index fits comfortably in memory and on disk.
+Indexes are built incrementally with add(), can be built in parallel (one
+partial index per file) and merged at the end, and pickle to a single file.
+
+Example:
+```
+import isitext
+T = isitext.TextIndex.build(["PY=2006-2015_SU=Sociology/"], processes=4)
+T.save("sociology.bm25")
+for ut, score in T.search('"social capital" migra*', k=10):
+    print(score, ut)
+```
+
+Query syntax:
+  word        -- scored with BM25
+  prefix*     -- any word starting with prefix
+  "a phrase"  -- the words, adjacent and in order, within a single field
+Documents matching any query element are ranked by the sum of their scores;
+with require_all=True only documents matching every element are returned.
+"""
+
+import sys, os
+import logging
+import pickle
+import heapq
+from array import array
+from bisect import bisect_left
+from math import log
+
+import isiparse
+from isiquery import tokenize
+from util import parallel_map
+
+TEXT_FIELDS = ['TI', 'AB', 'DE', 'ID'] #AB comes out of isiparse's 'paragraph' reformatter, i.e. newline-joined
+FIELD_GAP = 100 #position gap between fields (and keywords), so phrases can't match across a field boundary
+
+K1, B = 1.2, 0.75 #the usual BM25 constants
+
+
+# ------------------------------------------------------------------- varints
+
+def _put(buf, n):
+    "append n as a LEB128 varint to the bytearray buf"
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def _get(buf, i):
+    "read a varint from buf at i, returning (value, next i)"
+    n = shift = 0
+    while True:
+        b = buf[i]; i += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+def decode(postings):
+    "iterate over an encoded postings list, yielding (docid, positions)"
+    i, doc, end = 0, -1, len(postings)
+    while i < end:
+        delta, i = _get(postings, i)
+        doc += delta
+        tf, i = _get(postings, i)
+        positions, pos = [], -1
+        for _ in range(tf):
+            d, i = _get(postings, i)
+            pos += d
+            positions.append(pos)
+        yield doc, positions
+
+
+# ------------------------------------------------------------------- the index
+
+class TextIndex:
+    def __init__(self):
+        self.uts = []              # docid -> UT
+        self.ids = {}              # UT -> docid
+        self.doclen = array('i')   # docid -> number of words
+        self.postings = {}         # term -> bytearray, see decode()
+        self.last = {}             # term -> last docid in its postings (delta encoding continues from here)
+        self.df = {}               # term -> number of (non-deleted) documents containing it
+        self.deleted = set()       # docids shadowed by an earlier copy of the same UT (only arises from merge())
+        self._vocab = None         # sorted terms, for prefix queries
+
+    def __len__(self):
+        return len(self.uts) - len(self.deleted)
+
+    def add(self, record):
+        "index one record; records without a UT, or with a UT already indexed, are skipped"
+        ut = record.get('UT')
+        if ut is None or ut in self.ids:
+            return None
+        docid = len(self.uts)
+        self.uts.append(ut)
+        self.ids[ut] = docid
+
+        positions = {}
+        pos = 0
+        for field in TEXT_FIELDS:
+            if field not in record:
+                continue
+            value = record[field]
+            # list-valued fields (DE, ID) get the same gap between their elements,
+            # so that a phrase can't run from one keyword into the next
+            for element in (value if isinstance(value, list) else [value]):
+                for word in tokenize(element):
+                    positions.setdefault(word, []).append(pos)
+                    pos += 1
+                pos += FIELD_GAP
+        self.doclen.append(sum(len(p) for p in positions.values()))
+
+        for term, where in positions.items():
+            buf = self.postings.get(term)
+            if buf is None:
+                buf = self.postings[term] = bytearray()
+            _put(buf, docid - self.last.get(term, -1))
+            _put(buf, len(where))
+            prev = -1
+            for p in where:
+                _put(buf, p - prev)
+                prev = p
+            self.last[term] = docid
+            self.df[term] = self.df.get(term, 0) + 1
+        self._vocab = None
+        return docid
+
+    def add_file(self, fname):
+        logging.info("indexing %s" % (fname,))
+        with isiparse.reader(fname) as isi:
+            for record in isi:
+                self.add(record)
+
+    def merge(self, other):
+        """
+        append another index's documents to this one.
+        Because postings are delta-encoded, only the first entry of each of
+        other's postings lists needs re-encoding; the rest of the bytes are copied as-is.
+        Documents of other's whose UT is already indexed are superseded: they stay in the postings
+        but are marked deleted, and taken back out of df.
+        """
+        offset = len(self.uts)
+        superseded = set()  # other's docids that lose to a copy already in this index
+        for docid, ut in enumerate(other.uts):
+            if docid in other.deleted:
+                self.deleted.add(offset + docid) #already out of other.df
+            elif ut in self.ids:
+                self.deleted.add(offset + docid)
+                superseded.add(docid)
+            else:
+                self.ids[ut] = offset + docid
+        self.uts.extend(other.uts)
+        self.doclen.extend(other.doclen)
+
+        for term, theirs in other.postings.items():
+            first, i = _get(theirs, 0)
+            first = first - 1 + offset #their first docid, renumbered
+            buf = self.postings.get(term)
+            if buf is None:
+                buf = self.postings[term] = bytearray()
+            _put(buf, first - self.last.get(term, -1))
+            buf += theirs[i:]
+            self.last[term] = other.last[term] + offset
+            df = other.df[term]
+            if superseded:
+                df -= sum(1 for d, _ in decode(theirs) if d in superseded)
+            self.df[term] = self.df.get(term, 0) + df
+        self._vocab = None
+        return self
+
+    @classmethod
+    def build(cls, paths, processes=None):
+        """
+        index every record in paths, one partial index per file built across a process pool
+        and merged in file order at the end.
+        """
+        index = cls()
+        for part in parallel_map(_index_file, list(isiparse.find_files(paths)), processes):
+            index.merge(part)
+        return index
+
+    def save(self, fname):
+        state = (self.uts, self.doclen, {t: bytes(p) for t, p in self.postings.items()}, self.last, self.df, self.deleted)
+        with open(fname + ".part", "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fname + ".part", fname)
+
+    @classmethod
+    def load(cls, fname):
+        self = cls()
+        with open(fname, "rb") as f:
+            self.uts, self.doclen, postings, self.last, self.df, self.deleted = pickle.load(f)
+        self.postings = {t: bytearray(p) for t, p in postings.items()}
+        for docid, ut in enumerate(self.uts):
+            if docid not in self.deleted:
+                self.ids[ut] = docid
+        return self
+
+    # ---- querying
+
+    def vocabulary(self, prefix=""):
+        "all indexed terms starting with prefix"
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        i = bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            yield self._vocab[i]
+            i += 1
+
+    def _idf(self, df):
+        N = len(self)
+        return log(1 + (N - df + 0.5) / (df + 0.5))
+
+    def _bm25(self, tfs, df, avgdl):
+        "score each document in tfs ({docid: tf}) for a term with document frequency df"
+        idf = self._idf(df)
+        doclen = self.doclen
+        return {d: idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * doclen[d] / avgdl)) for d, tf in tfs.items()}
+
+    def _phrase(self, words):
+        "{docid: number of occurrences} of the phrase"
+        if any(w not in self.postings for w in words):
+            return {}
+        lists = [dict(decode(self.postings[w])) for w in words]
+        common = set(lists[0]).intersection(*lists[1:])
+        hits = {}
+        for d in common:
+            starts = set(lists[0][d])
+            for k, l in enumerate(lists[1:], 1):
+                starts &= {p - k for p in l[d]}
+                if not starts: break
+            if starts:
+                hits[d] = len(starts)
+        return hits
+
+    def parse(self, query):
+        "split a query into elements: ('term', word), ('prefix', stem) and ('phrase', [words])"
+        elements = []
+        for i, chunk in enumerate(query.split('"')):
+            if i % 2:
+                words = tokenize(chunk)
+                if len(words) == 1:
+                    elements.append(('term', words[0]))
+                elif words:
+                    elements.append(('phrase', words))
+            else:
+                for word in chunk.split():
+                    if word.endswith("*"):
+                        stem = tokenize(word[:-1])
+                        if stem:
+                            elements.extend(('term', w) for w in stem[:-1])
+                            elements.append(('prefix', stem[-1]))
+                    else:
+                        elements.extend(('term', w) for w in tokenize(word))
+        return elements
+
+    def scores(self, query, require_all=False):
+        "{docid: BM25 score} for every document matching the query"
+        if not len(self):
+            return {}
+        avgdl = (sum(self.doclen) - sum(self.doclen[d] for d in self.deleted)) / len(self) or 1
+        total, matched = {}, []
+        for kind, value in self.parse(query):
+            if kind == 'term':
+                terms = [value]
+            elif kind == 'prefix':
+                terms = list(self.vocabulary(value))
+            else:
+                terms = None
+
+            element = {}
+            if terms is None:
+                hits = {d: n for d, n in self._phrase(value).items() if d not in self.deleted}
+                for d, s in self._bm25(hits, len(hits), avgdl).items():
+                    element[d] = element.get(d, 0) + s
+            else:
+                for term in terms:
+                    if term not in self.postings: continue
+                    tfs = {d: len(p) for d, p in decode(self.postings[term])}
+                    for d, s in self._bm25(tfs, self.df[term], avgdl).items():
+                        element[d] = element.get(d, 0) + s
+            matched.append(set(element))
+            for d, s in element.items():
+                total[d] = total.get(d, 0) + s
+
+        if require_all and matched:
+            keep = set.intersection(*matched)
+            total = {d: s for d, s in total.items() if d in keep}
+        for d in self.deleted.intersection(total):
+            del total[d]
+        return total
+
+    def search(self, query, k=10, require_all=False):
+        "the top k (UT, score) pairs for query, best first; k=None gives every match"
+        scores = self.scores(query, require_all)
+        if k is None:
+            best = sorted(scores.items(), key=lambda ds: -ds[1])
+        else:
+            best = heapq.nlargest(k, scores.items(), key=lambda ds: ds[1])
+        return [(self.uts[d], s) for d, s in best]
+
+
+def _index_file(fname):
+    "worker for TextIndex.build()"
+    index = TextIndex()
+    index.add_file(fname)
+    return index
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Build and search a BM25 full-text index over the TI, AB, DE and ID fields of ISI files.")
+    sub = ap.add_subparsers(dest="command")
+    b = sub.add_parser("build", help="index a corpus")
+    b.add_argument('index', help="index file to write (or extend, if it exists)")
+    b.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    b.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    s = sub.add_parser("search", help="search an index")
+    s.add_argument('index', help="index file, from 'build'")
+    s.add_argument('query', help='e.g. \'"social capital" migra*\'')
+    s.add_argument('-k', type=int, default=20, help="number of results to show")
+    s.add_argument('-a', '--all', action="store_true", help="only show records matching every part of the query")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    if args.command == "build":
+        T = TextIndex.build(args.files, args.processes)
+        if os.path.exists(args.index):
+            T = TextIndex.load(args.index).merge(T)
+        T.save(args.index)
+        print("Indexed %d records, %d distinct terms" % (len(T), len(T.postings)))
+    elif args.command == "search":
+        T = TextIndex.load(args.index)
+        for ut, score in T.search(args.query, args.k, args.all):
+            print("%.3f\t%s" % (score, ut))
+    else:
+        ap.print_help()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Probabilistic sketches for quick, constant-memory answers over big corpora.
+
+ - HyperLogLog: approximate distinct counts ("how many distinct authors published in 2009?"),
+   to within about 1% using 16KB, however many records went in.
+ - CountMinSketch: approximate frequencies; never undercounts. It starts out sparse and only
+   becomes its fixed-size table once it has seen enough keys, so grouping by a field with
+   hundreds of values (by='WC') doesn't cost a full table per group per file.
+ - TopK: approximate heavy hitters ("the most cited references") on top of a CountMinSketch.
+
+All of them are mergeable: sketches built from different files or by different
+worker processes can be combined exactly as if all the data had gone into
+one, so a sketch can be built once per file, stored next to it with save(),
+and unioned on demand for any combination of files.
+
+Hashing uses blake2b rather than hash(), so sketches agree across processes and runs.
+
+Example:
+```
+import sketch
+authors = sketch.by_field(["PY=2006-2015_SU=Sociology/"], 'AU', by='PY')   # {year: HyperLogLog}
+print({year: round(len(h)) for year, h in authors.items()})
+refs = sketch.by_field(["PY=2006-2015_SU=Sociology/"], 'CR', kind='topk')[None]
+print(refs.top(10))
+sketch.save(refs, "sociology.cr.sketch")
+```
+"""
+
+import sys, os
+import logging
+import pickle
+import heapq
+from array import array
+from hashlib import blake2b
+from math import log
+
+import numpy as np
+
+import isiparse
+from util import parallel_map
+
+def _hash64(key):
+    return int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    Flajolet et al.'s HyperLogLog distinct counter, with the linear counting correction for small cardinalities.
+    p is the number of index bits: 2**p one-byte registers, standard error about 1.04/sqrt(2**p).
+    """
+    def __init__(self, p=14):
+        if not 4 <= p <= 18:
+            raise ValueError("p should be between 4 and 18")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, key):
+        h = _hash64(key)
+        idx = h >> (64 - self.p)
+        rest = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - self.p + 1 if rest == 0 else 64 - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("can only merge HyperLogLogs of the same precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        E = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        if E <= 2.5 * m:
+            zeros = self.registers.count(0)
+            if zeros:
+                return m * log(m / zeros)
+        return E
+
+    def __len__(self):
+        return int(round(self.count()))
+
+
+class CountMinSketch:
+    """
+    Cormode and Muthukrishnan's Count-Min sketch: depth rows of width counters.
+    Estimates overcount by at most about e/width * (total count), with probability 1 - exp(-depth).
+
+    Counters are kept in a dict {row * width + column: count} until more than width*depth/SPARSE of them
+    are in use, and only then in the rows (arrays of width counters); the estimates are the same either way.
+    """
+    SPARSE = 16 #a dict entry costs about as much as 16 array cells
+
+    def __init__(self, width=2 ** 16, depth=4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.cells = {}  # the counters while sparse; None once they are in rows
+        self.rows = None
+
+    def _cells(self, key):
+        # Kirsch-Mitzenmacher: depth hashes out of two
+        h = blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(h[:8], "big"), int.from_bytes(h[8:], "big") | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def _densify(self):
+        width = self.width
+        self.rows = [array('q', bytes(8 * width)) for _ in range(self.depth)]
+        for cell, n in self.cells.items():
+            self.rows[cell // width][cell % width] += n
+        self.cells = None
+
+    def add(self, key, n=1):
+        "count key n times, and return its new estimate"
+        self.total += n
+        cols = self._cells(key)
+        if self.rows is None:
+            cells, width = self.cells, self.width
+            est = None
+            for i, c in enumerate(cols):
+                cell = i * width + c
+                cells[cell] = v = cells.get(cell, 0) + n
+                est = v if est is None else min(est, v)
+            if len(cells) > width * self.depth // self.SPARSE:
+                self._densify()
+            return est
+        est = None
+        for row, c in zip(self.rows, cols):
+            row[c] += n
+            est = row[c] if est is None else min(est, row[c])
+        return est
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def estimate(self, key):
+        cols = self._cells(key)
+        if self.rows is None:
+            return min(self.cells.get(i * self.width + c, 0) for i, c in enumerate(cols))
+        return min(row[c] for row, c in zip(self.rows, cols))
+
+    __getitem__ = estimate
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("can only merge CountMinSketches of the same shape")
+        if other.rows is None:
+            if self.rows is None:
+                cells = self.cells
+                for cell, n in other.cells.items():
+                    cells[cell] = cells.get(cell, 0) + n
+                if len(cells) > self.width * self.depth // self.SPARSE:
+                    self._densify()
+            else:
+                width = self.width
+                for cell, n in other.cells.items():
+                    self.rows[cell // width][cell % width] += n
+        else:
+            if self.rows is None:
+                self._densify()
+            for mine, theirs in zip(self.rows, other.rows):
+                np.frombuffer(mine, dtype=np.int64)[:] += np.frombuffer(theirs, dtype=np.int64)
+        self.total += other.total
+        return self
+
+
+class TopK:
+    """
+    approximate heavy hitters: a CountMinSketch for frequencies, plus the k keys with the largest estimates seen so far.
+    """
+    def __init__(self, k=100, width=2 ** 16, depth=4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {} # key -> estimate
+        self._heap = []      # (estimate, key) for the candidates, smallest first; entries for old estimates are skipped
+
+    def _floor(self):
+        "the smallest estimate among the candidates, dropping stale heap entries on the way"
+        heap, cands = self._heap, self.candidates
+        while cands.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0]
+
+    def add(self, key, n=1):
+        est = self.sketch.add(key, n)
+        cands = self.candidates
+        if key not in cands and len(cands) >= self.k:
+            if est <= self._floor():
+                return
+            del cands[heapq.heappop(self._heap)[1]]
+        cands[key] = est
+        heapq.heappush(self._heap, (est, key))
+        if len(self._heap) > 4 * self.k:
+            self._reheap()
+
+    def _reheap(self):
+        self._heap = [(est, key) for key, est in self.candidates.items()]
+        heapq.heapify(self._heap)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates) | set(other.candidates)
+        best = heapq.nlargest(self.k, ((self.sketch.estimate(key), key) for key in keys))
+        self.candidates = {key: est for est, key in best}
+        self._reheap()
+        return self
+
+    def top(self, n=None):
+        "the (key, estimated count) pairs, most frequent first"
+        return heapq.nlargest(n or self.k, self.candidates.items(), key=lambda kv: kv[1])
+
+
+KINDS = {'hll': HyperLogLog, 'cms': CountMinSketch, 'topk': TopK}
+
+def save(sketch, fname):
+    "sketches are plain arrays underneath, so they pickle compactly"
+    with open(fname, "wb") as f:
+        pickle.dump(sketch, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load(fname):
+    with open(fname, "rb") as f:
+        return pickle.load(f)
+
+
+def _sketch_file(job):
+    "worker: sketch one field of one file, grouped by the value of another field"
+    fname, field, by, kind = job
+    sketches = {}
+    with isiparse.reader(fname) as isi:
+        for record in isi:
+            values = record.get(field)
+            if values is None:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            group = record.get(by) if by else None
+            groups = group if isinstance(group, list) else [group]
+            for g in groups:
+                if g not in sketches:
+                    sketches[g] = KINDS[kind]()
+                sketches[g].update(v.strip() for v in values)
+    return sketches
+
+def by_field(paths, field, by=None, kind='hll', processes=None):
+    """
+    sketch the values of field across a corpus, one file per worker process.
+    by: optionally, another field to group by (e.g. 'PY' or 'WC'); the result is {group value: sketch}.
+        Without it, the result is {None: sketch}.
+    kind: 'hll' for distinct counts, 'topk' for heavy hitters, 'cms' for frequencies.
+    """
+    total = {}
+    jobs = [(f, field, by, kind) for f in isiparse.find_files(paths)]
+    for sketches in parallel_map(_sketch_file, jobs, processes):
+        for g, s in sketches.items():
+            if g in total:
+                total[g].merge(s)
+            else:
+                total[g] = s
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Approximate distinct counts (HyperLogLog) or heavy hitters (Count-Min) of a field across ISI files.")
+    ap.add_argument('field', help="field to sketch, e.g. AU or CR")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-b', '--by', help="group by this field, e.g. PY or WC")
+    ap.add_argument('-t', '--top', type=int, help="report the N most frequent values instead of the distinct count")
+    ap.add_argument('-o', '--output', help="save the sketches to this file, for merging or querying later")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    sketches = by_field(args.files, args.field, args.by, 'topk' if args.top else 'hll', args.processes)
+    for g in sorted(sketches, key=str):
+        label = "%s\t" % (g,) if args.by else ""
+        if args.top:
+            for key, n in sketches[g].top(args.top):
+                print("%s%d\t%s" % (label, n, key))
+        else:
+            print("%s%d" % (label, len(sketches[g])))
+    if args.output:
+        save(sketches, args.output)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Exact counting over key spaces too big for a dict.
+
+Counting every distinct cited reference (CR) in a large corpus means tens of
+millions of keys, which a plain Counter can't hold on a laptop. SpillCounter
+counts in a dict until it holds `budget` distinct keys, then spills the
+counts to disk as sorted runs, hash-partitioned so that each partition can
+later be merged on its own. Reading the results merges the runs of one
+partition at a time, summing the counts of equal keys as they stream past,
+so memory stays bounded by the budget no matter how many keys there are.
+
+Whenever a partition has more than FANIN runs, its newest FANIN are merged
+into one, so no more than FANIN run files are ever open at once (a corpus
+ripped into thousands of blocks would otherwise blow through the open file
+limit) and every count is rewritten only a few times on the way.
+
+Example:
+```
+from spill import SpillCounter
+with SpillCounter(budget=2000000) as C:
+    for record in isiparse.reader("refs.isi"):
+        C.update(record.get('CR', []))
+    for ref, n in C.top(100):
+        print(n, ref)
+    C.dump("cr-counts.tsv")
+```
+"""
+
+import sys, os
+import logging
+import heapq
+import tempfile
+import zlib
+from shutil import rmtree
+from collections import Counter
+
+import isiparse
+from util import parallel_map
+
+FANIN = 64 #the most runs merged at once, see SpillCounter.compact()
+
+def _escape(key):
+    return key.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+def _unescape(s):
+    if "\\" not in s:
+        return s
+    out, i = [], 0
+    while i < len(s):
+        c = s[i]
+        if c == "\\":
+            i += 1
+            c = {"t": "\t", "n": "\n"}.get(s[i], s[i])
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+def _read_run(fname):
+    with open(fname, encoding="utf-8") as run:
+        for line in run:
+            key, count = line[:-1].rsplit("\t", 1)
+            yield _unescape(key), int(count)
+
+def _sum_sorted(streams):
+    "merge sorted streams of (key, count), summing the counts of equal keys"
+    current, total = None, 0
+    for key, n in heapq.merge(*streams):
+        if key == current:
+            total += n
+        else:
+            if current is not None:
+                yield current, total
+            current, total = key, n
+    if current is not None:
+        yield current, total
+
+
+class SpillCounter:
+    def __init__(self, budget=1000000, partitions=64, tmpdir=None):
+        """
+        budget: the most distinct keys to hold in memory before spilling to disk
+        partitions: how many hash partitions to spill into; merging reads one partition's runs at a time
+        tmpdir: where to put the spill files (default: the system temp dir)
+        """
+        self.budget = budget
+        self.partitions = partitions
+        self.memory = Counter()
+        self.runs = [[] for _ in range(partitions)] # partition -> [run file names]
+        self._dirs = [tempfile.mkdtemp(prefix="spill-", dir=tmpdir)]
+        self._spills = 0
+        self._merges = 0
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_unused):
+        self.close()
+
+    def close(self):
+        "delete the spill files"
+        for d in self._dirs:
+            rmtree(d, ignore_errors=True)
+        self._dirs = []
+        self.runs = [[] for _ in range(self.partitions)]
+        self.memory.clear()
+
+    def partition(self, key):
+        # crc32, not hash(), so that counters built in different processes agree
+        return zlib.crc32(key.encode("utf-8")) % self.partitions
+
+    def add(self, key, n=1):
+        self.memory[key] += n
+        if len(self.memory) >= self.budget:
+            self.spill()
+
+    def update(self, keys):
+        "count each key in an iterable of keys"
+        memory = self.memory
+        for key in keys:
+            memory[key] += 1
+            if len(memory) >= self.budget:
+                self.spill()
+
+    def spill(self):
+        "write the in-memory counts out as one sorted run per partition"
+        if not self.memory:
+            return
+        parts = [[] for _ in range(self.partitions)]
+        for key, n in self.memory.items():
+            parts[self.partition(key)].append((key, n))
+        for p, items in enumerate(parts):
+            if not items:
+                continue
+            items.sort()
+            fname = os.path.join(self._dirs[0], "%03d.%05d.tsv" % (p, self._spills))
+            with open(fname, "w", encoding="utf-8") as run:
+                run.writelines("%s\t%d\n" % (_escape(key), n) for key, n in items)
+            self.runs[p].append(fname)
+            self.compact(p)
+        logging.debug("spilled %d keys to %s" % (len(self.memory), self._dirs[0]))
+        self._spills += 1
+        self.memory.clear()
+
+    def compact(self, p):
+        """
+        merge partition p's newest FANIN runs into one until it has at most FANIN.
+        Older runs are the results of earlier compactions, so this merges runs of
+        about the same size together, and each count gets rewritten about log_FANIN(spills) times.
+        """
+        runs = self.runs[p]
+        while len(runs) > FANIN:
+            group = runs[-FANIN:]
+            fname = os.path.join(self._dirs[0], "%03d.m%05d.tsv" % (p, self._merges))
+            self._merges += 1
+            with open(fname, "w", encoding="utf-8") as run:
+                run.writelines("%s\t%d\n" % (_escape(key), n) for key, n in _sum_sorted([_read_run(f) for f in group]))
+            for f in group:
+                os.remove(f)
+            runs[-FANIN:] = [fname]
+
+    def merge(self, other):
+        """
+        fold another SpillCounter's counts into this one (e.g. one built by a worker process).
+        other's spill files are taken over, not copied, so don't use other afterwards.
+        """
+        if other.partitions != self.partitions:
+            raise ValueError("can only merge SpillCounters with the same number of partitions")
+        other.spill()
+        self._dirs.extend(other._dirs)
+        for p in range(self.partitions):
+            self.runs[p].extend(other.runs[p])
+            self.compact(p)
+        other._dirs = []
+        return self
+
+    def items(self):
+        """
+        every (key, count), sorted by key within each partition (but not across partitions).
+        This streams: only one partition's runs (at most FANIN of them) are open at a time.
+        """
+        memory = {}
+        if self.memory:
+            for key, n in self.memory.items():
+                memory.setdefault(self.partition(key), []).append((key, n))
+        for p in range(self.partitions):
+            streams = [_read_run(f) for f in self.runs[p]]
+            streams.append(iter(sorted(memory.get(p, []))))
+            yield from _sum_sorted(streams)
+
+    def __iter__(self):
+        return (key for key, n in self.items())
+
+    def top(self, n):
+        "the n most common (key, count) pairs, most common first"
+        return heapq.nlargest(n, self.items(), key=lambda kv: kv[1])
+
+    def dump(self, fname):
+        "write every (key, count) to fname as tab-separated lines"
+        with open(fname, "w", encoding="utf-8", buffering=1 << 20) as out:
+            for key, n in self.items():
+                out.write("%s\t%d\n" % (_escape(key), n))
+
+
+def _count_file(job):
+    "worker: count one field of one file into a SpillCounter, spilled so it pickles small"
+    fname, field, budget, partitions, tmpdir = job
+    C = SpillCounter(budget, partitions, tmpdir)
+    with isiparse.reader(fname) as isi:
+        for record in isi:
+            v = record.get(field)
+            if v is None:
+                continue
+            C.update(v if isinstance(v, list) else [v])
+    C.spill()
+    return C
+
+def count_field(paths, field, budget=1000000, partitions=64, tmpdir=None, processes=None):
+    "count the values of field across a corpus, one file per worker; returns a SpillCounter"
+    total = SpillCounter(budget, partitions, tmpdir)
+    jobs = [(f, field, budget, partitions, tmpdir) for f in isiparse.find_files(paths)]
+    for C in parallel_map(_count_file, jobs, processes):
+        total.merge(C)
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description="Count the distinct values of a field (e.g. CR, AU, C1) across ISI files, spilling to disk as needed.")
+    ap.add_argument('field', help="two letter field tag to count, e.g. CR")
+    ap.add_argument('files', nargs="+", help="ISI files, or folders of them")
+    ap.add_argument('-n', '--top', type=int, default=20, help="print the N most common values")
+    ap.add_argument('-o', '--dump', help="also write every value and its count to this file")
+    ap.add_argument('-b', '--budget', type=int, default=1000000, help="distinct keys to hold in memory (per worker) before spilling")
+    ap.add_argument('-T', '--tmpdir', help="where to put spill files")
+    ap.add_argument('-j', '--processes', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    ap.add_argument('-d', '--debug', action="store_true", help="Enable debugging")
+    args = ap.parse_args()
+
+    if args.debug:
+        logging.root.setLevel(logging.DEBUG)
+
+    with count_field(args.files, args.field, args.budget, tmpdir=args.tmpdir, processes=args.processes) as C:
+        for key, n in C.top(args.top):
+            print("%d\t%s" % (n, key))
+        if args.dump:
+            C.dump(args.dump)
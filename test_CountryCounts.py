@@ -0,0 +1,69 @@
+import csv
+
+import pytest
+
+import CountryCounts
+from CountryCounts import countFile
+
+CountryCounts.ErrorPrinting = False
+
+PAPERS = [
+    {'UT': "WOS:1", 'PY': "2010", 'SC': ["Sociology"], 'AF': ["Smith, John", "Tremblay, Marie"],
+     'C1': ["[Smith, John] Univ Chicago, Chicago, IL 60637 USA.", "[Tremblay, Marie] Univ Montreal, Montreal, PQ, Canada."]},
+    {'UT': "WOS:2", 'PY': "2011", 'SC': ["Sociology", "Demography"], 'AF': ["Smith, John"],
+     'C1': ["Univ Chicago, Chicago, IL 60637 USA."]},
+    {'UT': "WOS:3", 'PY': "2011", 'AF': ["Nobody, A"]}, #no subjects: a bad paper
+]
+
+
+def test_aggregate(write_isi):
+    ec, counts, failure = countFile((write_isi("a.isi", PAPERS), None))
+    assert (ec, failure) == (1, None)
+    assert counts == {("2010", "Sociology", "USA"): 1, ("2010", "Sociology", "Canada"): 1,
+                      ("2011", "Sociology", "USA"): 1, ("2011", "Demography", "USA"): 1}
+
+
+def test_rows(write_isi, tmp_path):
+    shard = str(tmp_path / "out.part")
+    ec, counts, failure = countFile((write_isi("a.isi", PAPERS), shard))
+    assert (ec, counts, failure) == (1, None, None)
+    with open(shard, newline='') as f:
+        rows = list(csv.reader(f))
+    assert [(r[0], r[5], r[6]) for r in rows] == [("WOS:1", "Smith, John", "USA"), ("WOS:1", "Tremblay, Marie", "Canada"),
+                                                  ("WOS:2", "Smith, John", "USA")]
+
+
+def test_truncated_file_is_reported_not_raised(write_isi, tmp_path):
+    fname = write_isi("a.isi", PAPERS)
+    with open(fname) as f:
+        text = f.read()
+    with open(fname, "w") as f:
+        f.write(text[:text.index("UT WOS:2")]) #cut off in the middle of the second record
+    shard = str(tmp_path / "out.part")
+    ec, counts, failure = countFile((fname, shard))
+    assert failure.startswith("ISIFormatError")
+    with open(shard, newline='') as f:
+        assert len(list(csv.reader(f))) == 2 #the first paper's authors were still written
+
+
+def test_missing_file_still_makes_a_shard(tmp_path):
+    shard = str(tmp_path / "out.part")
+    ec, counts, failure = countFile((str(tmp_path / "nope.isi"), shard))
+    assert failure.startswith("FileNotFoundError")
+    with open(shard) as f:
+        assert f.read() == ""
+
+
+def test_malformed_papers_are_bad_papers(write_isi):
+    base = {'UT': "WOS:4", 'PY': "2012", 'SC': ["Sociology"], 'AF': ["Smith, John"]}
+    for p in [dict(base, RP="Smith J (reprint author) Univ Chicago", C1=["Univ Chicago, Chicago, IL 60637 USA."]),
+              dict(base, C1=[""]),
+              dict(base, C1=[]),
+              dict(base, AF=[], C1=["Univ Chicago, Chicago, IL 60637 USA."])]:
+        with pytest.raises(CountryCounts.BadPaper):
+            CountryCounts.authorLocations(p)
+
+    # and in a file, they are counted as bad rather than stopping it
+    ec, counts, failure = countFile((write_isi("a.isi", PAPERS + [dict(base, RP="Smith J (reprint author) Univ Chicago", C1=["Univ Chicago, Chicago, IL 60637 USA."])]), None))
+    assert (ec, failure) == (2, None)
+    assert sum(counts.values()) == 4
@@ -0,0 +1,78 @@
+import authors
+from authors import split_name, block_key, given_compatible, mentions, resolve_block
+
+
+def record(ut, au, af=None, so="J SOCIOL", c1=(), em=""):
+    return {'UT': ut, 'AU': au, 'AF': af or au, 'SO': so, 'C1': list(c1), 'EM': em}
+
+
+def test_split_name():
+    assert split_name("Smith, John A") == ("smith", ["john", "a"])
+    assert split_name("Smith, JA") == ("smith", ["j", "a"])
+    assert block_key("Smith, JA") == block_key("Smith, John") == "smith_j"
+
+
+def test_given_compatible():
+    assert given_compatible(["j"], ["john"])
+    assert given_compatible(["john", "a"], ["john"])
+    assert not given_compatible(["john"], ["james"])
+
+
+def mention(rec, name):
+    return next(m for m in mentions(rec) if m.au == name)
+
+
+def test_coauthor_and_journal_link():
+    a = mention(record("1", ["Smith, J", "Doe, A"]), "Smith, J")
+    b = mention(record("2", ["Smith, J", "Doe, A"]), "Smith, J")
+    assert authors.score(a, b) == authors.COAUTHOR + authors.JOURNAL
+    assert resolve_block([a, b]) == [0, 0]
+
+
+def test_journal_alone_does_not_link():
+    a = mention(record("1", ["Smith, J", "Doe, A"]), "Smith, J")
+    b = mention(record("2", ["Smith, J", "Roe, B"]), "Smith, J")
+    assert resolve_block([a, b]) == [0, 1]
+
+
+def test_contradicting_given_names_stay_apart():
+    a = mention(record("1", ["Smith, J", "Doe, A"], ["Smith, John", "Doe, Anne"], em="john.smith@x.edu"), "Smith, J")
+    b = mention(record("2", ["Smith, J", "Doe, A"], ["Smith, James", "Doe, Anne"], em="john.smith@x.edu"), "Smith, J")
+    assert resolve_block([a, b]) == [0, 1]
+
+
+def test_initial_cannot_glue_different_names():
+    # "J" is compatible with both, but John and James must not end up in one cluster through it
+    co = ["Doe, A", "Roe, B"]
+    john = mention(record("1", ["Smith, J"] + co, ["Smith, John", "Doe, Anne", "Roe, Bob"]), "Smith, J")
+    j = mention(record("2", ["Smith, J"] + co), "Smith, J")
+    james = mention(record("3", ["Smith, J"] + co, ["Smith, James", "Doe, Anne", "Roe, Bob"]), "Smith, J")
+    clusters = resolve_block([john, j, james])
+    assert clusters[0] != clusters[2]
+
+
+def test_shared_journal_is_not_a_candidate(monkeypatch):
+    # a big block in one journal used to score every pair
+    surname = lambda i: "".join(chr(ord("a") + int(d)) for d in "%03d" % i)
+    block = [mention(record(str(i), ["Wang, Y", "%s, X" % surname(i)]), "Wang, Y") for i in range(200)]
+    calls = []
+    score = authors.score
+    monkeypatch.setattr(authors, "score", lambda m, n: calls.append(1) or score(m, n))
+    assert resolve_block(block) == list(range(200))
+    assert not calls
+
+
+def test_big_shared_affiliation_is_not_a_candidate(monkeypatch):
+    # every "Wang, Y" at one big university shares that affiliation
+    surname = lambda i: "".join(chr(ord("a") + int(d)) for d in "%03d" % i)
+    c1 = "[Wang, Y] Peking Univ, Beijing, Peoples R China."
+    block = [mention(record(str(i), ["Wang, Y", "%s, X" % surname(i)], c1=[c1], so="J %d" % i), "Wang, Y") for i in range(300)]
+    # two of them share a coauthor too, which still links them
+    block.append(mention(record("a", ["Wang, Y", "Doe, A"], c1=[c1]), "Wang, Y"))
+    block.append(mention(record("b", ["Wang, Y", "Doe, A"], c1=[c1]), "Wang, Y"))
+    calls = []
+    score = authors.score
+    monkeypatch.setattr(authors, "score", lambda m, n: calls.append(1) or score(m, n))
+    clusters = resolve_block(block)
+    assert len(calls) == 1
+    assert clusters[-1] == clusters[-2] and len(set(clusters)) == 301
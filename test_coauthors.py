@@ -0,0 +1,74 @@
+import numpy as np
+
+import coauthors
+from coauthors import CoauthorBuilder
+
+
+def paper(*authors, year="2010"):
+    return {'AU': list(authors), 'PY': year}
+
+
+def test_full_counting():
+    B = CoauthorBuilder()
+    B.add(paper("A", "B", "C"))
+    B.add(paper("A", "B"))
+    M = B.matrix()
+    a, b, c = (B.ids[n] for n in "ABC")
+    assert M[a, b] == M[b, a] == 2
+    assert M[a, c] == M[b, c] == 1
+    assert M[a, a] == 0
+    assert list(B.papers) == [2, 2, 1]
+
+
+def test_fractional_counting():
+    B = CoauthorBuilder(fractional=True)
+    B.add(paper("A", "B", "C"))
+    M = B.matrix()
+    # each author's weight from one paper sums to 1
+    assert np.allclose(np.asarray(M.sum(axis=1)).ravel(), 1)
+
+
+def test_years_and_slices():
+    B = CoauthorBuilder(years={2010, 2011}, by_year=True)
+    B.add(paper("A", "B", year="2010"))
+    B.add(paper("A", "B", year="2011"))
+    B.add(paper("A", "B", year="1999"))
+    B.add(paper("A", "B", year="????"))
+    assert B.slices() == [2010, 2011]
+    assert B.matrix(2010).sum() == 2
+    assert B.skipped == 1
+
+
+def test_big_papers_match_small_ones():
+    authors = ["A%d" % i for i in range(coauthors.BIG_PAPER + 5)]
+    big = CoauthorBuilder()
+    big.add(paper(*authors))
+    big.add(paper(*authors))
+    n = len(authors)
+    assert big.matrix(symmetric=False).nnz == n * (n - 1) // 2
+    assert big.matrix().max() == 2
+
+
+def test_compaction_is_amortized(monkeypatch):
+    # lots of big papers over the same few authors: every append after the first compaction
+    # used to compact the whole matrix again
+    compactions = []
+    coo = CoauthorBuilder._coo
+    def counting_coo(self, key):
+        compactions.append(key)
+        return coo(self, key)
+    monkeypatch.setattr(CoauthorBuilder, "_coo", counting_coo)
+
+    B = CoauthorBuilder(buffer_size=100)
+    pool = ["A%d" % i for i in range(200)]
+    rng = np.random.RandomState(0)
+    papers = [[pool[i] for i in rng.choice(len(pool), 40, replace=False)] for _ in range(500)]
+    for authors in papers:
+        B.add(paper(*authors))
+    assert 0 < len(compactions) < 50 #one per append would be ~500
+
+    M = B.matrix()
+    R = CoauthorBuilder(buffer_size=10**9)
+    for authors in papers:
+        R.add(paper(*authors))
+    assert (M != R.matrix()).nnz == 0
@@ -0,0 +1,50 @@
+import numpy as np
+import scipy.sparse
+import pytest
+
+import coupling
+from coupling import reference_key, gram
+
+
+@pytest.mark.parametrize("cr", [
+    "Smith J, 1990, AM J SOCIOL, V95, P1",
+    "Smith J., 1990, Am J Sociol, V95, P1, DOI 10.1086/229213",
+    "SMITH J, 1990, AM J SOCIOL, V95, P1, DOI [10.1086/229213, 10.1086/229214]",
+    "SMITH J, 1990, AM J SOCIOL, V95, P1, DOI [10.1086/229213, 10.10", #truncated
+    "*Smith  J, 1990,  AM J SOCIOL, V95, P1",
+])
+def test_reference_key(cr):
+    assert reference_key(cr) == "SMITH J, 1990, AM J SOCIOL, V95, P1"
+
+def test_reference_key_keeps_the_rest():
+    assert reference_key("Doiron B, 2001, DOING THINGS, V1, P2") == "DOIRON B, 2001, DOING THINGS, V1, P2"
+    assert reference_key("DOI 10.1/x") == ""
+
+
+@pytest.mark.parametrize("threshold", [1, 2])
+def test_gram(threshold):
+    rng = np.random.RandomState(0)
+    X = scipy.sparse.random(57, 40, density=0.1, random_state=rng, format="csr")
+    X.data[:] = 1
+    expected = np.triu((X @ X.T).toarray(), 1)
+    expected[expected < threshold] = 0
+    G = gram(X, threshold=threshold, block_size=10, processes=1)
+    assert (G.toarray() == expected).all()
+
+def test_gram_empty():
+    assert gram(scipy.sparse.csr_matrix((3, 4)), processes=1).nnz == 0
+
+
+def test_coupling_and_cocitation(write_isi):
+    fname = write_isi("a.isi", [
+        {'UT': "1", 'CR': ["A X, 1990, J", "B Y, 1991, K, DOI 10.1/b"]},
+        {'UT': "2", 'CR': ["A X, 1990, J", "B Y, 1991, K, DOI [10.1/b, 10.1/c]", "C Z, 1992, L"]},
+        {'UT': "3", 'CR': ["C Z, 1992, L"]},
+    ])
+    I = coupling.incidence([fname], processes=1)
+    assert I.shape == (3, 3) and I.uts == ["1", "2", "3"]
+    C = coupling.coupling(I, processes=1)
+    assert C.toarray().tolist() == [[0, 2, 0], [0, 0, 1], [0, 0, 0]]
+    K, refs = coupling.cocitation(I, min_citations=2, processes=1)
+    assert refs == ["A X, 1990, J", "B Y, 1991, K", "C Z, 1992, L"]
+    assert K.toarray().tolist() == [[0, 2, 1], [0, 0, 1], [0, 0, 0]]
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import scipy.sparse
+
+import graphio
+
+EDGES = [("Canada", "USA", 3), ("USA", "USA", 1), ("France", "USA", 2)]
+NODES = ["Canada", "France", "USA"]
+
+
+def test_graphml_int_weights_read_like_networkx(tmp_path):
+    nx = pytest.importorskip("networkx")
+    ours = str(tmp_path / "ours.graphml")
+    graphio.write_graphml(ours, NODES, EDGES, weight_type=int)
+    G = nx.Graph()
+    G.add_nodes_from(NODES)
+    G.add_weighted_edges_from(EDGES)
+    theirs = str(tmp_path / "theirs.graphml")
+    nx.write_graphml(G, theirs)
+    A, B = nx.read_graphml(ours), nx.read_graphml(theirs)
+    assert sorted(A.edges(data=True)) == sorted(B.edges(data=True))
+    assert all(type(d['weight']) is int for u, v, d in A.edges(data=True))
+
+
+def test_graphml_float_weights(tmp_path):
+    nx = pytest.importorskip("networkx")
+    fname = str(tmp_path / "g.graphml")
+    graphio.write_graphml(fname, ["a", ("b", {'year': 2010})], [("a", "b", 0.5)], node_attrs={'year': int})
+    G = nx.read_graphml(fname)
+    assert G["a"]["b"]["weight"] == 0.5
+    assert G.nodes["b"]["year"] == 2010
+
+
+def test_weight_type():
+    assert graphio.weight_type(scipy.sparse.csr_matrix(np.array([[0, 2], [2, 0]]))) is int
+    assert graphio.weight_type(scipy.sparse.csr_matrix(np.array([[0, 0.5], [0.5, 0]]))) is float
+
+
+def test_edgelist_round_trip(tmp_path):
+    fname = str(tmp_path / "e.tsv")
+    graphio.write_edgelist(fname, EDGES + [("Canada", "France")])
+    assert list(graphio.read_edgelist(fname)) == [(u, v, float(w)) for u, v, w in EDGES] + [("Canada", "France", 1.0)]
+    M, labels = graphio.read_csr(fname)
+    i = {l: k for k, l in enumerate(labels)}
+    assert M[i["USA"], i["Canada"]] == M[i["Canada"], i["USA"]] == 3
+    assert M[i["USA"], i["USA"]] == 1
+
+
+def test_csr_edges_upper():
+    M = scipy.sparse.csr_matrix(np.array([[0, 2, 0], [2, 0, 1], [0, 1, 0]]))
+    assert list(graphio.csr_edges(M, "abc", upper=True)) == [("a", "b", 2), ("b", "c", 1)]
+
+
+def test_pajek(tmp_path):
+    fname = str(tmp_path / "g.net")
+    graphio.write_pajek(fname, NODES, EDGES)
+    with open(fname) as f:
+        assert f.read().splitlines() == ['*Vertices 3', '1 "Canada"', '2 "France"', '3 "USA"', '*Edges', '1 3 3', '3 3 1', '2 3 2']
@@ -0,0 +1,72 @@
+import requests
+from requests.adapters import BaseAdapter
+
+import httputil
+from httputil import TokenBucket, PoliteSession, RTTEstimator
+
+
+def test_bucket_spends_its_burst_then_waits(monkeypatch):
+    slept = []
+    monkeypatch.setattr(httputil.time, "sleep", slept.append)
+    B = TokenBucket(rate=10, burst=2)
+    assert B.acquire() == B.acquire() == 0
+    assert B.acquire() > 0
+    assert slept
+
+
+def test_adjust_stays_within_bounds():
+    B = TokenBucket(rate=1.0)
+    assert B.adjust(factor=0.5, low=0.2) == 0.5
+    assert B.adjust(factor=0.1, low=0.2) == 0.2
+    assert B.adjust(step=5, high=2.0) == 2.0
+    assert B.adjust(high=1.5) == B.rate == 1.5
+
+
+def test_rtt_estimator():
+    E = RTTEstimator(initial=29, minimum=5, maximum=300)
+    E.sample(1.0)
+    assert E.timeout == 5 #srtt + 4*rttvar = 3, floored
+    E.backoff()
+    assert E.timeout == 10
+
+
+class Canned(BaseAdapter):
+    "answers every request with the next of a list of (status, url) or (status, url, body)s; the last one repeats"
+    def __init__(self, answers):
+        super().__init__()
+        self.answers = list(answers)
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        status, url, body = (self.answers[min(self.sent, len(self.answers) - 1)] + (b"",))[:3]
+        self.sent += 1
+        r = requests.Response()
+        r.status_code, r.url, r.request = status, url or request.url, request
+        r._content = body
+        r.elapsed = __import__("datetime").timedelta(seconds=0.1)
+        return r
+
+    def close(self):
+        pass
+
+
+def polite(answers, monkeypatch):
+    monkeypatch.setattr(httputil.time, "sleep", lambda s: None)
+    S = PoliteSession()
+    S.RETRIES = 3
+    S.mount("http://", Canned(answers))
+    return S
+
+
+def test_retries_transient_errors(monkeypatch):
+    S = polite([(503, None), (429, None), (200, None)], monkeypatch)
+    assert S.get("http://example.org/x").status_code == 200
+    assert S.adapters["http://"].sent == 3
+    assert S.limiter.rate < PoliteSession.RATE #halved twice, nudged up once
+
+
+def test_gives_up_after_retries(monkeypatch):
+    S = polite([(503, None)], monkeypatch)
+    assert S.get("http://example.org/x").status_code == 503
+    assert S.adapters["http://"].sent == S.RETRIES + 1
+    assert S.limiter.rate >= S.MIN_RATE
@@ -0,0 +1,150 @@
+import os
+import asyncio
+from urllib.parse import urlparse, urlunparse
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import isi_scrape
+import isi_async
+from isi_async import AsyncISI, AsyncISIResults, AsyncTokenBucket
+
+
+class Clock:
+    "stands in for both time and asyncio in isi_async: sleeping just moves the clock on"
+    def __init__(self):
+        self.now = 0.0
+    def monotonic(self):
+        return self.now
+    async def sleep(self, s):
+        self.now += s
+
+def run(coro):
+    "drive a coroutine that never really suspends (see Clock.sleep)"
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise AssertionError("coroutine suspended")
+
+
+def test_token_bucket(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(isi_async, "time", clock)
+    monkeypatch.setattr(isi_async, "asyncio", clock)
+    B = AsyncTokenBucket(rate=2.0, burst=2.0)
+    assert [run(B.acquire()) for _ in range(4)] == [0, 0, 0.5, 0.5] #the burst, then one every 1/rate
+    clock.now += 1.0
+    assert B.adjust(factor=0.5) == 1.0 #the time since the last refill still earned tokens at the old rate, filling the bucket
+    assert [run(B.acquire()) for _ in range(3)] == [0, 0, 1.0]
+    assert B.adjust(factor=0.01, low=0.5) == 0.5
+    assert B.adjust(step=10, high=3) == 3
+
+
+def serve(routes, test):
+    "run the coroutine test(S) with an AsyncISI whose requests all go to a local aiohttp app serving routes"
+    async def main():
+        app = web.Application()
+        for method, path, handler in routes:
+            app.router.add_route(method, path, handler)
+        async with TestServer(app) as server:
+            def proxify(url):
+                return urlunparse(("http", "%s:%d" % (server.host, server.port)) + tuple(urlparse(url)[2:]))
+            S = AsyncISI(aiohttp.ClientSession(), proxify, AsyncTokenBucket(1000, 1000))
+            S.BACKOFF = 0.001
+            async with S:
+                return await test(S)
+    return asyncio.run(main())
+
+async def summary(request):
+    return web.Response(text="<html></html>", content_type="text/html")
+
+async def error(request):
+    return web.Response(text='<div class="errorMessage"><div> </div><div>Search Error: bad tag</div></div>', content_type="text/html")
+
+
+def test_request_retries_and_tracks_the_session():
+    hits = []
+    async def page(request):
+        hits.append(request.path)
+        if len(hits) == 1:
+            return web.Response(status=503)
+        raise web.HTTPFound("/summary.do?SID=" + request.query.get("next", "abc"))
+    async def test(S):
+        await S._page("GET", "http://isi/page.do")
+        assert S.SID == "abc" and len(hits) == 2
+        await S._page("GET", "http://isi/page.do?next=abc") #the same session is fine
+        with pytest.raises(isi_scrape.NewSession):
+            await S._page("GET", "http://isi/page.do?next=xyz")
+        assert S.SID == "abc"
+    serve([("GET", "/page.do", page), ("GET", "/summary.do", summary)], test)
+
+
+def test_request_gives_up():
+    hits = []
+    async def page(request):
+        hits.append(request.path)
+        return web.Response(status=503)
+    async def test(S):
+        S.RETRIES = 2
+        with pytest.raises(aiohttp.ClientResponseError):
+            await S._page("GET", "http://isi/page.do")
+        assert len(hits) == 3
+        assert S.limiter.rate < 1000 #and it slowed down
+    serve([("GET", "/page.do", page)], test)
+
+
+def test_error_pages_raise_at_once():
+    hits = []
+    async def page(request):
+        hits.append(request.path)
+        raise web.HTTPFound("/error.do?error_display_redirect=true&message_key=Server.invalidInput")
+    async def test(S):
+        with pytest.raises(isi_scrape.InvalidInput):
+            await S._page("GET", "http://isi/page.do")
+        assert len(hits) == 1
+    serve([("GET", "/page.do", page), ("GET", "/error.do", error)], test)
+
+
+N = 1234 #how many records the server really has
+
+def records(a, b):
+    return "FN Thomson Reuters Web of Science\nVR 1.0\n" + "".join("PT J\nTI Paper %d\nUT WOS:%d\nER\n\n" % (i, i) for i in range(a, b+1)) + "EF\n"
+
+def test_rip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    inflight = {'now': 0, 'most': 0, 'exports': 0}
+    async def outbound(request):
+        form = await request.post()
+        a, b = int(form['markFrom']), int(form['markTo'])
+        inflight['exports'] += 1
+        inflight['now'] += 1
+        inflight['most'] = max(inflight['most'], inflight['now'])
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            inflight['now'] -= 1
+        if a > N:
+            raise web.HTTPFound("/error.do?error_display_redirect=true&message_key=Server.invalidInput")
+        return web.Response(body=records(a, min(b, N)).encode("utf-8"))
+    async def test(S):
+        S.SID = "abc"
+        Q = AsyncISIResults(S, 'GeneralSearch', "7", "http://isi/summary.do", N=2600, estimated=True) #more than there are
+        await Q.rip(workers=3)
+        return Q
+    routes = [("POST", "/OutboundService.do", outbound), ("GET", "/error.do", error)]
+    serve(routes, test)
+
+    assert inflight['most'] == 3 #a window of workers blocks
+    manifest = isi_scrape.read_manifest(".")
+    assert sorted(manifest) == ["0001-0500.ciw", "0501-1000.ciw", "1001-1500.ciw"]
+    assert manifest["1001-1500.ciw"]['records'] == str(N - 1000)
+    assert not [f for f in os.listdir(".") if f.endswith(".part")]
+
+    # resuming has nothing left to do but the blocks past the end, which fail the same way again
+    exports = inflight['exports']
+    serve(routes, test)
+    assert inflight['exports'] - exports <= 3
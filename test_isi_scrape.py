@@ -0,0 +1,223 @@
+import os
+import json
+
+import pytest
+import requests
+
+import httputil
+import isi_scrape
+from isi_scrape import ISISession, ISIError, InvalidInput, isi_error, parse_page
+from httputil import PoliteSession
+from util import wrapper
+from test_httputil import Canned
+
+
+def isi_session(answers, monkeypatch):
+    monkeypatch.setattr(httputil.time, "sleep", lambda s: None)
+    S = wrapper(ISISession, clone=False)(PoliteSession())
+    S.mount("http://", Canned(answers))
+    return S
+
+
+def test_server_errors_are_retried(monkeypatch):
+    S = isi_session([(503, "http://isi/summary.do"), (200, "http://isi/summary.do?SID=abc")], monkeypatch)
+    r = S.get("http://isi/summary.do")
+    r.raise_for_status()
+    assert S.adapters["http://"].sent == 2
+    assert S.SID == "abc"
+
+
+def test_error_pages_are_raised_at_once(monkeypatch):
+    S = isi_session([(200, "http://isi/error.do?Error=Server.sessionNotFound")], monkeypatch)
+    r = S.get("http://isi/summary.do")
+    assert S.adapters["http://"].sent == 1
+    with pytest.raises(ISIError) as exc:
+        r.raise_for_status()
+    assert exc.value.message_key == "Server.sessionNotFound"
+
+
+def test_isi_error_pages():
+    url = "http://isi/error.do?error_display_redirect=true&message_key=Server.invalidInput"
+    page = parse_page(b'<div class="errorMessage"><div> </div><div>Search Error: bad tag</div></div>')
+    err = isi_error(url, page)
+    assert isinstance(err, InvalidInput) and err.msg == "Search Error: bad tag"
+    assert isi_error("http://isi/summary.do?SID=abc", page) is None
+
+
+def logged_in(proxy):
+    "pretend proxy logged in, as EzProxy.login() leaves it"
+    proxy._logged_in = True
+    proxy.cookies.set("ezproxy", "s3cret", domain=".lib.uoguelph.ca", path="/")
+    return proxy
+
+
+def test_session_cache_round_trip(tmp_path):
+    from ezproxy import GuelphProxy
+    fname = str(tmp_path / "session.json")
+    saved = logged_in(GuelphProxy("12345", "Smith", login=False))
+    isi_scrape.save_session(fname, saved)
+    assert os.stat(fname).st_mode & 0o777 == 0o600
+    assert 'SID' not in json.load(open(fname))
+
+    restored = GuelphProxy("12345", "Smith", login=False)
+    assert isi_scrape.load_session(fname, restored)
+    assert restored._logged_in and restored.cookies["ezproxy"] == "s3cret"
+
+    assert not isi_scrape.load_session(fname, GuelphProxy("67890", "Jones", login=False))
+    assert not isi_scrape.load_session(str(tmp_path / "nope.json"), GuelphProxy("12345", "Smith", login=False))
+    isi_scrape.save_session(fname, saved, lifetime=-1)
+    assert not isi_scrape.load_session(fname, GuelphProxy("12345", "Smith", login=False))
+
+
+def test_ensure_pool_mounts_once():
+    S = requests.Session()
+    first = S.adapters["https://"]
+    isi_scrape.ensure_pool(S, 4) #the default pool of 10 is already enough
+    assert S.adapters["https://"] is first
+    isi_scrape.ensure_pool(S, 16)
+    bigger = S.adapters["https://"]
+    assert bigger is not first and bigger._pool_maxsize == 16
+    isi_scrape.ensure_pool(S, 8)
+    assert S.adapters["https://"] is bigger
+
+
+HANDLE = {'SID': "abc", 'search_mode': "GeneralSearch", 'qid': 7, 'referer': "http://isi/summary.do?qid=7&SID=abc",
+          'N': 1234, 'estimated': False}
+
+
+def test_result_handle_round_trip(tmp_path):
+    S = wrapper(ISISession, clone=False)(requests.Session())
+    Q = isi_scrape.ISIResults.from_dict(HANDLE, S)
+    assert S.SID == "abc" and len(Q) == 1234
+    fname = str(tmp_path / "results.json")
+    Q.save(fname)
+    assert isi_scrape.ISIResults.load(fname, S).to_dict() == HANDLE
+    other = wrapper(ISISession, clone=False)(requests.Session())
+    other.SID = "xyz"
+    with pytest.raises(ValueError):
+        isi_scrape.ISIResults.from_dict(HANDLE, other)
+
+
+def test_probe(monkeypatch):
+    S = isi_session([(200, "http://isi/OutboundService.do?SID=abc")], monkeypatch)
+    assert isi_scrape.ISIResults.from_dict(HANDLE, S).probe()
+    S = isi_session([(200, "http://isi/error.do?error_display_redirect=true&message_key=Server.invalidInput",
+                      b'<div class="errorMessage"><div>Invalid input</div></div>')], monkeypatch)
+    assert not isi_scrape.ISIResults.from_dict(HANDLE, S).probe()
+
+
+def test_probe_in_a_new_isi_session(monkeypatch):
+    # ISI has expired the saved session and started us a new one: the result set is gone, and that isn't a crash
+    S = isi_session([(200, "http://isi/summary.do?SID=new")], monkeypatch)
+    Q = isi_scrape.ISIResults.from_dict(HANDLE, S)
+    assert not Q.probe()
+    assert S.SID == "abc"
+
+
+def block(directory, fname, start, end, records):
+    "a finished block of `records` records, as rip() leaves it"
+    from conftest import isi_text
+    path = os.path.join(directory, fname)
+    with open(path, "w", encoding="utf-8-sig") as f:
+        f.write(isi_text([{'UT': str(i)} for i in range(records)]))
+    isi_scrape.append_manifest(directory, isi_scrape.summarize_file(path, start, end))
+
+
+def test_read_parameters(tmp_path):
+    assert isi_scrape.read_parameters(str(tmp_path)) is None
+    (tmp_path / "parameters.txt").write_text("ISI scrape\n==========\n\nQuery: TS=(cats)\nRecords: 1200\nEstimated: 1\n"
+                                             "Partition: 2\nParts: 2000-2004:700 2005-2010:500~\n")
+    params = isi_scrape.read_parameters(str(tmp_path))
+    assert params['Query'] == "TS=(cats)" and params['Records'] == 1200 and params['Estimated'] is True
+    assert params['Format'] == "fieldtagged"
+    assert params['Parts'] == [("2000-2004_", 700, False), ("2005-2010_", 500, True)]
+
+
+def test_plan_rip(tmp_path):
+    d = str(tmp_path)
+    assert isi_scrape.plan_rip(1200, d) == [(1, 500, "0001-0500.ciw"), (501, 1000, "0501-1000.ciw"), (1001, 1200, "1001-1200.ciw")]
+    block(d, "0501-1000.ciw", 501, 1000, 3)
+    with open(os.path.join(d, "0001-0500.ciw"), "w") as f: #not in the manifest yet, so it gets added
+        f.write("FN Thomson Reuters Web of Science\nVR 1.0\nEF\n")
+    assert isi_scrape.plan_rip(1200, d) == [(1001, 1200, "1001-1200.ciw")]
+    assert "0001-0500.ciw" in isi_scrape.read_manifest(d)
+    with open(os.path.join(d, "0501-1000.ciw"), "a") as f: #no longer what the manifest says
+        f.write("\n")
+    assert [b[2] for b in isi_scrape.plan_rip(1200, d)] == ["0501-1000.ciw", "1001-1200.ciw"]
+    assert [b[2] for b in isi_scrape.plan_rip(1200, d, upper_limit=600, prefix="x_")] == ["x_0001-0500.ciw", "x_0501-0600.ciw"]
+
+
+def test_plan_resume(tmp_path):
+    d = str(tmp_path)
+    exact = {'Records': 1600, 'Format': "fieldtagged"}
+    block(d, "0001-0500.ciw", 1, 500, 500)
+    block(d, "1001-1500.ciw", 1001, 1500, 500)
+    # gaps anywhere in the range are missing, not just the end
+    assert [b[2] for b in isi_scrape.plan_resume(d, exact)] == ["0501-1000.ciw", "1501-1600.ciw"]
+
+    # an estimate can overshoot: nothing past a short block exists
+    block(d, "0501-1000.ciw", 501, 1000, 200)
+    assert isi_scrape.plan_resume(d, dict(exact, Estimated=False)) == [(1501, 1600, "1501-1600.ciw")]
+    assert isi_scrape.plan_resume(d, dict(exact, Estimated=True)) == []
+
+
+def test_plan_resume_completed_estimate(tmp_path):
+    d = str(tmp_path)
+    params = {'Records': 1600, 'Estimated': True, 'Format': "fieldtagged"}
+    block(d, "0001-0500.ciw", 1, 500, 500)
+    assert len(isi_scrape.plan_resume(d, params)) == 3
+    # a rip that finished exactly on a block boundary had nothing after its last block
+    assert isi_scrape.plan_resume(d, dict(params, Completed="yesterday")) == []
+
+
+def test_plan_resume_parts(tmp_path):
+    d = str(tmp_path)
+    params = {'Records': 900, 'Format': "fieldtagged", 'Parts': [("2000-2004_", 600, False), ("2005-2010_", 300, True)]}
+    block(d, "2000-2004_0001-0500.ciw", 1, 500, 500)
+    block(d, "2005-2010_0001-0300.ciw", 1, 300, 120)
+    assert isi_scrape.plan_resume(d, params) == [(501, 600, "2000-2004_0501-0600.ciw")]
+
+
+class FakeResults:
+    def __init__(self, n, estimated=False):
+        self.n, self.estimated, self.session = n, estimated, None
+    def __len__(self):
+        return self.n
+
+def fake_isi(counts, estimated=()):
+    "an ISI whose generalSearch() counts records from {year: count}, logging the timespans it was asked for"
+    I = isi_scrape.ISI.__new__(isi_scrape.ISI)
+    I.searches = []
+    def generalSearch(*fields, timespan, editions, sort):
+        I.searches.append(timespan)
+        n = sum(c for y, c in counts.items() if timespan[0] <= y <= timespan[1])
+        if not n:
+            raise isi_scrape.NoRecordsFound(isi_scrape.NoRecordsFound.KEY)
+        return FakeResults(n, any(timespan[0] <= y <= timespan[1] for y in estimated))
+    I.generalSearch = generalSearch
+    return I
+
+
+def test_partition_bisects():
+    counts = {2000: 100, 2001: 100, 2002: 300, 2003: 900, 2005: 50, 2006: 500}
+    I = fake_isi(counts)
+    P = I.partition(('TS', "cats"), years=(2000, 2007), limit=400)
+    assert [(span, len(Q)) for span, Q in P.parts] == [((2000, 2001), 200), ((2002, 2002), 300), ((2003, 2003), 900),
+                                                       ((2004, 2005), 50), ((2006, 2006), 500)]
+    assert len(P) == sum(counts.values()) and not P.estimated
+    assert (2007, 2007) in I.searches #searched, but empty, so not a part
+
+    # resuming from the same spans searches only those again
+    I = fake_isi(counts)
+    again = I.partition(('TS', "cats"), years=(2000, 2007), limit=400, spans=[span for span, Q in P.parts])
+    assert [span for span, Q in again.parts] == [span for span, Q in P.parts]
+    assert I.searches == [(2000, 2007)] + [span for span, Q in P.parts]
+
+
+def test_partition_counts_must_add_up():
+    I = fake_isi({2000: 100, 2001: 100})
+    with pytest.raises(RuntimeError):
+        I.partition(('TS', "cats"), years=(2000, 2001), limit=150, spans=[(2000, 2000)]) #missing 2001
+    I = fake_isi({2000: 100, 2001: 100}, estimated=[2001])
+    P = I.partition(('TS', "cats"), years=(2000, 2001), limit=150, spans=[(2000, 2000)])
+    assert len(P) == 100 #the whole count was only an estimate, so this is just a warning
@@ -0,0 +1,99 @@
+import io
+
+import pytest
+
+import isiparse
+from isiparse import tab_records, sniff, ISIFormatError
+
+RECORDS = [
+    {'UT': "WOS:1", 'TI': "Social capital", 'PY': "2007", 'AU': ["Smith, J", "Doe, A"],
+     'DE': ["social capital", "networks"], 'C1': ["[Smith, J; Doe, A] Univ Guelph, Guelph, ON, Canada", "Univ Waterloo, Waterloo, ON, Canada"]},
+    {'UT': "WOS:2", 'TI': "Migration", 'PY': "2008", 'AU': ["Roe, R"]},
+]
+TAGS = ['PT', 'AU', 'TI', 'DE', 'C1', 'PY', 'UT']
+
+
+def tab_text(records):
+    "the tab-delimited export of a list of record dicts"
+    lines = ["\t".join(TAGS)]
+    for r in records:
+        r = dict(r, PT="J")
+        lines.append("\t".join("; ".join(r[t]) if isinstance(r.get(t), list) else r.get(t, "") for t in TAGS))
+    return "\n".join(lines) + "\n"
+
+
+def test_tab_records():
+    got = list(tab_records(io.StringIO(tab_text(RECORDS))))
+    assert got == [dict(r, PT="J") for r in RECORDS]
+
+
+def test_tab_records_errors():
+    with pytest.raises(ISIFormatError):
+        list(tab_records(io.StringIO("")))
+    with pytest.raises(ISIFormatError):
+        list(tab_records(io.StringIO("UT\tTI\n1\tx\n")))
+    with pytest.raises(ISIFormatError):
+        list(tab_records(io.StringIO("PT\tUT\nJ\t1\textra\n")))
+
+
+@pytest.mark.parametrize("encoding", ["utf-8-sig", "utf-16"])
+def test_sniff_and_read_tab(tmp_path, encoding):
+    path = tmp_path / "savedrecs.txt"
+    path.write_text(tab_text(RECORDS), encoding=encoding)
+    assert sniff(str(path)) == ('tab', "utf-16" if encoding == "utf-16" else "utf-8-sig")
+    with isiparse.reader(str(path)) as isi:
+        assert [r['UT'] for r in isi] == ["WOS:1", "WOS:2"]
+
+
+def test_tab_and_fieldtagged_agree(tmp_path, write_isi):
+    tagged = write_isi("a.isi", RECORDS)
+    tab = tmp_path / "a.tab"
+    tab.write_text(tab_text(RECORDS), encoding="utf-8-sig")
+    assert sniff(tagged) == ('fieldtagged', "utf-8-sig")
+    with isiparse.reader(tagged) as a, isiparse.reader(str(tab)) as b:
+        assert list(a) == list(b)
+
+
+def test_field_shapes(tmp_path):
+    path = tmp_path / "shapes.ciw"
+    path.write_text("""FN Thomson Reuters Web of Science
+VR 1.0
+PT J
+AU Smith, J
+   Doe, A
+AF Smith, John
+   Doe, Alice
+TI A title that runs
+   over two lines
+DE social capital; networks; a keyword that runs
+   over two lines
+ID MIGRATION
+CR Coleman JS, 1988, AM J SOCIOL, V94, pS95
+   Granovetter MS, 1973, AM J SOCIOL, V78, P1360
+C1 [Smith, John] Univ Guelph, Guelph, ON, Canada.
+WC Sociology
+AB First paragraph.
+   Second paragraph.
+UT WOS:000000000000001
+ER
+
+PT J
+AU Roe, R
+CR Bourdieu P, 1984, DISTINCTION SOCIAL C
+UT WOS:000000000000002
+ER
+
+EF
+""", encoding="utf-8-sig")
+    with isiparse.reader(str(path)) as isi:
+        first, second = isi
+    assert first['AU'] == ["Smith, J", "Doe, A"]
+    assert first['AF'] == ["Smith, John", "Doe, Alice"]
+    assert first['CR'] == ["Coleman JS, 1988, AM J SOCIOL, V94, pS95", "Granovetter MS, 1973, AM J SOCIOL, V78, P1360"]
+    assert first['C1'] == ["[Smith, John] Univ Guelph, Guelph, ON, Canada."]
+    assert first['DE'] == ["social capital", "networks", "a keyword that runs over two lines"]
+    assert first['ID'] == ["MIGRATION"]
+    assert first['WC'] == ["Sociology"]
+    assert first['TI'] == "A title that runs over two lines"
+    assert first['AB'] == "First paragraph.\nSecond paragraph."
+    assert second['AU'] == ["Roe, R"] and second['CR'] == ["Bourdieu P, 1984, DISTINCTION SOCIAL C"] #lists even when there's one
@@ -0,0 +1,64 @@
+import pytest
+
+import isiquery
+from isiquery import parse, lex, fields2query, tokenize, QuerySyntaxError
+
+
+def test_lex():
+    assert list(lex('TS=(cats OR "big dogs") NEAR/5 x')) == [
+        ('field', 'TS'), ('(', None), ('term', "cats"), ('op', 'OR'), ('phrase', "big dogs"), (')', None), ('op', 'NEAR'), ('term', "x")]
+
+
+def test_precedence():
+    # NOT binds tighter than AND, which binds tighter than OR
+    assert parse("a OR b AND c") == ('OR', ('term', 'TS', "a"), ('AND', ('term', 'TS', "b"), ('term', 'TS', "c")))
+    assert parse("a AND b NOT c") == ('AND', ('term', 'TS', "a"), ('NOT', ('term', 'TS', "b"), ('term', 'TS', "c")))
+    assert parse("(a OR b) AND c") == ('AND', ('OR', ('term', 'TS', "a"), ('term', 'TS', "b")), ('term', 'TS', "c"))
+    assert parse("a b") == parse("a AND b")
+
+
+def test_field_scope():
+    # a tag applies up to the next tag, or the end of the parentheses it is in
+    assert parse("TI=(cats OR dogs) fish") == ('AND', ('OR', ('term', 'TI', "cats"), ('term', 'TI', "dogs")), ('term', 'TI', "fish"))
+    assert parse("(TI=cats) fish") == ('AND', ('term', 'TI', "cats"), ('term', 'TS', "fish"))
+    assert parse("TI=cats dogs PY=2007") == ('AND', ('AND', ('term', 'TI', "cats"), ('term', 'TI', "dogs")), ('term', 'PY', "2007"))
+    # whole-value fields swallow the words up to the next operator
+    assert parse("SO=SOCIAL FORCES AND PY=2010") == ('AND', ('term', 'SO', "SOCIAL FORCES"), ('term', 'PY', "2010"))
+    assert parse('TS="social capital"') == ('phrase', 'TS', "social capital")
+
+
+@pytest.mark.parametrize("query", ["XX=cats", "(cats", "cats)", "AND", "TS="])
+def test_syntax_errors(query):
+    with pytest.raises(QuerySyntaxError):
+        parse(query)
+
+
+def test_fields2query():
+    assert fields2query(('TS', ["cats", "dogs"]), 'AND', ('PY', "2007-2010")) == "TS=(cats OR dogs) AND PY=(2007-2010)"
+
+
+def test_tokenize():
+    assert tokenize("Socio-economic Status, 2nd") == ["socio", "economic", "status", "2nd"]
+    assert tokenize(["a b", "C"]) == ["a", "b", "c"]
+
+
+def test_search(write_isi):
+    fname = write_isi("a.isi", [
+        {'UT': "1", 'TI': "Social capital and migration", 'AU': ["Smith, J"], 'SO': "SOCIAL FORCES", 'PY': "2007"},
+        {'UT': "2", 'TI': "Migrant networks", 'AU': ["Smithers, J"], 'SO': "DEMOGRAPHY", 'PY': "2010"},
+        {'UT': "3", 'TI': "Socio-economic status", 'AU': ["Smith, John"], 'SO': "SOCIAL FORCES", 'PY': "2012"},
+    ])
+    I = isiquery.Index()
+    I.build([fname, fname]) #the same file twice is only indexed once
+    assert len(I) == 3
+    assert I.search("migra*") == {"1", "2"}
+    assert I.search("TS=migra* NOT PY=2010") == {"1"}
+    assert I.search("PY=2008-2012") == {"2", "3"}
+    assert I.search("SO=SOCIAL FORCES") == {"1", "3"}
+    assert I.search("AU=Smith") == {"1", "3"}
+    assert I.search("AU=Smith J") == {"1", "3"}
+    assert I.search("socio-economic") == {"3"}
+    assert I.search(('TI', ["capital", "networks"]), 'AND', ('PY', "2007")) == {"1"}
+    assert [r['UT'] for r in I.records("SO=DEMOGRAPHY")] == ["2"]
+    with pytest.raises(QuerySyntaxError):
+        I.search("PY=recent")
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import isiparse
+import isishard
+from isishard import reshard, select, read_catalog, parse_years
+
+
+def paper(ut, year=None, categories=()):
+    r = {'UT': ut, 'TI': "Paper " + ut}
+    if year is not None:
+        r['PY'] = str(year)
+    if categories:
+        r['WC'] = list(categories)
+    return r
+
+
+def uts(files):
+    return sorted(r['UT'] for f in files for r in isiparse.reader(f))
+
+
+def test_reshard_by_year(write_isi, tmp_path):
+    a = write_isi("a.isi", [paper("1", 2007), paper("2", 2008), paper("3")])
+    b = write_isi("b.isi", [paper("4", 2007)])
+    out = str(tmp_path / "shards")
+    catalog = reshard([a, b], out, buffer_lines=3) #flush often, so shards get appended to
+    assert catalog == {("2007", None): ("PY=2007.isi", 2), ("2008", None): ("PY=2008.isi", 1), ("unknown", None): ("PY=unknown.isi", 1)}
+    assert read_catalog(out) == catalog
+    assert uts(select(out, years=range(2007, 2008))) == ["1", "4"]
+    assert uts(select(out)) == ["1", "2", "3", "4"]
+    with pytest.raises(ValueError):
+        list(select(out, categories=["Sociology"]))
+
+
+def test_reshard_by_category(write_isi, tmp_path):
+    a = write_isi("a.isi", [paper("1", 2007, ["Sociology", "Demography"]), paper("2", 2007, ["Demography"]), paper("3", 2007)])
+    out = str(tmp_path / "shards")
+    reshard([a], out, by_category=True)
+    assert uts(select(out, categories=["Sociology"])) == ["1"]
+    assert uts(select(out, categories=[isishard.NO_CATEGORY])) == ["3"]
+
+
+def test_colliding_names_get_their_own_shards(write_isi, tmp_path):
+    # safe_filename() makes both of these "PY=2007_WC=A___B"
+    a = write_isi("a.isi", [paper("1", 2007, ["A & B"]), paper("2", 2007, ["A / B"]), paper("3", 2007, ["A & B"])])
+    out = str(tmp_path / "shards")
+    catalog = reshard([a], out, by_category=True)
+    names = [fname for fname, count in catalog.values()]
+    assert len(set(names)) == 2
+    assert uts(select(out, categories=["A & B"])) == ["1", "3"]
+    assert uts(select(out, categories=["A / B"])) == ["2"]
+    assert len(list(select(out))) == 2
+
+
+def test_refuses_stale_shards(write_isi, tmp_path):
+    a = write_isi("a.isi", [paper("1", 2007)])
+    out = tmp_path / "shards"
+    out.mkdir()
+    (out / "PY=2007.isi").write_text("FN Thomson Reuters Web of Science\nVR 1.0\n")
+    with pytest.raises(FileExistsError):
+        reshard([a], str(out))
+    os.remove(str(out / "PY=2007.isi"))
+    reshard([a], str(out))
+    with pytest.raises(FileExistsError):
+        reshard([a], str(out)) #there's a catalog now
+
+
+def test_parse_years():
+    assert parse_years("2007") == range(2007, 2008)
+    assert parse_years("2007-2010") == range(2007, 2011)
@@ -0,0 +1,66 @@
+import pytest
+
+from isitext import TextIndex, decode
+
+
+def index(*records):
+    T = TextIndex()
+    for r in records:
+        T.add(r)
+    return T
+
+def found(T, query, **kwargs):
+    return sorted(ut for ut, score in T.search(query, k=None, **kwargs))
+
+
+def test_decode_round_trip():
+    T = index({'UT': "1", 'TI': "a b a"}, {'UT': "2", 'TI': "b"})
+    assert list(decode(T.postings["a"])) == [(0, [0, 2])]
+    assert list(decode(T.postings["b"])) == [(0, [1]), (1, [0])]
+    assert T.doclen.tolist() == [3, 1]
+
+
+def test_terms_prefixes_and_phrases():
+    T = index({'UT': "1", 'TI': "Social capital and migration"},
+              {'UT': "2", 'TI': "Capital flows", 'AB': "social networks of migrants"},
+              {'UT': "3", 'TI': "Unrelated"})
+    assert found(T, "capital") == ["1", "2"]
+    assert found(T, "migra*") == ["1", "2"]
+    assert found(T, '"social capital"') == ["1"]
+    assert found(T, '"capital social"') == []
+    assert found(T, 'flows migra*', require_all=True) == ["2"]
+    assert T.search("capital social", k=1)[0][0] == "1"
+
+
+def test_phrases_stay_within_fields_and_keywords():
+    T = index({'UT': "1", 'TI': "about social", 'AB': "capital gains", 'DE': ["social", "capital"]})
+    assert found(T, '"social capital"') == []
+    assert found(T, '"capital gains"') == ["1"]
+
+
+def test_merge_supersedes_duplicates():
+    a = index({'UT': "1", 'TI': "social capital"}, {'UT': "2", 'TI': "migration"})
+    b = index({'UT': "2", 'TI': "social migration with a much longer title"}, {'UT': "3", 'TI': "social"})
+    T = a.merge(b)
+    assert len(T) == 3
+    assert T.df == {"social": 2, "capital": 1, "migration": 1, "with": 0, "a": 0, "much": 0, "longer": 0, "title": 0}
+    assert found(T, "social") == ["1", "3"]
+    assert found(T, "migration") == ["2"]
+    assert found(T, '"social migration"') == []
+
+    # merging a merged index carries its deletions along without counting them twice
+    T = index({'UT': "4", 'TI': "social"}).merge(T)
+    assert len(T) == 4
+    assert T.df["social"] == 3 and T.df["migration"] == 1
+
+    whole = index({'UT': "4", 'TI': "social"}, {'UT': "1", 'TI': "social capital"}, {'UT': "2", 'TI': "migration"}, {'UT': "3", 'TI': "social"})
+    assert dict(T.search("social migration", k=None)) == pytest.approx(dict(whole.search("social migration", k=None)))
+
+
+def test_save_load(tmp_path):
+    T = index({'UT': "1", 'TI': "social capital"}).merge(index({'UT': "1", 'TI': "other"}, {'UT': "2", 'TI': "capital"}))
+    fname = str(tmp_path / "t.bm25")
+    T.save(fname)
+    L = TextIndex.load(fname)
+    assert len(L) == 2 and L.ids == T.ids and L.df == T.df
+    assert L.search("capital", k=None) == T.search("capital", k=None)
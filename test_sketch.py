@@ -0,0 +1,96 @@
+import math
+import pickle
+import random
+from collections import Counter
+
+import pytest
+
+import sketch
+from sketch import HyperLogLog, CountMinSketch, TopK
+
+
+def zipf(n, seed):
+    "n keys with a long tail: a few are very common, most are rare"
+    rng = random.Random(seed)
+    return ["k%d" % int(rng.paretovariate(1.0)) for _ in range(n)]
+
+
+@pytest.mark.parametrize("n", [100, 5000, 50000])
+def test_hyperloglog_error(n):
+    H = HyperLogLog(p=12) #standard error 1.6%
+    H.update("key%d" % i for i in range(n))
+    H.update("key%d" % i for i in range(n)) #repeats don't count
+    assert abs(H.count() - n) < 4 * 1.04 / math.sqrt(H.m) * n + 1
+
+
+def test_hyperloglog_merge_is_union():
+    a, b, both = HyperLogLog(p=10), HyperLogLog(p=10), HyperLogLog(p=10)
+    a.update("a%d" % i for i in range(3000))
+    b.update("a%d" % i for i in range(2000, 6000))
+    both.update("a%d" % i for i in range(6000))
+    assert a.merge(b).registers == both.registers
+    with pytest.raises(ValueError):
+        a.merge(HyperLogLog(p=11))
+
+
+@pytest.mark.parametrize("width", [64, 4096])
+def test_count_min_error(width):
+    keys = zipf(20000, 1)
+    exact = Counter(keys)
+    C = CountMinSketch(width=width, depth=4)
+    C.update(keys)
+    assert (C.rows is None) == (width == 4096) #the big one never filled up enough to need its table
+    bound = math.e / width * len(keys)
+    over = [C[k] - n for k, n in exact.items()]
+    assert min(over) >= 0 #never undercounts
+    # each estimate is within the bound with probability 1 - exp(-depth) = 98%
+    assert sum(o > bound for o in over) <= 0.05 * len(exact)
+    assert C["never seen"] <= bound
+
+
+def test_count_min_merge():
+    a, b = zipf(3000, 1), zipf(30000, 2)
+    for first, second in [(a, b), (b, a), (a, a[:10])]: #dense into sparse, sparse into dense, sparse into sparse
+        x, y = CountMinSketch(width=4096), CountMinSketch(width=4096)
+        x.update(first)
+        y.update(second)
+        merged = CountMinSketch(width=4096)
+        merged.update(first + second)
+        x.merge(y)
+        assert x.total == merged.total
+        assert all(x[k] == merged[k] for k in set(first + second))
+    with pytest.raises(ValueError):
+        x.merge(CountMinSketch(width=512))
+
+
+def test_topk():
+    keys = zipf(50000, 3)
+    exact = Counter(keys)
+    T = TopK(k=20, width=4096)
+    T.update(keys)
+    assert len(T.candidates) == 20
+    assert [k for k, n in T.top(5)] == [k for k, n in exact.most_common(5)]
+    assert all(n >= exact[k] for k, n in T.top())
+    assert len(T._heap) <= 4 * T.k
+
+
+def test_topk_merge():
+    a, b = zipf(20000, 4), zipf(20000, 5)
+    exact = Counter(a + b)
+    x, y = TopK(k=10, width=4096), TopK(k=10, width=4096)
+    x.update(a)
+    y.update(b)
+    x.merge(y)
+    assert [k for k, n in x.top(5)] == [k for k, n in exact.most_common(5)]
+    x.update(["new"] * 100000) #and it carries on adding after a merge
+    assert x.top(1)[0][0] == "new" and x.top(1)[0][1] >= 100000
+
+
+def test_by_field_groups_stay_small(write_isi):
+    records = [{'UT': str(i), 'CR': ["REF %d" % (i % 7), "REF X"], 'WC': ["Category %d" % i]} for i in range(250)]
+    fname = write_isi("a.isi", records)
+    sketches = sketch._sketch_file((fname, 'CR', 'WC', 'topk'))
+    assert len(sketches) == 250
+    assert len(pickle.dumps(sketches)) < 1000000 #not 250 full tables
+    total = sketch.by_field([fname, fname], 'CR', 'WC', kind='topk', processes=1)
+    assert sorted(total["Category 3"].top()) == [("REF 3", 2), ("REF X", 2)]
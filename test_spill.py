@@ -0,0 +1,61 @@
+import os
+import random
+import resource
+from collections import Counter
+
+import pytest
+
+import spill
+from spill import SpillCounter, count_field, _escape, _unescape
+
+
+def keys(n, seed):
+    rng = random.Random(seed)
+    return ["k%d" % rng.randrange(500) for _ in range(n)] + ["tab\there", "new\nline", "back\\slash"]
+
+
+def test_escape_round_trip():
+    for key in ["plain", "a\tb", "a\nb", "a\\tb", "\\", ""]:
+        assert _unescape(_escape(key)) == key
+
+
+def test_counts_across_spills_and_merges(monkeypatch, tmp_path):
+    monkeypatch.setattr(spill, "FANIN", 3)
+    expected = Counter()
+    with SpillCounter(budget=10, partitions=2, tmpdir=str(tmp_path)) as C:
+        for seed in range(5):
+            other = SpillCounter(budget=10, partitions=2, tmpdir=str(tmp_path))
+            other.update(keys(300, seed))
+            C.merge(other)
+            expected.update(keys(300, seed))
+        C.update(keys(50, 99)) #some left in memory
+        expected.update(keys(50, 99))
+        C.add("k1", 5)
+        expected["k1"] += 5
+        assert all(len(runs) <= 3 for runs in C.runs)
+        assert dict(C.items()) == expected
+        assert sum(1 for _ in C) == len(expected)
+        assert [n for k, n in C.top(3)] == [n for k, n in expected.most_common(3)]
+        C.dump(str(tmp_path / "counts.tsv"))
+        assert sum(1 for _ in open(str(tmp_path / "counts.tsv"), encoding="utf-8")) == len(expected)
+    assert os.listdir(str(tmp_path)) == ["counts.tsv"] #close() cleaned up
+
+
+def test_open_files_stay_bounded(tmp_path):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(256, hard), hard))
+    try:
+        with SpillCounter(budget=10, partitions=1, tmpdir=str(tmp_path)) as C:
+            for i in range(300):
+                C.update(["%d.%d" % (i, j) for j in range(10)] + ["common"])
+            counts = dict(C.items())
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert len(counts) == 3001 and counts["common"] == 300
+
+
+def test_count_field(write_isi):
+    a = write_isi("a.isi", [{'UT': "1", 'CR': ["X, 1990", "Y, 1991"]}, {'UT': "2", 'CR': ["X, 1990"]}])
+    b = write_isi("b.isi", [{'UT': "3", 'CR': ["Y, 1991"]}, {'UT': "4"}])
+    with count_field([a, b], 'CR', budget=1, partitions=4, processes=1) as C:
+        assert dict(C.items()) == {"X, 1990": 2, "Y, 1991": 2}
@@ -12,6 +12,8 @@ class BlockReinit:
         logging.debug("blocking reinitialization of super() of %r; extra args: *%s, **%s" % (self, args, kwargs)) #DEBUG
         pass
 
+_wrapped = {} #(mixins..., BlockReinit, base) -> mixed class, see wrapper()
+
 def wrapper(*cls, clone=True):
     """
     Dynamically mix in classes before a given obj's type.
@@ -78,7 +80,11 @@ def wrapper(*cls, clone=True):
     def __new__(obj):
         logging.debug("wrapper.__new__(cls=*%s, obj=%s)" % (cls, obj))
         _cls = cls + (BlockReinit, type(obj))
-        class W(*_cls): pass
+        W = _wrapped.get(_cls)
+        if W is None:
+            # make each mixed class once, not once per object: wrapper() gets used on every HTTP response
+            class W(*_cls): pass
+            _wrapped[_cls] = W
         if clone:
             logging.debug("wrapper.__new__(cls=%s, obj=%s): cloning" % (cls, obj))
             obj = deepcopy(obj)
@@ -196,6 +202,13 @@ def rm(path):
     else:
         os.unlink(path)
 	
+def safe_filename(s):
+    """
+    make s usable as (part of) a file name, by replacing anything that isn't
+    a letter, a digit or one of "-_.=," with an underscore.
+    """
+    return "".join(c if c.isalnum() or c in "-_.=," else "_" for c in s)
+
 def flatten(L):
     """
     flatten a nested list by one level
@@ -203,6 +216,24 @@ def flatten(L):
     return list(chain.from_iterable(L))
 
 
+def parallel_map(f, items, processes=None):
+    """
+    map(f, items), fanned out over a multiprocessing.Pool, yielding results in order.
+    f must be a top-level (picklable) function.
+    processes=None uses one worker per CPU; processes=1 skips the pool entirely,
+    which is handy for debugging and for tiny inputs.
+    """
+    items = list(items)
+    if processes == 1 or len(items) <= 1:
+        for item in items:
+            yield f(item)
+        return
+    from multiprocessing import Pool
+    with Pool(processes) as pool:
+        for result in pool.imap(f, items):
+            yield result
+
+
 def parse_american_int(c):
     """
     Parse an integer, possibly an American-style comma-separated integer.